@@ -38,14 +38,41 @@ yq_val() { # read simple or nested keys; warn when yq missing and nested request
 
 PROFILE="$(yq_val aws_profile "$AUTO_CFG")"
 OWNER="$(yq_val owner "$AUTO_CFG")"
+# an orgs: section fans every module out over those orgs in one process
+if grep -q '^orgs:' "$AUTO_CFG"; then
+  OWNER_ARGS=(--orgs "$AUTO_CFG")
+else
+  OWNER_ARGS=(--owner "$OWNER")
+fi
 REGION="$(yq_val region "$AUTO_CFG")"
 SSM_TOKEN="$(yq_val ssm_token "$AUTO_CFG" || echo "")"
 
+# GitHub App auth when github_app.app_id is set (scripts read GITHUB_APP_* from the env)
+APP_ID="$(yq_val 'github_app.app_id' "$AUTO_CFG" || echo "")"
+if [[ -n "$APP_ID" && "$APP_ID" != "null" ]]; then
+  export GITHUB_APP_ID="$APP_ID"
+  export GITHUB_APP_PRIVATE_KEY="$(yq_val 'github_app.private_key' "$AUTO_CFG")"
+  APP_INST="$(yq_val 'github_app.installation_id' "$AUTO_CFG" || echo "")"
+  if [[ -n "$APP_INST" && "$APP_INST" != "null" ]]; then export GITHUB_APP_INSTALLATION_ID="$APP_INST"; fi
+fi
+
+# run metrics for node-exporter's textfile collector (one .prom file per module)
+METRICS_DIR="$(yq_val metrics_dir "$AUTO_CFG" || echo "")"
+if [[ -n "$METRICS_DIR" && "$METRICS_DIR" != "null" ]]; then export GH_AUTOMATION_METRICS_DIR="$METRICS_DIR"; fi
+
 REPOS_CFG="$(yq_val 'configs.repos'   "$AUTO_CFG" || echo "src/config/repos.yaml")"
 TEAMS_CFG="$(yq_val 'configs.teams'   "$AUTO_CFG" || echo "src/config/teams.yaml")"
 USERS_CFG="$(yq_val 'configs.users'   "$AUTO_CFG" || echo "src/config/users.yaml")"
 SECRETS_CFG="$(yq_val 'configs.secrets' "$AUTO_CFG" || echo "src/config/secrets.yaml")"
 DUMP_DIR="$(yq_val 'configs.dump'     "$AUTO_CFG" || echo "private/github_secrets")"
+DUMP_ARCHIVE="$(yq_val 'configs.dump_archive' "$AUTO_CFG" || echo "")"
+
+# encrypted single-file dump when configs.dump_archive is set, else the plaintext per-secret tree
+if [[ -n "$DUMP_ARCHIVE" && "$DUMP_ARCHIVE" != "null" ]]; then
+  DUMP_ARGS=(--dump-archive "$DUMP_ARCHIVE")
+else
+  DUMP_ARGS=(--dump-dir "$DUMP_DIR")
+fi
 
 usage() {
   cat <<EOF
@@ -54,6 +81,7 @@ GitHub Automation
 Usage:
   $0 dry-run             # simulate repos, secrets, keys, org hooks, teams, users, gpg
   $0 bootstrap           # run all live (repos -> secrets -> keys -> org hooks -> teams -> users -> gpg)
+  $0 bootstrap --resume <run-id>   # resume a failed bootstrap; completed steps are skipped
 
   $0 repos    [--live]   # only repos
   $0 secrets  [--live]   # org+repo+env secrets
@@ -62,10 +90,19 @@ Usage:
   $0 teams    [--live]
   $0 users    [--live]
   $0 gpg      [--live]
+  $0 webhook  [--live]   # org webhook receiver -> targeted repo/team reconciles (owner: only)
+  $0 drift    [--live]   # audit-log drift report; --live reconciles touched objects and advances the cursor
+  $0 import   [--force]  # write repos/teams/secrets YAML for the existing org under private/import/<owner>
+  $0 snapshot [refresh|unprotected|access <repo>|sql "<query>"]   # local SQLite copy of org state (default: refresh)
 
 Notes:
 - In live mode, secrets/keys/orghooks/gpg accept --skip-missing (wired by default in bootstrap).
 - Dry-run never touches SSM/files and does not write dumps.
+- With an orgs: section in automation.yaml each module reconciles all listed orgs concurrently
+  (per-org token/config overrides, [owner]-prefixed output, combined per-org summary).
+- After a snapshot refresh, repos.py/teams.py/cleanup.py --dry-run --snapshot plan against it without API calls.
+- Live runs journal each step under private/state/runs/<run-id>.jsonl; scripts also accept
+  --resume <run-id> and --continue-on-error (collect failures into a final report).
 EOF
 }
 
@@ -83,60 +120,70 @@ pyrun_or_dry() {
 
 case "${1:-}" in
   dry-run)
-    "$PYTHON" "$PY/repos.py"    --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$REPOS_CFG"     --dry-run
-    "$PYTHON" "$PY/secrets.py"  --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG"  --dump-dir "$DUMP_DIR" --dry-run
-    "$PYTHON" "$PY/ssh_keys.py" --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG"  --dry-run
-    "$PYTHON" "$PY/org.py"      --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG"  --dry-run
-    "$PYTHON" "$PY/teams.py"    --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$TEAMS_CFG"    --dry-run
-    "$PYTHON" "$PY/users.py"    --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$USERS_CFG"    --dry-run
+    "$PYTHON" "$PY/repos.py"    "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$REPOS_CFG"     --dry-run
+    "$PYTHON" "$PY/secrets.py"  "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG"  "${DUMP_ARGS[@]}" --dry-run
+    "$PYTHON" "$PY/ssh_keys.py" "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG"  --dry-run
+    "$PYTHON" "$PY/org.py"      "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG"  --dry-run
+    "$PYTHON" "$PY/teams.py"    "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$TEAMS_CFG"    --dry-run
+    "$PYTHON" "$PY/users.py"    "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$USERS_CFG"    --dry-run
     "$PYTHON" "$PY/gpg.py"      --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG"                   --dry-run
     ;;
 
   bootstrap)
-    pyrun_or_dry true "$PY/repos.py"    --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$REPOS_CFG"
-    pyrun_or_dry true "$PY/secrets.py"  --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" --dump-dir "$DUMP_DIR" --skip-missing
-    pyrun_or_dry true "$PY/ssh_keys.py" --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" --skip-missing
-    pyrun_or_dry true "$PY/org.py"      --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" --skip-missing
-    pyrun_or_dry true "$PY/teams.py"    --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$TEAMS_CFG"
-    pyrun_or_dry true "$PY/users.py"    --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$USERS_CFG"
-    pyrun_or_dry true "$PY/gpg.py"      --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" --skip-missing
+    # one journal for the whole bootstrap; `bootstrap --resume <run-id>` skips completed steps
+    if [[ "${2:-}" == "--resume" && -n "${3:-}" ]]; then
+      RUN=(--resume "$3")
+    else
+      RUN=(--run-id "$(date +%Y%m%d-%H%M%S)-bootstrap")
+    fi
+    # gpg.py acts on the token's user, not per org: with an orgs: section the org modules journal
+    # to <run-id>-<owner>, so there is no <run-id> journal for gpg to resume (its uploads skip existing keys)
+    GPG_RUN=("${RUN[@]}")
+    [[ "${OWNER_ARGS[0]}" == "--orgs" ]] && GPG_RUN=()
+    pyrun_or_dry true "$PY/repos.py"    "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$REPOS_CFG" "${RUN[@]}"
+    pyrun_or_dry true "$PY/secrets.py"  "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" "${DUMP_ARGS[@]}" --skip-missing "${RUN[@]}"
+    pyrun_or_dry true "$PY/ssh_keys.py" "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" --skip-missing "${RUN[@]}"
+    pyrun_or_dry true "$PY/org.py"      "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" --skip-missing "${RUN[@]}"
+    pyrun_or_dry true "$PY/teams.py"    "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$TEAMS_CFG" "${RUN[@]}"
+    pyrun_or_dry true "$PY/users.py"    "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$USERS_CFG" "${RUN[@]}"
+    pyrun_or_dry true "$PY/gpg.py"      --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" --skip-missing ${GPG_RUN[@]+"${GPG_RUN[@]}"}
     ;;
 
   repos)
-    pyrun_or_dry "${2:-}" "$PY/repos.py"    --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$REPOS_CFG" --allow-unprotect
+    pyrun_or_dry "${2:-}" "$PY/repos.py"    "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$REPOS_CFG" --allow-unprotect
     ;;
 
   secrets)
     # if live, append --skip-missing so absent SSM/file refs don't abort the run
     if is_live "${2:-}"; then
-      "$PYTHON" "$PY/secrets.py" --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" --dump-dir "$DUMP_DIR" --skip-missing
+      "$PYTHON" "$PY/secrets.py" "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" "${DUMP_ARGS[@]}" --skip-missing
     else
-      "$PYTHON" "$PY/secrets.py" --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" --dump-dir "$DUMP_DIR" --dry-run
+      "$PYTHON" "$PY/secrets.py" "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" "${DUMP_ARGS[@]}" --dry-run
     fi
     ;;
 
   keys)
     if is_live "${2:-}"; then
-      "$PYTHON" "$PY/ssh_keys.py" --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" --skip-missing
+      "$PYTHON" "$PY/ssh_keys.py" "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" --skip-missing
     else
-      "$PYTHON" "$PY/ssh_keys.py" --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" --dry-run
+      "$PYTHON" "$PY/ssh_keys.py" "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" --dry-run
     fi
     ;;
 
   orghooks)
     if is_live "${2:-}"; then
-      "$PYTHON" "$PY/org.py" --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" --skip-missing
+      "$PYTHON" "$PY/org.py" "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" --skip-missing
     else
-      "$PYTHON" "$PY/org.py" --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" --dry-run
+      "$PYTHON" "$PY/org.py" "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$SECRETS_CFG" --dry-run
     fi
     ;;
 
   teams)
-    pyrun_or_dry "${2:-}" "$PY/teams.py"    --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$TEAMS_CFG"
+    pyrun_or_dry "${2:-}" "$PY/teams.py"    "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$TEAMS_CFG"
     ;;
 
   users)
-    pyrun_or_dry "${2:-}" "$PY/users.py"    --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$USERS_CFG"
+    pyrun_or_dry "${2:-}" "$PY/users.py"    "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --config "$USERS_CFG"
     ;;
 
   gpg)
@@ -147,6 +194,32 @@ case "${1:-}" in
     fi
     ;;
 
+  webhook)
+    pyrun_or_dry "${2:-}" "$PY/webhook.py"  --owner "$OWNER" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --repos "$REPOS_CFG" --teams "$TEAMS_CFG" --secrets "$SECRETS_CFG"
+    ;;
+
+  drift)
+    if is_live "${2:-}"; then
+      "$PYTHON" "$PY/drift.py" "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --repos "$REPOS_CFG" --teams "$TEAMS_CFG" --secrets "$SECRETS_CFG" --reconcile
+    else
+      "$PYTHON" "$PY/drift.py" "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" --repos "$REPOS_CFG" --teams "$TEAMS_CFG" --secrets "$SECRETS_CFG"
+    fi
+    ;;
+
+  import)
+    shift
+    "$PYTHON" "$PY/import_org.py" "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN" "$@"
+    ;;
+
+  snapshot)
+    shift
+    if [[ "${1:-refresh}" == "refresh" ]]; then
+      "$PYTHON" "$PY/snapshot.py" refresh "${OWNER_ARGS[@]}" --profile "$PROFILE" --region "$REGION" --ssm-token "$SSM_TOKEN"
+    else
+      "$PYTHON" "$PY/snapshot.py" "$@" --owner "$OWNER"
+    fi
+    ;;
+
   *)
     usage; exit 1 ;;
 esac
@@ -0,0 +1,132 @@
+"""
+GitHub App authentication.
+
+An AppToken signs a short-lived JWT with the App's private key, exchanges it
+for an installation token and hands that out wherever a PAT string was used:
+str(tok) / f"Bearer {tok}" always yield a token with at least REFRESH_MARGIN
+seconds left, refreshing transparently during long runs. Tokens are cached in
+process and on disk (<state-dir>/tokens/, mode 0600) so child reconciles and
+back-to-back modules reuse one token until it nears expiry.
+
+Configured through the environment:
+  GITHUB_APP_ID                 App id
+  GITHUB_APP_PRIVATE_KEY        PEM ref: file:/ssm:/literal:
+  GITHUB_APP_INSTALLATION_ID    optional; looked up from the owner otherwise
+  GITHUB_API_URL                optional API base (GHES or a local stand-in)
+"""
+import os, time, threading, calendar, requests
+from _journal import STATE_DIR
+
+API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+REFRESH_MARGIN = 300  # seconds of validity a handed-out token must still have
+
+def _read_ref(ref, region="us-east-2", profile=None):
+    if ref.startswith("file:"):
+        with open(ref.split("file:", 1)[1], "r", encoding="utf-8") as f:
+            return f.read()
+    if ref.startswith("literal:"):
+        return ref.split("literal:", 1)[1]
+    if ref.startswith("ssm:"):
+        import boto3
+        session = boto3.Session(profile_name=profile, region_name=region) if profile else boto3.Session(region_name=region)
+        return session.client("ssm").get_parameter(Name=ref.split("ssm:", 1)[1], WithDecryption=True)["Parameter"]["Value"]
+    raise SystemExit(f"ERROR: unsupported GitHub App key ref: {ref}")
+
+def _parse_ts(s):
+    return calendar.timegm(time.strptime(s, "%Y-%m-%dT%H:%M:%SZ"))
+
+class AppToken:
+    def __init__(self, app_id, key_ref, owner=None, installation_id=None, api=API_URL,
+                 state_dir=STATE_DIR, region="us-east-2", profile=None):
+        if not owner and not installation_id:
+            raise SystemExit("ERROR: GitHub App auth needs an owner or GITHUB_APP_INSTALLATION_ID")
+        self.app_id = str(app_id)
+        self.key_ref = key_ref
+        self.owner = owner
+        self.installation_id = installation_id
+        self.api = api.rstrip("/")
+        self.region, self.profile = region, profile
+        self.path = os.path.join(state_dir, "tokens", f"app-{self.app_id}-{installation_id or owner}.json")
+        self._key = None
+        self._token, self._expires = None, 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, owner=None, region="us-east-2", profile=None):
+        """One AppToken per comma-separated GITHUB_APP_ID (keys/installation ids in the same order); [] if unset."""
+        split = lambda v: [x.strip() for x in (os.getenv(v) or "").split(",") if x.strip()]
+        ids, keys, insts = split("GITHUB_APP_ID"), split("GITHUB_APP_PRIVATE_KEY"), split("GITHUB_APP_INSTALLATION_ID")
+        if ids and len(keys) != len(ids):
+            raise SystemExit("ERROR: GITHUB_APP_PRIVATE_KEY needs one key ref per GITHUB_APP_ID")
+        if insts and len(insts) != len(ids):
+            raise SystemExit("ERROR: GITHUB_APP_INSTALLATION_ID needs one id per GITHUB_APP_ID")
+        return [cls(a, k, owner=owner, installation_id=(insts[i] if insts else None), region=region, profile=profile)
+                for i, (a, k) in enumerate(zip(ids, keys))]
+
+    def __str__(self):
+        return self.get()
+
+    def __format__(self, spec):
+        return format(self.get(), spec)
+
+    def __repr__(self):
+        return f"AppToken(app_id={self.app_id}, installation={self.installation_id or self.owner})"
+
+    def jwt(self):
+        import jwt
+        if self._key is None:
+            self._key = _read_ref(self.key_ref, self.region, self.profile)
+        now = int(time.time())
+        # iat backdated for clock drift; GitHub caps exp at 10 minutes
+        return jwt.encode({"iat": now - 60, "exp": now + 540, "iss": self.app_id}, self._key, algorithm="RS256")
+
+    def _app_h(self):
+        return {"Authorization": f"Bearer {self.jwt()}", "Accept": "application/vnd.github+json"}
+
+    def _installation(self):
+        if self.installation_id:
+            return self.installation_id
+        for kind in ("orgs", "users"):
+            r = requests.get(f"{self.api}/{kind}/{self.owner}/installation", headers=self._app_h())
+            if r.status_code == 200:
+                self.installation_id = str(r.json()["id"])
+                return self.installation_id
+            if r.status_code != 404:
+                break
+        raise SystemExit(f"ERROR: GitHub App {self.app_id} is not installed on {self.owner}: {r.status_code} {r.text}")
+
+    def login(self):
+        """The login the App acts as (events and audit entries show "<slug>[bot]")."""
+        r = requests.get(f"{self.api}/app", headers=self._app_h())
+        return f"{r.json()['slug']}[bot]" if r.ok else None
+
+    def _fresh(self, expires):
+        return expires - time.time() > REFRESH_MARGIN
+
+    def get(self):
+        with self._lock:
+            if self._token and self._fresh(self._expires):
+                return self._token
+            from _common import load_json
+            cached = load_json(self.path, {}) or {}
+            if cached.get("token") and self._fresh(cached.get("expires", 0)):
+                self._token, self._expires = cached["token"], cached["expires"]
+                self.installation_id = self.installation_id or cached.get("installation_id")
+                return self._token
+            inst = self._installation()
+            r = requests.post(f"{self.api}/app/installations/{inst}/access_tokens", headers=self._app_h())
+            if r.status_code != 201:
+                raise SystemExit(f"ERROR: installation token for app {self.app_id} failed: {r.status_code} {r.text}")
+            data = r.json()
+            self._token, self._expires = data["token"], _parse_ts(data["expires_at"])
+            self._save(inst)
+            print(f"AUTH: GitHub App {self.app_id} installation {inst} token valid until {data['expires_at']}")
+            return self._token
+
+    def _save(self, inst):
+        from _common import atomic_write_json
+        atomic_write_json(self.path, {"token": self._token, "expires": self._expires, "installation_id": inst})
+        try:
+            os.chmod(self.path, 0o600)
+        except OSError:
+            pass
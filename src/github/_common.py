@@ -1,49 +1,360 @@
-import os, sys, yaml
-from github import Github
+import os, sys, yaml, json, time, tempfile, functools, threading, contextvars, requests
+from concurrent.futures import ThreadPoolExecutor
+from github import Github, Auth, UnknownObjectException
 import boto3
 from botocore.exceptions import ClientError
+from _metrics import METRICS, CountingRetry
 
 def load_yaml(path):
     with open(path, 'r', encoding='utf-8') as f:
         return yaml.safe_load(f) or {}
 
-def get_token(ssm_name=None, region="us-east-2", profile=None, dry_run=False):
+def load_json(path, default=None):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+def atomic_write_json(path, data):
+    """Write JSON via temp file + rename so readers never see a partial file."""
+    atomic_write_text(path, json.dumps(data, indent=2, sort_keys=True))
+
+def atomic_write_yaml(path, data, header=""):
+    atomic_write_text(path, header + yaml.safe_dump(data, sort_keys=False, default_flow_style=None, width=120))
+
+def atomic_write_text(path, text):
+    d = os.path.dirname(path) or "."
+    os.makedirs(d, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=d, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try: os.unlink(tmp)
+        except OSError: pass
+        raise
+
+# ---------- token pool ----------
+_pools = []
+
+class TokenPool:
+    """
+    Several identities (PATs or App installations) used as one token. Each
+    str()/f"Bearer {pool}" hands out the member with the most core rate-limit
+    budget left; budgets come from X-RateLimit-* headers seen on gh_http and
+    are decremented per hand-out in between (PyGithub calls are not observed).
+    After pin(pool, key) the thread keeps using the member first
+    picked for `key`, so one repo's write sequence comes from one identity.
+    """
+    def __init__(self, tokens):
+        self.members = [{"tok": t, "limit": 5000, "remaining": 5000, "reset": 0} for t in tokens]
+        self._issued = {}  # token string -> member, to attribute response headers
+        self._pins = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        _pools.append(self)
+
+    def __len__(self):
+        return len(self.members)
+
+    def _best(self, now):
+        for m in self.members:
+            if m["reset"] and m["reset"] <= now:
+                m["remaining"], m["reset"] = m["limit"], 0
+        return max(self.members, key=lambda m: m["remaining"])
+
+    def _pick(self):
+        key, now = getattr(self._local, "pin", None), time.time()
+        with self._lock:
+            m = self._best(now) if key is None else self._pins.get(key)
+            if key is not None and (m is None or (m["remaining"] <= 0 and m["reset"] > now)):
+                m = self._pins[key] = self._best(now)
+            m["remaining"] -= 1
+        tok = str(m["tok"])  # an AppToken may refresh here; outside the pool lock
+        with self._lock:
+            self._issued[tok] = m
+        return tok
+
+    def __str__(self):
+        return self._pick()
+
+    def __format__(self, spec):
+        return format(self._pick(), spec)
+
+    def __repr__(self):
+        return f"TokenPool({len(self.members)} identities)"
+
+    def observe(self, r):
+        auth = r.request.headers.get("Authorization", "")
+        m = self._issued.get(auth.split(" ", 1)[-1])
+        h = r.headers
+        if m is None or "X-RateLimit-Remaining" not in h or h.get("X-RateLimit-Resource", "core") != "core":
+            return
+        with self._lock:
+            m["remaining"] = int(h["X-RateLimit-Remaining"])
+            m["limit"] = int(h.get("X-RateLimit-Limit", m["limit"]))
+            m["reset"] = int(h.get("X-RateLimit-Reset", 0))
+
+    def budget(self):
+        return [(i, m["remaining"], m["limit"]) for i, m in enumerate(self.members)]
+
+def pin(token, key):
+    """
+    Route this thread's following requests through the pool member pinned to
+    `key` (e.g. a repo name) until the next pin; key=None unpins. No-op for a
+    single token.
+    """
+    if isinstance(token, TokenPool):
+        token._local.pin = key
+
+def user_token(token):
+    """
+    The identity for /user endpoints (GPG keys, ...): a pool's first member,
+    so a run's listing and writes, and later runs, all act as one user. A
+    single token is returned as is.
+    """
+    return token.members[0]["tok"] if isinstance(token, TokenPool) else token
+
+def _observe_rate_limit(r, *a, **kw):
+    for pool in _pools:
+        pool.observe(r)
+
+def _record_request(r, *a, **kw):
+    METRICS.request(r.request.method, r.url, r.status_code, r.headers)
+
+# shared session for raw REST calls: keep-alive, rate-limit headers feed the token pools and run metrics
+gh_http = requests.Session()
+gh_http.hooks["response"] += [_observe_rate_limit, _record_request]
+
+class ContextPool(ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor running each task in a copy of the submitter's
+    contextvars, so a worker's output carries its org's [owner] tag in a
+    multi-org run.
+    """
+    def submit(self, fn, /, *a, **kw):
+        return super().submit(contextvars.copy_context().run, fn, *a, **kw)
+
+_prefetch_pool = None
+_prefetch_lock = threading.Lock()
+
+def _prefetcher():
+    global _prefetch_pool
+    with _prefetch_lock:
+        if _prefetch_pool is None:
+            _prefetch_pool = ContextPool(4, thread_name_prefix="gh-prefetch")
+        return _prefetch_pool
+
+def paginate(url, token, params=None, key=None, allow_404=False):
+    """
+    Yield the items of a REST list endpoint, following Link rel="next".
+    The next page is requested in the background while the caller works on the
+    current one, so at most two pages are held; breaking out of the loop stops
+    paging. `key` names the list in object-shaped responses ("environments",
+    "secrets", ...). With allow_404 a missing parent yields nothing.
+    """
+    def _get(u, p, h):
+        return gh_http.get(u, headers=h, params=p)
+    # headers are built on the caller's thread so token pins/refreshes apply
+    hdrs = lambda: {"Authorization": f"Bearer {token}", "Accept": "application/vnd.github+json",
+                    "X-GitHub-Api-Version": "2022-11-28"}
+    pool = _prefetcher()
+    fut = pool.submit(_get, url, {"per_page": 100, **(params or {})}, hdrs())
+    try:
+        while fut is not None:
+            r = fut.result()
+            fut = None
+            if r.status_code == 404 and allow_404:
+                return
+            if r.status_code != 200:
+                raise SystemExit(f"GET {r.url} failed: {r.status_code} {r.text}")
+            nxt = r.links.get("next", {}).get("url")
+            if nxt:
+                fut = pool.submit(_get, nxt, None, hdrs())  # the next link carries the query
+            body = r.json()
+            yield from (body.get(key) or []) if key else body
+    finally:
+        if fut is not None:
+            fut.cancel()
+
+def _ssm_token(ssm, name, region):
+    try:
+        resp = ssm.get_parameter(Name=name, WithDecryption=True)
+        return resp["Parameter"]["Value"]
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") == "ParameterNotFound":
+            raise SystemExit(
+                f"ERROR: SSM param '{name}' not found in region '{region}'.\n"
+                f"Fix: aws ssm put-parameter --name {name} --type SecureString --value <PAT> --overwrite --region {region}\n"
+                f"Or set env var GITHUB_TOKEN (or GH_TOKEN) for a quick test."
+            )
+        raise
+
+_ssm_lock = threading.Lock()
+
+def _one_or_pool(tokens):
+    return tokens[0] if len(tokens) == 1 else TokenPool(tokens)
+
+def get_token(ssm_name=None, region="us-east-2", profile=None, dry_run=False, owner=None):
     """
     Returns a token for live calls.
     In dry-run, if no env token is set, returns a dummy string without touching SSM.
+    With GITHUB_APP_ID set and an owner given, returns an AppToken: an
+    installation token that str()/f-strings refresh transparently.
+    Comma-separated GITHUB_TOKEN / --ssm-token / GITHUB_APP_ID values give a
+    TokenPool spreading requests over all of them.
     """
     # Prefer env var
     token = os.getenv("GITHUB_TOKEN") or os.getenv("GH_TOKEN")
     if token:
-        return token
+        return _one_or_pool([t.strip() for t in token.split(",") if t.strip()])
 
     if dry_run:
         # Do not touch SSM in dry-run; return a placeholder
         return "DRY-RUN"
 
-    # Live mode: optionally use a profile and fetch from SSM
-    if profile:
-        boto3.setup_default_session(profile_name=profile, region_name=region)
-    else:
-        boto3.setup_default_session(region_name=region)
+    if owner:
+        from _app_auth import AppToken
+        apps = AppToken.from_env(owner, region=region, profile=profile)
+        if apps:
+            return _one_or_pool(apps)
 
     if not ssm_name:
         raise RuntimeError("No token provided: set GITHUB_TOKEN/GH_TOKEN or supply --ssm-token")
 
-    ssm = boto3.client("ssm", region_name=region)
-    try:
-        resp = ssm.get_parameter(Name=ssm_name, WithDecryption=True)
-        return resp["Parameter"]["Value"]
-    except ClientError as e:
-        if e.response.get("Error", {}).get("Code") == "ParameterNotFound":
-            raise SystemExit(
-                f"ERROR: SSM param '{ssm_name}' not found in region '{region}'.\n"
-                f"Fix: aws ssm put-parameter --name {ssm_name} --type SecureString --value <PAT> --overwrite --region {region}\n"
-                f"Or set env var GITHUB_TOKEN (or GH_TOKEN) for a quick test."
-            )
-        raise
+    # Live mode: optionally use a profile and fetch from SSM
+    # (boto3's default session is process-wide; orgs fanned out in threads take turns)
+    with _ssm_lock:
+        if profile:
+            boto3.setup_default_session(profile_name=profile, region_name=region)
+        else:
+            boto3.setup_default_session(region_name=region)
+        ssm = boto3.client("ssm", region_name=region)
+        return _one_or_pool([_ssm_token(ssm, n.strip(), region) for n in ssm_name.split(",") if n.strip()])
+
+class _ProviderAuth(Auth.Auth):
+    """PyGithub auth reading the token per request, so AppToken refreshes apply."""
+    def __init__(self, provider):
+        self.provider = provider
+
+    @property
+    def token_type(self):
+        return "Bearer"
+
+    @property
+    def token(self):
+        return str(self.provider)
+
+def token_env(token):
+    """
+    Environment for child scripts. PATs are passed down as GITHUB_TOKEN; an
+    AppToken is not (it would expire in long-lived parents) -- children get
+    the GITHUB_APP_* variables and share the on-disk token cache instead.
+    """
+    toks = [m["tok"] for m in token.members] if isinstance(token, TokenPool) else [token]
+    return {"GITHUB_TOKEN": ",".join(toks)} if all(isinstance(t, str) for t in toks) else {}
+
+def automation_logins(token):
+    """Logins our writes are attributed to (one per pool member), used to ignore our own changes."""
+    out = set()
+    for t in (token.members if isinstance(token, TokenPool) else [{"tok": token}]):
+        t = t["tok"]
+        if not isinstance(t, str):
+            login = t.login()
+        else:
+            r = gh_http.get("https://api.github.com/user", headers={"Authorization": f"Bearer {t}", "Accept": "application/vnd.github+json"})
+            login = r.json().get("login") if r.ok else None
+        if login:
+            out.add(login)
+    return out
 
 def gh_client(owner, token):
-    gh = Github(login_or_token=token, per_page=100)
+    auth = Auth.Token(token) if isinstance(token, str) else _ProviderAuth(token)
+    gh = Github(auth=auth, per_page=100, retry=CountingRetry())
     org = gh.get_organization(owner)
+    from _orgs import track
+    track("gh", gh)  # rate limit left, for the multi-org summary
     return gh, org
+
+class ObjectCache:
+    """
+    Run-scoped memo of fetched repos/teams/users, keyed by name/slug/login, so
+    each object costs at most one GET per run (misses are remembered as None).
+    The *_handle() methods build an object from its URL alone, without any
+    request, for paths that only write to it; they reuse a fetched object when
+    one is cached. Writes that rename or delete an object should forget() it.
+    """
+    def __init__(self, gh, org):
+        self.gh, self.org = gh, org
+        self.owner = org.login
+        self.api = "https://api.github.com"
+        self._objs = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+        METRICS.cache("objects", lambda: (self.hits, self.misses), org=self.owner)
+
+    def _get(self, kind, key, fetch):
+        with self._lock:
+            if (kind, key) in self._objs:
+                self.hits += 1
+                return self._objs[kind, key]
+            self.misses += 1
+        try:
+            obj = fetch(key)
+        except UnknownObjectException:
+            obj = None
+        with self._lock:
+            return self._objs.setdefault((kind, key), obj)
+
+    def repo(self, name):
+        return self._get("repo", name, self.org.get_repo)
+
+    def team(self, slug):
+        return self._get("team", slug, self.org.get_team_by_slug)
+
+    def user(self, login):
+        return self._get("user", login, self.gh.get_user)
+
+    def put(self, kind, key, obj):
+        with self._lock:
+            self._objs[kind, key] = obj
+
+    def forget(self, kind, key):
+        with self._lock:
+            self._objs.pop((kind, key), None)
+
+    def _cached(self, kind, key):
+        with self._lock:
+            return self._objs.get((kind, key))
+
+    def repo_handle(self, name):
+        from github.Repository import Repository
+        return self._cached("repo", name) or self.gh.create_from_raw_data(Repository, {
+            "url": f"{self.api}/repos/{self.owner}/{name}", "name": name,
+            "full_name": f"{self.owner}/{name}", "owner": {"login": self.owner}})
+
+    def team_handle(self, slug):
+        from github.Team import Team
+        return self._cached("team", slug) or self.gh.create_from_raw_data(Team, {
+            "url": f"{self.api}/orgs/{self.owner}/teams/{slug}", "slug": slug, "name": slug,
+            "organization": {"login": self.owner, "url": f"{self.api}/orgs/{self.owner}"}})
+
+    def user_handle(self, login):
+        from github.NamedUser import NamedUser
+        return self._cached("user", login) or self.gh.create_from_raw_data(NamedUser, {
+            "login": login, "url": f"{self.api}/users/{login}"})
+
+@functools.lru_cache(maxsize=None)
+def lookup_id(kind, owner, name, token):
+    """Numeric id of an org team (kind="team", by slug) or a user (kind="user", by login); cached per run."""
+    url = f"https://api.github.com/orgs/{owner}/teams/{name}" if kind == "team" else f"https://api.github.com/users/{name}"
+    r = gh_http.get(url, headers={"Authorization": f"Bearer {token}", "Accept": "application/vnd.github+json"})
+    if r.status_code != 200:
+        raise SystemExit(f"ERROR: {kind} '{name}' not found in {owner}: {r.status_code} {r.text}")
+    return r.json()["id"]
+
+METRICS.cache("lookup_id", lambda: lookup_id.cache_info()[:2])
@@ -0,0 +1,131 @@
+"""
+Encrypted single-file secret dump.
+
+Layout:  MAGIC | u64 header length | header JSON | sealed entries
+header = {"v": 1, "entries": {"repo/<repo>/<NAME>": {"o": offset, "n": length, "d": mac}}}
+
+Each entry is sealed on its own with a NaCl SecretBox, and offsets are
+relative to the end of the header, so reading one secret means reading the
+header and one entry. The header holds only scope/name paths (already in
+secrets.yaml) and a keyed MAC of each value, which lets a run re-seal only
+the entries whose value changed and copy the rest byte for byte. The file
+is rewritten via temp file + rename, so readers never see a partial archive.
+"""
+import os, json, struct, base64, hashlib, tempfile, threading, stat
+from nacl import secret, utils
+
+MAGIC = b"GHSDUMP1"
+
+def load_key(ref, region="us-east-2", profile=None):
+    """32-byte key, base64 encoded, from literal:/file:/ssm:."""
+    if ref.startswith("literal:"):
+        raw = ref.split("literal:", 1)[1]
+    elif ref.startswith("file:"):
+        with open(ref.split("file:", 1)[1], "r", encoding="utf-8") as f:
+            raw = f.read()
+    elif ref.startswith("ssm:"):
+        import boto3
+        session = boto3.Session(profile_name=profile, region_name=region) if profile else boto3.Session(region_name=region)
+        raw = session.client("ssm").get_parameter(Name=ref.split("ssm:", 1)[1], WithDecryption=True)["Parameter"]["Value"]
+    else:
+        raise ValueError(f"Unsupported dump key ref: {ref}")
+    key = base64.b64decode(raw.strip())
+    if len(key) != secret.SecretBox.KEY_SIZE:
+        raise ValueError(f"dump key must be {secret.SecretBox.KEY_SIZE} bytes (base64)")
+    return key
+
+def keygen(path):
+    if os.path.exists(path):
+        raise SystemExit(f"ERROR: {path} already exists; refusing to overwrite a dump key")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, stat.S_IRUSR | stat.S_IWUSR)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(base64.b64encode(utils.random(secret.SecretBox.KEY_SIZE)).decode("ascii") + "\n")
+
+def _read_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a secret dump archive")
+    (n,) = struct.unpack(">Q", f.read(8))
+    return json.loads(f.read(n)), len(MAGIC) + 8 + n
+
+def read_index(path):
+    """Entry paths in the archive; needs no key."""
+    with open(path, "rb") as f:
+        return sorted(_read_header(f)[0]["entries"])
+
+class DumpArchive:
+    def __init__(self, path, key):
+        self.path = path
+        self.box = secret.SecretBox(key)
+        self.mac_key = hashlib.blake2b(b"ghsdump-index-mac", key=key, digest_size=32).digest()
+        self.pending = {}
+        self._lock = threading.Lock()
+
+    def _mac(self, entry, value):
+        return hashlib.blake2b(entry.encode("utf-8") + b"\0" + value.encode("utf-8"), key=self.mac_key, digest_size=16).hexdigest()
+
+    def put(self, parts, name, value):
+        with self._lock:
+            self.pending["/".join([*parts, name])] = value
+
+    def get(self, entry):
+        with open(self.path, "rb") as f:
+            header, base = _read_header(f)
+            e = header["entries"].get(entry)
+            if e is None:
+                raise KeyError(entry)
+            f.seek(base + e["o"])
+            return self.box.decrypt(f.read(e["n"])).decode("utf-8")
+
+    def commit(self, keep=None):
+        """
+        Merge pending values into the archive; returns (updated, unchanged, total, removed).
+        With `keep` (every entry path the config still manages), older entries
+        outside it are dropped; entries in it that were not put() this run
+        (resumed or skipped) are carried over.
+        """
+        try:
+            old_f = open(self.path, "rb")
+            old, old_base = _read_header(old_f)
+        except FileNotFoundError:
+            old_f, old, old_base = None, {"entries": {}}, 0
+        kept = set(old["entries"]) if keep is None else set(old["entries"]) & set(keep)
+        removed = len(old["entries"]) - len(kept)
+        try:
+            entries, blobs, off, updated = {}, [], 0, 0
+            for entry in sorted(kept | set(self.pending)):
+                prev = old["entries"].get(entry)
+                value = self.pending.get(entry)
+                mac = self._mac(entry, value) if value is not None else prev["d"]
+                if prev is not None and prev["d"] == mac:
+                    old_f.seek(old_base + prev["o"])
+                    blob = old_f.read(prev["n"])
+                else:
+                    blob = self.box.encrypt(value.encode("utf-8"))
+                    updated += 1
+                entries[entry] = {"o": off, "n": len(blob), "d": mac}
+                blobs.append(blob)
+                off += len(blob)
+        finally:
+            if old_f:
+                old_f.close()
+        total = len(entries)
+        if not updated and not removed and old_f is not None:
+            return 0, total, total, 0  # nothing changed; leave the file alone
+        header = json.dumps({"v": 1, "entries": entries}, sort_keys=True).encode("utf-8")
+        d = os.path.dirname(self.path) or "."
+        os.makedirs(d, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=d, prefix=".tmp-dump-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(MAGIC + struct.pack(">Q", len(header)) + header)
+                for blob in blobs:
+                    f.write(blob)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            try: os.unlink(tmp)
+            except OSError: pass
+            raise
+        return updated, total - updated, total, removed
@@ -0,0 +1,122 @@
+"""
+Batched GraphQL writes.
+
+MutationBatch packs many aliased mutations into one request:
+
+  mutation($i0: ArchiveRepositoryInput!, $i1: ArchiveRepositoryInput!) {
+    m0: archiveRepository(input: $i0) { clientMutationId }
+    m1: archiveRepository(input: $i1) { clientMutationId }
+  }
+
+GitHub runs the aliases in order and reports failures per alias (errors[].path
+starts with the alias), so every queued mutation keeps its own result and a
+failed alias is mapped back to the object that queued it. Requests are capped
+at MAX_MUTATIONS aliases: each mutation costs 5 points against the secondary
+limit (2,000 points/minute) and large bodies risk the 10s server timeout.
+Node ids for the inputs come from repo_nodes()/team_nodes(), which resolve
+up to MAX_LOOKUPS names per aliased query.
+"""
+import json
+from _common import gh_http
+
+GRAPHQL = "https://api.github.com/graphql"
+MAX_MUTATIONS = 50
+MAX_LOOKUPS = 100
+
+def _h(tok): return {"Authorization": f"Bearer {tok}", "Content-Type": "application/json"}
+
+def graphql(tok, query, variables=None):
+    """Returns (data, errors); raises SystemExit only when the request itself fails."""
+    r = gh_http.post(GRAPHQL, headers=_h(tok), data=json.dumps({"query": query, "variables": variables or {}}))
+    if r.status_code != 200:
+        raise SystemExit(f"GraphQL request failed: {r.status_code} {r.text}")
+    body = r.json()
+    return body.get("data") or {}, body.get("errors") or []
+
+def _chunks(items, n):
+    for i in range(0, len(items), n):
+        yield items[i:i + n]
+
+def _lookup(tok, names, field, make):
+    out = {}
+    for chunk in _chunks(sorted(set(names)), MAX_LOOKUPS):
+        aliases = {f"n{i}": n for i, n in enumerate(chunk)}
+        body = "\n".join(f"  {a}: {make(n)}" for a, n in aliases.items())
+        data, errors = graphql(tok, f"query {{\n{body}\n}}")
+        for err in errors:
+            if err.get("type") != "NOT_FOUND":
+                raise SystemExit(f"GraphQL lookup failed: {err.get('message')}")
+        for a, n in aliases.items():
+            node = data.get(a)
+            out[n] = node.get(field) if field and node else node
+    return out
+
+def repo_nodes(tok, owner, names, fields="id"):
+    """name -> {id, <fields>} (None for repos that do not exist)."""
+    return _lookup(tok, names, None, lambda n: f"repository(owner: {json.dumps(owner)}, name: {json.dumps(n)}) {{ {fields} }}")
+
+def team_nodes(tok, owner, slugs):
+    """slug -> {id} (None for missing teams)."""
+    return _lookup(tok, slugs, "team", lambda s: f"organization(login: {json.dumps(owner)}) {{ team(slug: {json.dumps(s)}) {{ id }} }}")
+
+class MutationBatch:
+    def __init__(self, tok, size=MAX_MUTATIONS):
+        self.tok = tok
+        self.size = max(1, size)
+        self.queue = []    # (key, mutation, input_type, input, fields)
+        self.results = {}  # key -> (data, error)
+
+    def add(self, key, mutation, input_type, inp, fields="clientMutationId"):
+        self.queue.append((key, mutation, input_type, inp, fields))
+
+    def __len__(self):
+        return len(self.queue)
+
+    def fail(self, key, error):
+        """Record a failure for a key that could not be queued (e.g. its node does not exist)."""
+        self.results[key] = (None, error)
+
+    def run(self):
+        """Send everything queued; returns {key: (data, error)} with error None on success."""
+        queue, self.queue = self.queue, []
+        for chunk in _chunks(queue, self.size):
+            decls, body, variables, keys = [], [], {}, {}
+            for i, (key, mutation, input_type, inp, fields) in enumerate(chunk):
+                decls.append(f"$i{i}: {input_type}!")
+                body.append(f"  m{i}: {mutation}(input: $i{i}) {{ {fields} }}")
+                variables[f"i{i}"] = inp
+                keys[f"m{i}"] = key
+            query = f"mutation({', '.join(decls)}) {{\n" + "\n".join(body) + "\n}"
+            try:
+                data, errors = graphql(self.tok, query, variables)
+            except SystemExit as e:
+                data, errors = {}, [{"message": str(e)}]
+            failed = {}
+            for err in errors:
+                path = err.get("path") or []
+                targets = [path[0]] if path and path[0] in keys else list(keys)  # no path: the whole request failed
+                for alias in targets:
+                    failed.setdefault(alias, err.get("message", "GraphQL error"))
+            for alias, key in keys.items():
+                if alias in failed or data.get(alias) is None:
+                    self.results[key] = (None, failed.get(alias, "no result returned"))
+                else:
+                    self.results[key] = (data[alias], None)
+        return self.results
+
+    def result(self, key):
+        """Data for a key, raising its error: use as a journal step so each object is recorded."""
+        data, err = self.results.get(key, (None, "mutation was not sent"))
+        if err is not None:
+            raise SystemExit(f"GraphQL {key}: {err}")
+        return data if data is not None else True
+
+def journal_results(journal, batch, steps):
+    """
+    Record (obj, action, key, ok_message) steps from batch results, successes
+    first so an abort on the first failure still journals everything applied.
+    """
+    failed = lambda s: batch.results.get(s[2], (None, "not sent"))[1] is not None
+    for obj, action, key, msg in sorted(steps, key=failed):
+        if journal.step(obj, action, batch.result, key) is not None and msg:
+            print(msg)
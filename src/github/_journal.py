@@ -0,0 +1,156 @@
+"""
+Run journal for the GitHub automation scripts.
+
+Every live write is recorded as a (module, object, action) step in an
+append-only JSONL file under the state dir. A later run started with
+`--resume <run-id>` skips the steps that already completed and retries only
+the failed/remaining ones. With `--continue-on-error` failures are collected
+and reported at the end instead of aborting on the first one.
+"""
+import os, json, time, threading, uuid
+from _metrics import METRICS, add_metrics_args
+
+STATE_DIR = os.getenv("GH_AUTOMATION_STATE", "private/state")
+
+def add_journal_args(ap):
+    ap.add_argument("--resume", default=None, metavar="RUN_ID", help="Resume a previous run; completed steps are skipped")
+    ap.add_argument("--run-id", default=None, help="Journal id for this run (default: generated); share it across modules to resume a bootstrap")
+    ap.add_argument("--continue-on-error", action="store_true", help="Collect failures into a final report instead of stopping")
+    ap.add_argument("--state-dir", default=STATE_DIR, help="Where run journals and other local state are kept")
+    add_metrics_args(ap)
+
+class StepSkipped(Exception):
+    """Raised inside a step that had nothing to write; journaled as skipped so --resume retries it."""
+
+def _new_run_id():
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+def _outcome(stage):
+    if stage.startswith("create"):
+        return "created"
+    if stage.startswith(("delete", "remove", "unprotect", "revoke")):
+        return "deleted"
+    if stage.startswith("list"):
+        return "listed"  # a read journaled only so its failure is recorded
+    return "updated"
+
+class RunJournal:
+    def __init__(self, module, run_id=None, resume=False, continue_on_error=False, state_dir=STATE_DIR, enabled=True, owner=None):
+        self.module = module
+        self.owner = owner
+        self.run_id = run_id or _new_run_id()
+        self.continue_on_error = continue_on_error
+        self.enabled = enabled
+        self.path = os.path.join(state_dir, "runs", f"{self.run_id}.jsonl")
+        self.completed = set()
+        self.failures = []
+        self.counts = {"ok": 0, "skipped": 0, "failed": 0}
+        self._lock = threading.Lock()
+        if not enabled:
+            return
+        if resume:
+            if not os.path.exists(self.path):
+                raise SystemExit(f"ERROR: no journal for run '{self.run_id}' at {self.path}")
+            self._load()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        verb = "resuming" if resume else "starting"
+        print(f"RUN: {verb} {module} run-id={self.run_id} (journal: {self.path})")
+
+    @classmethod
+    def from_args(cls, module, args):
+        journal = cls(
+            module,
+            run_id=args.resume or args.run_id,
+            resume=bool(args.resume),
+            continue_on_error=args.continue_on_error,
+            state_dir=args.state_dir,
+            enabled=not getattr(args, "dry_run", False),
+            owner=getattr(args, "owner", None),
+        )
+        if journal.enabled:  # dry runs leave the last live run's metrics in place
+            METRICS.configure(module, getattr(args, "metrics_dir", None), journal.owner)
+        from _orgs import track
+        track("journal", journal)  # per-org step counts for a multi-org summary
+        return journal
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # torn trailing line from a crash
+                if rec.get("module") == self.module and rec.get("status") == "ok":
+                    self.completed.add((rec["object"], rec["action"]))
+
+    def _record(self, obj, action, status, error=None):
+        rec = {"ts": time.time(), "module": self.module, "object": obj, "action": action, "status": status}
+        if error:
+            rec["error"] = error
+        line = json.dumps(rec) + "\n"
+        with self._lock:
+            # one write + fsync per step: a crash leaves at most a torn last line
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def done(self, obj, action):
+        return (obj, action) in self.completed
+
+    def step(self, obj, action, fn, *a, **kw):
+        """
+        Run fn(*a, **kw) as one journaled step. Returns fn's result, or None
+        when the step was skipped (already done) or failed under --continue-on-error.
+        """
+        if not self.enabled:
+            return fn(*a, **kw)
+        kind, stage = obj.split(":", 1)[0], action.split(":", 1)[0]
+        if self.done(obj, action):
+            with self._lock:
+                self.counts["skipped"] += 1
+            METRICS.count(kind, "skipped", org=self.owner)
+            print(f"SKIP: {obj} {action} (completed in run {self.run_id})")
+            return None
+        start = time.time()
+        try:
+            result = fn(*a, **kw)
+        except StepSkipped as e:
+            self._record(obj, action, "skipped", str(e) or None)
+            with self._lock:
+                self.counts["skipped"] += 1
+            METRICS.count(kind, "skipped", org=self.owner)
+            return None
+        except (Exception, SystemExit) as e:
+            METRICS.timed(stage, time.time() - start, self.owner)
+            METRICS.count(kind, "failed", org=self.owner)
+            err = str(e) or e.__class__.__name__
+            self._record(obj, action, "failed", err)
+            with self._lock:
+                self.counts["failed"] += 1
+                self.failures.append((obj, action, err))
+            if not self.continue_on_error:
+                print(f"RUN: failed at {obj} {action}; resume with --resume {self.run_id}")
+                raise
+            print(f"WARN: {obj} {action} failed: {err}")
+            return None
+        METRICS.timed(stage, time.time() - start, self.owner)
+        METRICS.count(kind, _outcome(stage), org=self.owner)
+        self._record(obj, action, "ok")
+        with self._lock:
+            self.counts["ok"] += 1
+            self.completed.add((obj, action))
+        return result
+
+    def finish(self):
+        """Print the run summary; returns a process exit code."""
+        if not self.enabled:
+            return 0
+        c = self.counts
+        print(f"RUN: {self.module} run-id={self.run_id} ok={c['ok']} skipped={c['skipped']} failed={c['failed']}")
+        for obj, action, err in self.failures:
+            print(f"  FAILED: {obj} {action}: {err}")
+        if self.failures:
+            print(f"RUN: retry the failed steps with --resume {self.run_id}")
+            return 1
+        return 0
@@ -0,0 +1,241 @@
+"""
+Run metrics in the Prometheus text format, for node-exporter's textfile
+collector: with --metrics-dir (or GH_AUTOMATION_METRICS_DIR) each module
+writes <dir>/github_automation_<module>.prom when the process exits, via
+temp file + rename so the collector never reads a partial file.
+
+  github_automation_run_duration_seconds         whole run
+  github_automation_last_run_timestamp_seconds   when it ended
+  github_automation_stage_duration_seconds       journal steps by action, plus explicit stages
+  github_automation_api_requests_total           by method, route template and status
+  github_automation_api_retries_total            PyGithub retries (rate limits, 5xx)
+  github_automation_rate_limit_remaining         last X-RateLimit-Remaining seen, by resource
+  github_automation_token_budget_remaining       per token pool member
+  github_automation_objects_total                created/updated/deleted/unchanged/failed/skipped/drifted
+  github_automation_cache_{hits,misses}_total    plus cache_hit_ratio
+  github_automation_org_run_{duration_seconds,success}   per org in a multi-org run
+
+Requests made through gh_http are seen by a response hook; PyGithub's are
+read from its own debug log records, so no request path is wrapped. Routes
+keep only GitHub's static path words (/repos/*/*/environments/*/secrets/*),
+which keeps label cardinality bounded; the org comes from the URL, falling
+back to the org whose thread made the request.
+"""
+import os, re, time, atexit, logging, tempfile, threading
+from contextlib import contextmanager
+from github.GithubRetry import GithubRetry
+
+METRICS_DIR = os.getenv("GH_AUTOMATION_METRICS_DIR")
+PREFIX = "github_automation_"
+
+# static path segments kept verbatim in route labels; everything else becomes *
+ROUTE_WORDS = {
+    "repos", "orgs", "users", "user", "teams", "actions", "secrets", "variables", "public-key", "repositories",
+    "environments", "deployment-branch-policies", "branches", "protection", "required_status_checks",
+    "required_pull_request_reviews", "restrictions", "enforce_admins", "hooks", "keys", "rulesets",
+    "memberships", "members", "invitations", "collaborators", "gpg_keys", "installation", "installations",
+    "access_tokens", "app", "audit-log", "events", "topics", "generate", "contents", "git", "refs",
+    "graphql", "rate_limit", "pulls", "vulnerability-alerts", "automated-security-fixes",
+}
+
+HELP = {
+    "run_duration_seconds": ("gauge", "Wall time of the run"),
+    "last_run_timestamp_seconds": ("gauge", "Unix time the run ended"),
+    "stage_duration_seconds": ("gauge", "Seconds spent per stage (journal action or explicit phase)"),
+    "stage_runs_total": ("counter", "Times a stage ran"),
+    "api_requests_total": ("counter", "GitHub API requests by route template and status"),
+    "api_retries_total": ("counter", "Requests retried by PyGithub"),
+    "rate_limit_remaining": ("gauge", "Last X-RateLimit-Remaining seen"),
+    "token_budget_remaining": ("gauge", "Rate-limit budget left per token pool member"),
+    "objects_total": ("counter", "Managed objects by outcome"),
+    "cache_hits_total": ("counter", "Cache hits"),
+    "cache_misses_total": ("counter", "Cache misses"),
+    "cache_hit_ratio": ("gauge", "Cache hits / lookups"),
+    "org_run_duration_seconds": ("gauge", "Wall time per org in a multi-org run"),
+    "org_run_success": ("gauge", "1 when the org's run exited 0"),
+}
+
+_ORG_IN_PATH = re.compile(r"^/(?:repos|orgs)/([^/]+)")
+
+def route(url):
+    """(route template, org or None) for an API URL or path."""
+    path = re.sub(r"^https?://[^/]+", "", url or "").split("?", 1)[0]
+    if path.startswith("/api/v3/"):
+        path = path[len("/api/v3"):]  # GHES prefix
+    m = _ORG_IN_PATH.match(path)
+    segs = [s if s in ROUTE_WORDS else "*" for s in path.strip("/").split("/") if s]
+    return "/" + "/".join(segs), (m.group(1) if m else None)
+
+def _esc(v):
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class RunMetrics:
+    def __init__(self):
+        self.start = time.time()
+        self.module = None
+        self.path = None
+        self.values = {}   # (name, sorted labels) -> value
+        self.caches = {}   # (name, org) -> callable returning (hits, misses)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hooked = False
+
+    # ---- setup ----
+    def configure(self, module, metrics_dir=None, owner=None):
+        """Enable the export for this process (first module name wins); binds owner to this thread."""
+        if owner:
+            self._local.org = owner
+        metrics_dir = metrics_dir or METRICS_DIR
+        if not metrics_dir:
+            return
+        with self._lock:
+            if self.path is not None:
+                return
+            self.module = module
+            self.path = os.path.join(metrics_dir, f"{PREFIX}{module}.prom")
+        self._hook_pygithub()
+        atexit.register(self.write)
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def org(self):
+        return getattr(self._local, "org", None) or ""
+
+    def _hook_pygithub(self):
+        if self._hooked:
+            return
+        self._hooked = True
+        log = logging.getLogger("github.Requester")
+        log.addHandler(_RequesterLog(self))
+        log.setLevel(logging.DEBUG)
+        log.propagate = False  # the handler passes INFO and up on, so PyGithub's console output is unchanged
+
+    # ---- recording ----
+    def _key(self, name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+    def inc(self, name, n=1, **labels):
+        if not self.enabled:
+            return
+        k = self._key(name, labels)
+        with self._lock:
+            self.values[k] = self.values.get(k, 0) + n
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.values[self._key(name, labels)] = value
+
+    @contextmanager
+    def stage(self, name, org=None):
+        t = time.time()
+        try:
+            yield
+        finally:
+            self.timed(name, time.time() - t, org)
+
+    def timed(self, stage, secs, org=None):
+        org = org or self.org()
+        self.inc("stage_duration_seconds", secs, org=org, stage=stage)
+        self.inc("stage_runs_total", org=org, stage=stage)
+
+    def count(self, kind, result, n=1, org=None):
+        """Managed objects by outcome: created, updated, deleted, unchanged, failed, skipped or drifted."""
+        self.inc("objects_total", n, org=org or self.org(), kind=kind, result=result)
+
+    def cache(self, name, stats, org=None):
+        """Register a cache; stats() returns (hits, misses) and is read when the file is written."""
+        with self._lock:
+            self.caches[name, org] = stats
+
+    def request(self, method, url, status, headers, org=None):
+        if not self.enabled:
+            return
+        path, url_org = route(url)
+        org = url_org or org or self.org()
+        self.inc("api_requests_total", method=method.upper(), route=path, status=status, org=org)
+        remaining = headers.get("X-RateLimit-Remaining") or headers.get("x-ratelimit-remaining")
+        if remaining is not None:
+            resource = headers.get("X-RateLimit-Resource") or headers.get("x-ratelimit-resource") or "core"
+            self.set("rate_limit_remaining", int(remaining), org=org, resource=resource)
+
+    def retry(self, method, url):
+        self.inc("api_retries_total", method=(method or "").upper(), route=route(url)[0])
+
+    # ---- output ----
+    def render(self):
+        from _common import _pools
+        now = time.time()
+        with self._lock:
+            values = dict(self.values)
+            caches = dict(self.caches)
+        values[self._key("run_duration_seconds", {})] = now - self.start
+        values[self._key("last_run_timestamp_seconds", {})] = now
+        for p, pool in enumerate(_pools):
+            for i, remaining, _ in pool.budget():
+                values[self._key("token_budget_remaining", {"pool": p, "member": i})] = remaining
+        for (name, org), stats in caches.items():
+            hits, misses = stats()
+            lbl = {"cache": name, "org": org}
+            values[self._key("cache_hits_total", lbl)] = hits
+            values[self._key("cache_misses_total", lbl)] = misses
+            if hits + misses:
+                values[self._key("cache_hit_ratio", lbl)] = hits / (hits + misses)
+        out = []
+        for name in sorted({n for n, _ in values}):
+            kind, text = HELP.get(name, ("gauge", name))
+            out.append(f"# HELP {PREFIX}{name} {text}")
+            out.append(f"# TYPE {PREFIX}{name} {kind}")
+            for (n, labels), v in sorted(values.items()):
+                if n != name:
+                    continue
+                lbl = ",".join(f'{k}="{_esc(val)}"' for k, val in (("module", self.module),) + labels)
+                out.append(f"{PREFIX}{name}{{{lbl}}} {round(v, 6) if isinstance(v, float) else v}")
+        return "\n".join(out) + "\n"
+
+    def write(self):
+        if not self.enabled:
+            return
+        d = os.path.dirname(self.path) or "."
+        os.makedirs(d, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=d, prefix=".tmp-metrics-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.render())
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp, 0o644)  # mkstemp is 0600; the collector may run as another user
+            os.replace(tmp, self.path)
+        except BaseException:
+            try: os.unlink(tmp)
+            except OSError: pass
+            raise
+
+class _RequesterLog(logging.Handler):
+    """Counts PyGithub requests from its debug record: (verb, scheme, host, url, hdrs, input, status, resp hdrs, body)."""
+    def __init__(self, metrics):
+        super().__init__(logging.DEBUG)
+        self.metrics = metrics
+
+    def emit(self, record):
+        if record.levelno >= logging.INFO:
+            logging.getLogger("github").handle(record)
+            return
+        a = record.args
+        if isinstance(a, tuple) and len(a) == 9 and isinstance(a[6], int):
+            self.metrics.request(a[0], a[3], a[6], a[7] or {})
+
+METRICS = RunMetrics()
+
+def add_metrics_args(ap):
+    ap.add_argument("--metrics-dir", default=METRICS_DIR, help="Write run metrics (Prometheus textfile) here")
+
+class CountingRetry(GithubRetry):
+    """PyGithub's default retry policy, counting each retry it makes."""
+    def increment(self, method=None, url=None, *a, **kw):
+        retry = super().increment(method, url, *a, **kw)
+        METRICS.retry(method, url)
+        return retry
@@ -0,0 +1,155 @@
+"""
+Multi-org fan-out: one invocation reconciles several orgs concurrently.
+
+  repos.py --owner org-a,org-b ...          # same flags for every org
+  repos.py --orgs src/config/automation.yaml
+
+An `orgs:` entry names the owner and may override any of the module's flags
+for that org (ssm_token, config, dump_dir, ...), which is how each org gets
+its own token. Every org runs the module's normal main() in its own thread
+with its own args, so tokens/pools, object caches and journals are per org;
+journals get a per-org run id (<run-id>-<owner>) so --resume picks up each
+org where it stopped. Output lines are prefixed with [owner], also those
+printed by a module's worker pools (_common.ContextPool), and a combined
+summary (result, duration, journal counts, rate limit left) closes the run.
+"""
+import sys, time, threading, contextvars, argparse, traceback
+from concurrent.futures import ThreadPoolExecutor
+from _common import load_yaml
+from _metrics import METRICS
+
+_ctx = threading.local()
+_tag = contextvars.ContextVar("org_tag", default=None)  # copied into worker pools by ContextPool
+
+def add_org_args(ap):
+    ap.add_argument("--orgs", default=None, help="YAML with an orgs: list (owner + per-org flag overrides); --owner then selects a subset")
+    ap.add_argument("--org-workers", type=int, default=4, help="Orgs reconciled at the same time")
+
+def multi_org(args):
+    if not args.owner and not args.orgs:
+        raise SystemExit("ERROR: --owner (one org or several, comma-separated) or --orgs is required")
+    return bool(args.orgs) or "," in args.owner
+
+def track(key, value):
+    """Record a per-org detail (journal, client) for the summary; no-op outside a fan-out."""
+    res = getattr(_ctx, "result", None)
+    if res is not None:
+        res[key] = value
+
+def org_entries(args):
+    wanted = [o.strip() for o in (args.owner or "").split(",") if o.strip()]
+    if not args.orgs:
+        return [{"owner": o} for o in wanted]
+    entries = []
+    for e in (load_yaml(args.orgs).get("orgs") or []):
+        e = {"owner": e} if isinstance(e, str) else dict(e)
+        if not wanted or e.get("owner") in wanted:
+            entries.append(e)
+    missing = set(wanted) - {e.get("owner") for e in entries}
+    if missing:
+        raise SystemExit(f"ERROR: {', '.join(sorted(missing))} not in orgs: of {args.orgs}")
+    return entries
+
+class _Prefixed:
+    """
+    stdout that writes whole lines only, tagged with [owner] when the writing
+    org thread (or a ContextPool worker it submitted to) has a tag; partial
+    lines are buffered per thread and tag so orgs never split each other's lines.
+    """
+    def __init__(self, out):
+        self.out = out
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def tag(self, owner):
+        _tag.set(owner)
+
+    def write(self, s):
+        tag = _tag.get()
+        bufs = self._local.__dict__.setdefault("bufs", {})
+        *lines, bufs[tag] = (bufs.get(tag, "") + s).split("\n")
+        if lines:
+            with self._lock:
+                self.out.write("".join(f"[{tag}] {l}\n" if tag else f"{l}\n" for l in lines))
+        return len(s)
+
+    def close_tag(self):
+        if self._local.__dict__.get("bufs", {}).get(_tag.get()):
+            self.write("\n")
+        _tag.set(None)
+
+    def flush(self):
+        self.out.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.out, name)
+
+def _org_args(args, entry, run_id):
+    a = argparse.Namespace(**vars(args))
+    for k, v in entry.items():
+        k = k.replace("-", "_")
+        if not hasattr(a, k):
+            raise SystemExit(f"ERROR: orgs: entry for {entry.get('owner')} sets unknown option '{k}'")
+        setattr(a, k, v)
+    a.orgs = None
+    if hasattr(a, "run_id"):
+        if a.resume:
+            a.resume = f"{a.resume}-{a.owner}"
+        else:
+            a.run_id = f"{run_id}-{a.owner}"
+    return a
+
+def fan_out(module, main, args):
+    """Run main(args) once per org, concurrently; returns the worst exit code."""
+    from _journal import _new_run_id
+    if not getattr(args, "dry_run", False):
+        METRICS.configure(module, getattr(args, "metrics_dir", None))
+    base = getattr(args, "run_id", None) or _new_run_id()
+    jobs = [_org_args(args, e, base) for e in org_entries(args)]  # bad overrides fail before anything runs
+    out = _Prefixed(sys.stdout)
+    results = []
+
+    def one(a):
+        res = _ctx.result = {"owner": a.owner, "code": 1, "error": None}
+        results.append(res)
+        out.tag(a.owner)
+        if METRICS.enabled:
+            METRICS.configure(module, owner=a.owner)
+        start = time.time()
+        try:
+            code = main(a)
+            res["code"] = code if isinstance(code, int) else 0
+        except SystemExit as e:
+            res["code"] = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            if not isinstance(e.code, (int, type(None))):
+                res["error"] = str(e.code)
+                print(e.code)
+        except Exception as e:
+            res["error"] = f"{e.__class__.__name__}: {e}"
+            traceback.print_exc(file=sys.stdout)
+        finally:
+            res["secs"] = time.time() - start
+            METRICS.set("org_run_duration_seconds", res["secs"], org=a.owner)
+            METRICS.set("org_run_success", int(res["code"] == 0), org=a.owner)
+            out.close_tag()
+            _ctx.result = None
+
+    print(f"ORGS: {module} over {', '.join(a.owner for a in jobs)} ({min(args.org_workers, len(jobs))} at a time)")
+    sys.stdout = out
+    try:
+        with ThreadPoolExecutor(max(1, args.org_workers)) as ex:
+            list(ex.map(one, jobs))
+    finally:
+        sys.stdout = out.out
+
+    worst = 0
+    print(f"SUMMARY: {module} across {len(results)} orgs")
+    for res in sorted(results, key=lambda r: r["owner"]):
+        j, gh = res.get("journal"), res.get("gh")
+        counts = " ".join(f"{k}={v}" for k, v in j.counts.items()) if j is not None and j.enabled else "-"
+        rate = "%d/%d" % gh.rate_limiting if gh is not None else "-"
+        status = "ok" if res["code"] == 0 else f"failed({res['code']})"
+        print(f"  {res['owner']}: {status} {res['secs']:.1f}s steps[{counts}] rate_left={rate}"
+              + (f" error={res['error']}" if res["error"] else ""))
+        worst = max(worst, res["code"] or 0)
+    return worst
@@ -0,0 +1,60 @@
+"""
+Targeted reconcile jobs shared by webhook.py and drift.py: run one module's
+script for just the objects that changed.
+"""
+import os, sys, subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# kind -> (script, args attribute holding its config, accepts --only)
+# org.py manages only org webhooks, a single object, so a full run is already targeted
+SCRIPTS = {
+    "repo":       ("repos.py",    "repos",   True),
+    "team":       ("teams.py",    "teams",   True),
+    "secret":     ("secrets.py",  "secrets", True),
+    "hook":       ("org.py",      "secrets", False),
+    "deploy_key": ("ssh_keys.py", "secrets", True),
+}
+ORG_SCOPE = ":org"  # secrets.py --only value selecting org-level secrets
+
+def managed_objects(repos_cfg, teams_cfg, secrets_cfg=None):
+    repos = set()
+    for spec in repos_cfg.get("repos", []) or []:
+        repos.add(spec["name"])
+        if spec.get("rename_from"):
+            repos.add(spec["rename_from"])
+    teams = {t["name"] for t in teams_cfg.get("teams", []) or []}
+    sc = secrets_cfg or {}
+    secrets = set((sc.get("repos") or {}).keys()) | set((sc.get("envs") or {}).keys())
+    if sc.get("org"):
+        secrets.add(ORG_SCOPE)
+    return {
+        "repo": repos,
+        "team": teams,
+        "secret": secrets,
+        "hook": {"org"} if sc.get("org_webhooks") else set(),
+        "deploy_key": set((sc.get("deploy_keys") or {}).keys()),
+    }
+
+def make_runner(args, env):
+    """Returns run(kind, names) -> bool; honours args.dry_run by printing the command only."""
+    def run(kind, names):
+        script, cfg_attr, only = SCRIPTS[kind]
+        cmd = [sys.executable, os.path.join(HERE, script), "--owner", args.owner, "--config", getattr(args, cfg_attr),
+               "--region", args.region, "--ssm-token", args.ssm_token]
+        if args.profile:
+            cmd += ["--profile", args.profile]
+        if only:
+            for n in names:
+                cmd += ["--only", n]
+        if kind == "repo":
+            cmd.append("--full")  # the event is the change signal; do not trust fingerprints
+        if args.dry_run:
+            print(f"DRY: reconcile {kind} {names}: {' '.join(cmd[1:])}")
+            return True
+        print(f"JOB: reconcile {kind} {names}")
+        r = subprocess.run(cmd, env=env)
+        if r.returncode != 0:
+            print(f"WARN: reconcile {kind} {names} exited {r.returncode}")
+        return r.returncode == 0
+    return run
@@ -0,0 +1,128 @@
+"""
+Local SQLite snapshot of an org's state, written by snapshot.py and read by
+the dry-run paths of repos.py / teams.py / cleanup.py (--snapshot).
+
+One table holds every object as JSON, keyed by kind, parent and name:
+
+  kind          parent          name      data
+  repo          ""              <repo>    repo listing entry
+  branch        <repo>          <branch>  branch listing entry (has "protected")
+  protection    <repo>          <branch>  branch protection
+  ruleset       <repo> | ":org" <name>    repo ruleset (full), org ruleset summary
+  environment   <repo>          <env>     environment
+  branch_policy <repo>/<env>    <pattern> custom deployment branch policy
+  hook          <repo> | ":org" <id>      webhook (config.url)
+  deploy_key    <repo>          <title>   deploy key
+  secret        <repo> | ":org" <NAME>    secret name + dates (never values); org: + selected_repos
+  env_secret    <repo>/<env>    <NAME>
+  team          ""              <slug>    team
+  team_member   <slug>          <login>   {"login", "role"}
+  team_repo     <slug>          <repo>    {"permission", "role_name"}
+
+  SELECT name FROM objects r WHERE kind = 'repo' AND NOT EXISTS
+    (SELECT 1 FROM objects p WHERE p.kind = 'protection' AND p.parent = r.name AND p.name = 'main');
+
+The etags table remembers the ETag of every single-page list/object fetched,
+so a refresh sends If-None-Match and keeps the stored rows on 304 (which
+does not count against the rate limit).
+"""
+import os, json, time, sqlite3
+from _journal import STATE_DIR
+
+ORG = ":org"  # parent of org-level hooks, rulesets and secrets
+REPO_KINDS = ("branch", "protection", "ruleset", "environment", "branch_policy", "hook", "deploy_key", "secret", "env_secret")
+TEAM_KINDS = ("team_member", "team_repo")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+  kind TEXT NOT NULL, parent TEXT NOT NULL, name TEXT NOT NULL, data TEXT NOT NULL,
+  PRIMARY KEY (kind, parent, name)
+);
+CREATE INDEX IF NOT EXISTS objects_name ON objects (kind, name);
+CREATE TABLE IF NOT EXISTS etags (url TEXT PRIMARY KEY, etag TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+def default_path(owner, state_dir=STATE_DIR):
+    return os.path.join(state_dir, "snapshots", f"{owner}.sqlite")
+
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    @classmethod
+    def open(cls, owner, state_dir=STATE_DIR, path=None):
+        """An existing snapshot for reading; SystemExit when there is none."""
+        path = path if path and path != "auto" else default_path(owner, state_dir)
+        if not os.path.exists(path):
+            raise SystemExit(f"ERROR: no snapshot at {path}; run snapshot.py --owner {owner} refresh first")
+        snap = cls(path)
+        print(f"SNAPSHOT: planning against {path} (taken {snap.taken()})")
+        return snap
+
+    # ---- reading ----
+    def taken(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'refreshed_at'").fetchone()
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(float(row[0]))) if row else "never"
+
+    def get(self, kind, parent, name):
+        row = self.db.execute("SELECT data FROM objects WHERE kind = ? AND parent = ? AND name = ?", (kind, parent, name)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def children(self, kind, parent):
+        """{name: data} of one kind under a parent."""
+        rows = self.db.execute("SELECT name, data FROM objects WHERE kind = ? AND parent = ?", (kind, parent))
+        return {n: json.loads(d) for n, d in rows}
+
+    def repo(self, name):
+        return self.get("repo", "", name)
+
+    def team(self, slug):
+        return self.get("team", "", slug)
+
+    def load(self):
+        """Everything as {(kind, parent): {name: data}}, for a refresh to diff against."""
+        out = {}
+        for kind, parent, name, data in self.db.execute("SELECT kind, parent, name, data FROM objects"):
+            out.setdefault((kind, parent), {})[name] = json.loads(data)
+        return out
+
+    def etags(self):
+        return dict(self.db.execute("SELECT url, etag FROM etags"))
+
+    def query(self, sql, params=()):
+        cur = self.db.execute(sql, params)
+        return [d[0] for d in cur.description or []], cur.fetchall()
+
+    # ---- writing (one thread) ----
+    def replace(self, kind, parent, rows):
+        """Make {name: data} the complete set of `kind` under `parent`."""
+        self.db.execute("DELETE FROM objects WHERE kind = ? AND parent = ?", (kind, parent))
+        self.db.executemany("INSERT INTO objects (kind, parent, name, data) VALUES (?, ?, ?, ?)",
+                            [(kind, parent, n, json.dumps(d, sort_keys=True)) for n, d in rows.items()])
+
+    def drop_children(self, kinds, parent):
+        """Forget everything under a repo/team that no longer exists."""
+        for kind in kinds:
+            self.db.execute("DELETE FROM objects WHERE kind = ? AND (parent = ? OR parent LIKE ?)", (kind, parent, parent + "/%"))
+
+    def drop_etags(self, prefix):
+        self.db.execute("DELETE FROM etags WHERE url LIKE ?", (prefix + "%",))
+
+    def set_etag(self, url, etag):
+        if etag:
+            self.db.execute("INSERT OR REPLACE INTO etags (url, etag) VALUES (?, ?)", (url, etag))
+        else:
+            self.db.execute("DELETE FROM etags WHERE url = ?", (url,))
+
+    def mark_refreshed(self):
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('refreshed_at', ?)", (str(time.time()),))
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
@@ -1,14 +1,20 @@
 #!/usr/bin/env python3
-import argparse, sys, json, requests
-from _common import load_yaml, get_token, gh_client
-from github import GithubException
+import argparse, os, sys, json
+from _common import load_yaml, load_json, atomic_write_json, get_token, gh_client, gh_http, paginate, ObjectCache, user_token
+from _journal import RunJournal, add_journal_args
+from _metrics import METRICS
+from _graphql import MutationBatch, MAX_MUTATIONS, repo_nodes, journal_results
+from _orgs import add_org_args, multi_org, fan_out
+from _snapshot import Snapshot
+from repos import compile_org_rulesets
+from github import GithubException, UnknownObjectException
 
 API = "https://api.github.com"
 H = {"Accept": "application/vnd.github+json", "X-GitHub-Api-Version": "2022-11-28"}
 def _h(tok): return {"Authorization": f"Bearer {tok}", **H}
 
 def _del(url, tok, ok=(204,200,202,404)):
-    r = requests.delete(url, headers=_h(tok))
+    r = gh_http.delete(url, headers=_h(tok))
     if r.status_code not in ok:
         raise SystemExit(f"DELETE {url} -> {r.status_code} {r.text}")
 
@@ -26,23 +32,27 @@ def remove_rulesets(owner, repo, names, tok, dry):
     if dry:
         print(f"DRY: delete rulesets {names} on {owner}/{repo}")
         return
-    r = requests.get(url, headers=_h(tok)); r.raise_for_status()
-    for rs in r.json():
-        if rs.get("name") in names:
-            _del(f"{url}/{rs['id']}", tok); print(f"OK: deleted ruleset '{rs['name']}' on {repo}")
+    # collect first: deleting while paging would shift later pages
+    for rs in [rs for rs in paginate(url, tok) if rs.get("name") in names]:
+        _del(f"{url}/{rs['id']}", tok); print(f"OK: deleted ruleset '{rs['name']}' on {repo}")
 
 def delete_repo_webhooks(owner, repo, urls, tok, dry):
     if dry:
         for u in urls: print(f"DRY: delete repo webhook {u} on {repo}")
         return
-    r = requests.get(f"{API}/repos/{owner}/{repo}/hooks", headers=_h(tok))
-    if r.status_code == 404: 
-        print(f"SKIP: repo {repo} missing for webhook cleanup"); return
-    r.raise_for_status()
-    hooks = r.json()
+    hooks = [h for h in paginate(f"{API}/repos/{owner}/{repo}/hooks", tok, allow_404=True)
+             if h.get("config",{}).get("url") in urls]
     for h in hooks:
-        if h.get("config",{}).get("url") in urls:
-            _del(f"{API}/repos/{owner}/{repo}/hooks/{h['id']}", tok); print(f"OK: deleted repo webhook {h['config']['url']}")
+        _del(f"{API}/repos/{owner}/{repo}/hooks/{h['id']}", tok); print(f"OK: deleted repo webhook {h['config']['url']}")
+
+def remove_org_rulesets(owner, names, tok, dry):
+    # one listing, then delete every managed org ruleset by name
+    url = f"{API}/orgs/{owner}/rulesets"
+    if dry:
+        for n in sorted(names): print(f"DRY: delete org ruleset {n}")
+        return
+    for rs in [rs for rs in paginate(url, tok) if rs.get("name") in names]:
+        _del(f"{url}/{rs['id']}", tok); print(f"OK: deleted org ruleset '{rs['name']}'")
 
 def delete_org_webhooks(owner, urls, tok, dry, org):
     if dry:
@@ -70,15 +80,14 @@ def delete_env_secret(owner, repo, env, name, tok, dry):
         print(f"DRY: delete env secret {name} in {repo}/{env}"); return
     _del(url, tok); print(f"OK: deleted env secret {name} in {repo}/{env}")
 
-def delete_deploy_keys(org, repo_name, titles, dry):
+def delete_deploy_keys(cache, repo_name, titles, dry):
     if dry:
         for t in titles: print(f"DRY: delete deploy key '{t}' on {repo_name}")
         return
     try:
-        repo = org.get_repo(repo_name)
-    except Exception:
+        existing = {k.title: k for k in cache.repo_handle(repo_name).get_keys()}
+    except UnknownObjectException:
         print(f"SKIP: repo {repo_name} not found for deploy keys"); return
-    existing = {k.title: k for k in repo.get_keys()}
     for t in titles:
         k = existing.get(t)
         if k:
@@ -86,43 +95,54 @@ def delete_deploy_keys(org, repo_name, titles, dry):
         else:
             print(f"SKIP: deploy key '{t}' not present on {repo_name}")
 
-def remove_team(org, slug, repos_to_detach, dry):
-    try:
-        team = org.get_team_by_slug(slug)
-    except Exception:
-        print(f"SKIP: team {slug} not found"); return
+def remove_team(cache, slug, repos_to_detach, dry):
+    # deleting a team drops every repo grant it holds, so there is nothing to detach first
     if dry:
-        for r in repos_to_detach: print(f"DRY: remove {slug} access to {r}")
-        print(f"DRY: delete team {slug}")
+        if cache.team(slug) is None:
+            print(f"SKIP: team {slug} not found"); return
+        print(f"DRY: delete team {slug}" + (f" (drops its access to {', '.join(repos_to_detach)})" if repos_to_detach else ""))
         return
-    # detach perms
-    for r in repos_to_detach:
-        try:
-            repo = org.get_repo(r)
-            team.remove_from_repos(repo)
-            print(f"OK: removed {slug} access to {r}")
-        except Exception:
-            pass
-    team.delete(); print(f"OK: deleted team {slug}")
-
-def archive_or_delete_repo(org, name, mode, dry):
     try:
-        repo = org.get_repo(name)
-    except Exception:
-        print(f"SKIP: repo {name} not found"); return
+        cache.team_handle(slug).delete()
+    except UnknownObjectException:
+        print(f"SKIP: team {slug} not found"); return
+    cache.forget("team", slug); print(f"OK: deleted team {slug}")
+
+def archive_or_delete_repo(cache, name, mode, dry):
+    if mode not in ("archive", "delete"):
+        raise SystemExit(f"Unknown mode {mode}")
     if dry:
+        if cache.repo(name) is None:
+            print(f"SKIP: repo {name} not found"); return
         print(f"DRY: {mode} repo {name}"); return
-    if mode == "archive":
-        repo.edit(archived=True); print(f"OK: archived {name}")
-    elif mode == "delete":
-        repo.delete(); print(f"OK: deleted {name}")
-    else:
-        raise SystemExit(f"Unknown mode {mode}")
+    repo = cache.repo_handle(name)  # the write itself reports a missing repo
+    try:
+        if mode == "archive":
+            repo.edit(archived=True); print(f"OK: archived {name}")
+        else:
+            repo.delete(); cache.forget("repo", name); print(f"OK: deleted {name}")
+    except UnknownObjectException:
+        print(f"SKIP: repo {name} not found")
+
+def archive_repos(owner, names, tok, journal, batch_size):
+    """archiveRepository for every repo in as few GraphQL requests as possible; one journal step per repo."""
+    nodes = repo_nodes(tok, owner, names, "id isArchived")
+    batch, steps = MutationBatch(tok, batch_size), []
+    for name in names:
+        node = nodes.get(name)
+        if node is None:
+            print(f"SKIP: repo {name} not found"); continue
+        if node["isArchived"]:
+            print(f"SKIP: repo {name} already archived"); METRICS.count("repo", "unchanged"); continue
+        batch.add(name, "archiveRepository", "ArchiveRepositoryInput", {"repositoryId": node["id"]})
+        steps.append((f"repo:{name}", "archive", name, f"OK: archived {name}"))
+    batch.run()
+    journal_results(journal, batch, steps)
 
 # ---------- main ----------
-def main():
+def main(args=None):
     ap = argparse.ArgumentParser()
-    ap.add_argument("--owner", required=True)
+    ap.add_argument("--owner", help="Org login, or several comma-separated to reconcile them concurrently")
     ap.add_argument("--repos", default="src/config/repos.yaml")
     ap.add_argument("--teams", default="src/config/teams.yaml")
     ap.add_argument("--secrets", default="src/config/secrets.yaml")
@@ -133,13 +153,26 @@ def main():
     ap.add_argument("--force", action="store_true", help="Required for destructive actions")
     ap.add_argument("--repo-mode", choices=["archive","delete"], default="archive")
     ap.add_argument("--include-gpg", action="store_true", help="Also delete user GPG keys added by automation (best-effort)")
-    args = ap.parse_args()
+    ap.add_argument("--graphql-batch", type=int, default=MAX_MUTATIONS, help="Repo archives per GraphQL request")
+    ap.add_argument("--snapshot", nargs="?", const="auto", default=None, metavar="DB",
+                    help="With --dry-run: check what exists in a local snapshot (snapshot.py refresh); no token or API calls")
+    add_journal_args(ap)
+    add_org_args(ap)
+    args = args or ap.parse_args()
+    if multi_org(args):
+        return fan_out("cleanup", main, args)
 
     if not args.force and not args.dry_run:
         raise SystemExit("Refusing to run live cleanup without --force. Use --dry-run to preview.")
 
-    token = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=False)
-    gh, org = gh_client(args.owner, token)
+    if args.dry_run and args.snapshot:
+        token, org = "DRY", None
+        cache = Snapshot.open(args.owner, args.state_dir, args.snapshot)  # answers repo()/team() like ObjectCache
+    else:
+        token = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=False, owner=args.owner)
+        gh, org = gh_client(args.owner, token)
+        cache = ObjectCache(gh, org)
+    journal = RunJournal.from_args("cleanup", args)
 
     repos_cfg  = load_yaml(args.repos) or {}
     teams_cfg  = load_yaml(args.teams) or {}
@@ -149,60 +182,85 @@ def main():
     # 0) Org webhooks (optional)
     org_urls = [h.get("url") for h in (secret_cfg.get("org_webhooks") or []) if h.get("url")]
     if org_urls:
-        delete_org_webhooks(args.owner, org_urls, token, args.dry_run, org)
+        journal.step("org", "delete_webhooks", delete_org_webhooks, args.owner, org_urls, token, args.dry_run, org)
 
     # 1) Secrets (org → repo → env) — so nothing references them later
     for k in (secret_cfg.get("org") or {}).keys():
-        delete_org_secret(args.owner, k, token, args.dry_run)
+        journal.step("org", f"delete_secret:{k}", delete_org_secret, args.owner, k, token, args.dry_run)
+    # org secrets secrets.py promoted from identical repo secrets (--promote-duplicates)
+    promo_path = os.path.join(args.state_dir, "secrets", f"{args.owner}-promoted.json")
+    promoted = load_json(promo_path, {}) or {}
+    for k in sorted(set(promoted) - set(secret_cfg.get("org") or {})):
+        journal.step("org", f"delete_secret:{k}", delete_org_secret, args.owner, k, token, args.dry_run)
+    if promoted and not args.dry_run:
+        atomic_write_json(promo_path, {k: v for k, v in promoted.items() if not journal.done("org", f"delete_secret:{k}")})
 
     for repo_name, kv in (secret_cfg.get("repos") or {}).items():
         for k in (kv or {}).keys():
-            delete_repo_secret(args.owner, repo_name, k, token, args.dry_run)
+            journal.step(f"repo:{repo_name}", f"delete_secret:{k}", delete_repo_secret, args.owner, repo_name, k, token, args.dry_run)
 
     for repo_name, envs in (secret_cfg.get("envs") or {}).items():
         for env, kv in (envs or {}).items():
             for k in (kv or {}).keys():
-                delete_env_secret(args.owner, repo_name, env, k, token, args.dry_run)
+                journal.step(f"repo:{repo_name}", f"delete_env_secret:{env}:{k}", delete_env_secret, args.owner, repo_name, env, k, token, args.dry_run)
 
     # 2) Deploy keys
     for repo_name, items in (secret_cfg.get("deploy_keys") or {}).items():
         titles = [it.get("title") for it in items or [] if it.get("title")]
-        delete_deploy_keys(org, repo_name, titles, args.dry_run)
+        journal.step(f"repo:{repo_name}", "delete_deploy_keys", delete_deploy_keys, cache, repo_name, titles, args.dry_run)
 
     # 3) Teams → remove permissions then delete team
     for t in (teams_cfg.get("teams") or []):
         slug = t.get("name")
         repos = [r.get("name") for r in t.get("repos", []) if r.get("name")]
-        remove_team(org, slug, repos, args.dry_run)
+        journal.step(f"team:{slug}", "delete", remove_team, cache, slug, repos, args.dry_run)
 
-    # 4) Per-repo cleanup: protection, rulesets, webhooks → then archive/delete
+    # 4) Org rulesets (compiled from per-repo protection) in one pass
+    org_rs, covered = compile_org_rulesets(repos_cfg)
+    if org_rs:
+        journal.step("org", "delete_rulesets", remove_org_rulesets, args.owner, set(org_rs), token, args.dry_run)
+
+    # 5) Per-repo cleanup: protection, rulesets, webhooks → then archive/delete
+    to_archive = []
     for spec in (repos_cfg.get("repos") or []):
         name = spec.get("name")
+        obj = f"repo:{name}"
         # remove branch protection
         for p in spec.get("protected_branches", []) or []:
-            remove_branch_protection(args.owner, name, p.get("name"), token, args.dry_run)
+            if (name, "protect", p.get("name")) in covered:
+                continue  # removed with the org ruleset
+            journal.step(obj, f"unprotect:{p.get('name')}", remove_branch_protection, args.owner, name, p.get("name"), token, args.dry_run)
         # remove rulesets by name
-        rs_names = [r.get("name") for r in spec.get("rulesets", []) or [] if r.get("name")]
+        rs_names = [r.get("name") for r in spec.get("rulesets", []) or [] if r.get("name") and (name, "ruleset", r.get("name")) not in covered]
         if rs_names:
-            remove_rulesets(args.owner, name, rs_names, token, args.dry_run)
+            journal.step(obj, "delete_rulesets", remove_rulesets, args.owner, name, rs_names, token, args.dry_run)
         # remove repo webhooks
         urls = [h.get("url") for h in (spec.get("repo_webhooks") or []) if h.get("url")]
         if urls:
-            delete_repo_webhooks(args.owner, name, urls, token, args.dry_run)
-        # archive or delete repo
-        archive_or_delete_repo(org, name, args.repo_mode, args.dry_run)
+            journal.step(obj, "delete_webhooks", delete_repo_webhooks, args.owner, name, urls, token, args.dry_run)
+        # archive or delete repo (live archives go out together below)
+        if args.repo_mode == "archive" and not args.dry_run:
+            if not journal.done(obj, "archive"):
+                to_archive.append(name)
+        else:
+            journal.step(obj, args.repo_mode, archive_or_delete_repo, cache, name, args.repo_mode, args.dry_run)
+    if to_archive:
+        with METRICS.stage("archive_batch"):
+            archive_repos(args.owner, to_archive, token, journal, args.graphql_batch)
 
-    # 5) (Optional) GPG keys — best-effort only (not strongly recommended)
+    # 6) (Optional) GPG keys — best-effort only (not strongly recommended)
     if args.include_gpg:
         if args.dry_run:
             print("DRY: would list and delete user GPG keys (best effort, not fingerprint-matched)")
         else:
-            r = requests.get(f"{API}/user/gpg_keys", headers=_h(token))
-            if r.status_code == 200:
-                for k in r.json():
-                    _del(f"{API}/user/gpg_keys/{k['id']}", token); print(f"OK: deleted user GPG key id={k['id']}")
+            user = user_token(token)  # the same identity gpg.py uploads as
+            def _del_gpg(kid):
+                _del(f"{API}/user/gpg_keys/{kid}", user); print(f"OK: deleted user GPG key id={kid}")
+            for k in list(paginate(f"{API}/user/gpg_keys", user)):
+                journal.step("user", f"delete_gpg_key:{k['id']}", _del_gpg, k["id"])
 
     print("CLEANUP COMPLETE (preview)" if args.dry_run else "CLEANUP COMPLETE")
+    return journal.finish()
 
 if __name__ == "__main__":
     sys.exit(main())
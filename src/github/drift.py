@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Drift scanner: reads the org audit log (or the org events API) from a stored
+cursor, works out which managed repos/teams/secrets/hooks/deploy keys were
+touched since the last scan, and reports them -- or, with --reconcile, runs
+the owning module for just those objects and then advances the cursor.
+
+Cursor state lives in <state-dir>/drift/<owner>.json. The first scan only
+initialises the cursor; run the full modules once to establish a baseline.
+"""
+import argparse, sys, os, time
+from datetime import datetime, timezone
+from _common import load_yaml, get_token, load_json, atomic_write_json, token_env, automation_logins, paginate
+from _journal import STATE_DIR
+from _reconcile import managed_objects, make_runner, ORG_SCOPE
+from _orgs import add_org_args, multi_org, fan_out
+from _metrics import METRICS, add_metrics_args
+
+API = "https://api.github.com"
+
+def _last(path):
+    return (path or "").rsplit("/", 1)[-1] or None
+
+def objects_for_audit_entry(e):
+    """Map one audit-log entry to the (kind, name) objects it touched."""
+    action = e.get("action", "")
+    prefix = action.split(".", 1)[0]
+    repo, team = _last(e.get("repo")), _last(e.get("team"))
+    if "actions_secret" in action:
+        return [("secret", repo or ORG_SCOPE)]
+    if prefix == "hook":
+        # repo hooks are reported by nothing: no module reconciles repo_webhooks live yet
+        return [] if repo else [("hook", "org")]
+    if prefix == "public_key" or action.startswith("repo.deploy_key"):
+        return [("deploy_key", repo)] if repo else []
+    if prefix == "team":
+        return [("team", team)] if team else []
+    if prefix in ("repo", "protected_branch", "repository_ruleset", "environment", "repository_branch_protection_evaluation"):
+        return [("repo", repo)] if repo else []
+    return []
+
+def objects_for_event(ev):
+    """Map one org events API entry (coarser than the audit log) to objects."""
+    t = ev.get("type", "")
+    repo = _last((ev.get("repo") or {}).get("name"))
+    if t in ("CreateEvent", "DeleteEvent", "MemberEvent", "PublicEvent", "RepositoryEvent"):
+        return [("repo", repo)] if repo else []
+    if t == "TeamAddEvent":
+        team = ((ev.get("payload") or {}).get("team") or {}).get("slug")
+        return [("team", team)] if team else []
+    return []
+
+def scan_audit_log(owner, tok, cursor):
+    """
+    Entries strictly after cursor {"ts": ms, "seen": [_document_id at ts]}.
+    Returns (entries, new_cursor).
+    """
+    ts = cursor.get("ts", 0)
+    seen = set(cursor.get("seen", []))
+    since = datetime.fromtimestamp(ts / 1000, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+    params = {"phrase": f"created:>={since}", "order": "asc", "include": "all"}
+    out = []
+    for e in paginate(f"{API}/orgs/{owner}/audit-log", tok, params):
+        ets, doc = e.get("@timestamp", 0), e.get("_document_id")
+        if ets < ts or (ets == ts and doc in seen):
+            continue
+        out.append(e)
+    if out:
+        top = max(e.get("@timestamp", 0) for e in out)
+        seen = {e.get("_document_id") for e in out if e.get("@timestamp", 0) == top} | (seen if top == ts else set())
+        ts = top
+    return out, {"ts": ts, "seen": sorted(s for s in seen if s)}
+
+def scan_events(owner, tok, cursor):
+    """Org events newer than cursor {"id": last event id}; the API is newest-first."""
+    last = int(cursor.get("id", 0))
+    out = []
+    for ev in paginate(f"{API}/orgs/{owner}/events", tok):
+        if int(ev["id"]) <= last:
+            break  # everything after this is older; stops paging
+        out.append(ev)
+    new = max([int(ev["id"]) for ev in out] + [last])
+    return out, {"id": new}
+
+def main(args=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--owner", help="Org login, or several comma-separated to reconcile them concurrently")
+    ap.add_argument("--repos", default="src/config/repos.yaml")
+    ap.add_argument("--teams", default="src/config/teams.yaml")
+    ap.add_argument("--secrets", default="src/config/secrets.yaml")
+    ap.add_argument("--source", choices=["audit-log", "events"], default="audit-log",
+                    help="audit-log needs GitHub Enterprise Cloud; events is coarser and only covers recent activity")
+    ap.add_argument("--reconcile", action="store_true", help="Reconcile touched objects, then advance the cursor")
+    ap.add_argument("--ignore-actor", default=None, help="Login whose changes are not drift (default: the token's user(s))")
+    ap.add_argument("--state-dir", default=STATE_DIR)
+    ap.add_argument("--ssm-token", default="insizon-github-admin-token")
+    ap.add_argument("--region", default="us-east-2")
+    ap.add_argument("--profile", default=None)
+    ap.add_argument("--dry-run", action="store_true", help="With --reconcile: print the jobs, keep the cursor")
+    add_metrics_args(ap)
+    add_org_args(ap)
+    args = args or ap.parse_args()
+    if multi_org(args):
+        return fan_out("drift", main, args)
+
+    METRICS.configure("drift", args.metrics_dir, args.owner)
+    managed = managed_objects(load_yaml(args.repos), load_yaml(args.teams), load_yaml(args.secrets))
+    tok = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=False, owner=args.owner)
+
+    path = os.path.join(args.state_dir, "drift", f"{args.owner}.json")
+    state = load_json(path, {}) or {}
+    cursor = state.get(args.source)
+    if cursor is None:
+        init = {"ts": int(time.time() * 1000), "seen": []} if args.source == "audit-log" else scan_events(args.owner, tok, {})[1]
+        state[args.source] = init
+        atomic_write_json(path, state)
+        print(f"INFO: {args.source} cursor initialised; run the full modules once to establish a baseline")
+        return 0
+
+    ignore = {args.ignore_actor} if args.ignore_actor else automation_logins(tok)
+
+    if args.source == "audit-log":
+        entries, new_cursor = scan_audit_log(args.owner, tok, cursor)
+        actor = lambda e: e.get("actor")
+        objects = objects_for_audit_entry
+    else:
+        entries, new_cursor = scan_events(args.owner, tok, cursor)
+        actor = lambda e: (e.get("actor") or {}).get("login")
+        objects = objects_for_event
+
+    touched = {}
+    for e in entries:
+        if actor(e) in ignore:
+            continue
+        for kind, name in objects(e):
+            if name in managed[kind]:
+                touched.setdefault(kind, set()).add(name)
+
+    print(f"SCAN: {len(entries)} {args.source} entries since last cursor")
+    if not touched:
+        print("OK: no drift on managed objects")
+    for kind, names in sorted(touched.items()):
+        print(f"DRIFT: {kind}: {', '.join(sorted(names))}")
+        METRICS.count(kind, "drifted", len(names))
+
+    if not args.reconcile:
+        print("INFO: report only; cursor not advanced (use --reconcile)")
+        return 1 if touched else 0
+
+    env = dict(os.environ, **token_env(tok))
+    run = make_runner(args, env)
+    ok = all([run(kind, sorted(names)) for kind, names in sorted(touched.items())])
+    if not ok:
+        print("WARN: some reconciles failed; cursor not advanced")
+        return 1
+    if args.dry_run:
+        return 0
+    state[args.source] = new_cursor
+    atomic_write_json(path, state)
+    print(f"OK: cursor advanced ({args.source})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
-import argparse, sys, requests, json, os
-from _common import load_yaml, get_token
+import argparse, sys, json, os, base64, hashlib, struct
+from _common import load_yaml, get_token, gh_http, paginate, user_token
+from _journal import RunJournal, add_journal_args
+from _metrics import METRICS
 
 API = "https://api.github.com"
 def _h(tok): return {"Authorization": f"Bearer {tok}", "Accept": "application/vnd.github+json"}
@@ -47,28 +49,71 @@ def _resolve_armored(ref, region, profile=None, dry_run=False, skip_missing=Fals
             return None
         raise
 
-def _already_uploaded(tok, armored_prefix_hint=None):
+def _dearmor(armored):
+    """Binary packets of an ASCII-armored OpenPGP block (armor headers and CRC line dropped)."""
+    lines = armored.replace("\r", "").strip().splitlines()
+    try:
+        begin = next(i for i, l in enumerate(lines) if l.startswith("-----BEGIN PGP PUBLIC KEY BLOCK"))
+    except StopIteration:
+        raise ValueError("no PGP PUBLIC KEY BLOCK armor")
+    body, in_headers = [], True
+    for l in lines[begin + 1:]:
+        if l.startswith("-----END PGP"):
+            break
+        if in_headers:
+            if not l.strip():
+                in_headers = False
+            elif ":" in l:
+                continue  # Version:/Comment: headers
+            else:
+                in_headers = False
+        if not in_headers and l.strip() and not l.startswith("="):
+            body.append(l.strip())
+    return base64.b64decode("".join(body))
+
+def _first_packet(data):
+    """(tag, body) of the first packet, for both old and new packet formats."""
+    b0 = data[0]
+    if not b0 & 0x80:
+        raise ValueError("not an OpenPGP packet")
+    if b0 & 0x40:  # new format
+        tag, l0 = b0 & 0x3F, data[1]
+        if l0 < 192:
+            n, off = l0, 2
+        elif l0 < 224:
+            n, off = ((l0 - 192) << 8) + data[2] + 192, 3
+        elif l0 == 255:
+            (n,) = struct.unpack(">I", data[2:6]); off = 6
+        else:
+            raise ValueError("partial-length public key packet")
+    else:
+        tag, lt = (b0 >> 2) & 0x0F, b0 & 0x03
+        size = {0: 1, 1: 2, 2: 4}.get(lt)
+        if size is None:
+            raise ValueError("indeterminate-length public key packet")
+        n = int.from_bytes(data[1:1 + size], "big"); off = 1 + size
+    return tag, data[off:off + n]
+
+def key_identity(armored):
     """
-    Lightweight idempotency: fetch user GPG keys and optionally
-    look for a prefix match to avoid duplicate POSTs when possible.
-    (We can't compute fingerprints without parsing; this is best-effort.)
+    Primary key (key_id, fingerprint) of an armored public key, both upper-case
+    hex. key_id is what GET /user/gpg_keys reports for each key.
     """
-    try:
-        r = requests.get(f"{API}/user/gpg_keys", headers=_h(tok))
-        if r.status_code != 200:
-            return set()
-        data = r.json()
-        notes = set()
-        for k in data:
-            # GitHub returns 'key_id','id','public_key','emails', etc.
-            # We store title-ish hint in 'notes' via armored_prefix_hint match.
-            # Not perfect, but better than hammering POST repeatedly.
-            if armored_prefix_hint:
-                if any(armored_prefix_hint in str(v) for v in k.values() if isinstance(v, (str, list, dict))):
-                    notes.add("HINT-MATCH")
-        return notes
-    except Exception:
-        return set()
+    tag, body = _first_packet(_dearmor(armored))
+    if tag != 6:
+        raise ValueError("first packet is not a public key")
+    version = body[0]
+    if version == 4:
+        fp = hashlib.sha1(b"\x99" + struct.pack(">H", len(body)) + body).hexdigest().upper()
+        return fp[-16:], fp
+    if version in (5, 6):
+        fp = hashlib.sha256(bytes([0x9A if version == 5 else 0x9B]) + struct.pack(">I", len(body)) + body).hexdigest().upper()
+        return fp[:16], fp
+    raise ValueError(f"unsupported public key version {version}")
+
+def _uploaded_index(tok):
+    """key_id -> key for every GPG key on the token's user; one paginated listing."""
+    return {(k.get("key_id") or "").upper(): k for k in paginate(f"{API}/user/gpg_keys", tok)}
 
 def main():
     ap = argparse.ArgumentParser()
@@ -78,10 +123,13 @@ def main():
     ap.add_argument("--dry-run", action="store_true")
     ap.add_argument("--skip-missing", action="store_true", help="Skip if key source is missing")
     ap.add_argument("--profile", default=None, help="AWS profile for SSM lookups")
+    add_journal_args(ap)
     args = ap.parse_args()
 
     cfg = load_yaml(args.config) or {}
-    tok = get_token(args.ssm_token, region=args.region, profile=args.profile)
+    # /user/gpg_keys is per identity: a token pool would list one member's keys and upload as another
+    tok = user_token(get_token(args.ssm_token, region=args.region, profile=args.profile))
+    journal = RunJournal.from_args("gpg", args)
 
     # secrets.yaml schema:
     # gpg_keys:
@@ -89,34 +137,42 @@ def main():
     #   - armored_key: ssm:/org/gpg/armored_public_key
     #   - armored_key: literal:-----BEGIN PGP PUBLIC KEY BLOCK-----\n...
     keys = cfg.get("gpg_keys") or []
+    uploaded = _uploaded_index(tok) if keys and not args.dry_run else {}
     for k in keys:
         ref = k["armored_key"]
         armored = _resolve_armored(ref, args.region, args.profile, dry_run=args.dry_run, skip_missing=args.skip_missing)
         if armored is None:
             continue
 
-        # small idempotency hint: first 40 chars as a prefix marker
-        hint = armored.strip().replace("\r","").splitlines()[0] if armored else ""
         if args.dry_run:
-            print(f"DRY: add user GPG key (source={ref}, hint={hint[:40]!r})")
+            print(f"DRY: add user GPG key (source={ref})")
             continue
 
-        # If best-effort says likely present, skip POST
-        if _already_uploaded(tok, armored_prefix_hint=hint):
-            print("SKIP: a GPG key with similar hint appears to be already uploaded")
+        try:
+            key_id, fpr = key_identity(armored)
+        except (ValueError, IndexError) as e:
+            raise SystemExit(f"ERROR: could not parse GPG key from {ref}: {e}")
+        if key_id in uploaded:
+            print(f"SKIP: GPG key {key_id} already uploaded (source={ref})")
+            METRICS.count("gpg_key", "unchanged")
             continue
 
-        r = requests.post(f"{API}/user/gpg_keys", headers=_h(tok),
-                          data=json.dumps({"armored_public_key": armored}))
-        # Accept common "already exists"/validation responses gracefully
-        if r.status_code in (201, 200):
-            print("OK: user GPG key added")
-        elif r.status_code in (409, 422):
-            # 409 Conflict or 422 Unprocessable Entity typically means duplicate or invalid; surface minimal info
-            msg = r.text.strip().replace("\n"," ")
-            print(f"INFO: GPG add returned {r.status_code}: {msg}")
-        else:
-            raise SystemExit(f"GPG add failed: {r.status_code} {r.text}")
+        def _add(armored=armored):
+            r = gh_http.post(f"{API}/user/gpg_keys", headers=_h(tok),
+                              data=json.dumps({"armored_public_key": armored}))
+            # Accept common "already exists"/validation responses gracefully
+            if r.status_code in (201, 200):
+                uploaded[key_id] = r.json()
+                print(f"OK: user GPG key {key_id} added (fingerprint {fpr})")
+            elif r.status_code in (409, 422):
+                # 409 Conflict or 422 Unprocessable Entity typically means duplicate or invalid; surface minimal info
+                msg = r.text.strip().replace("\n"," ")
+                print(f"INFO: GPG add returned {r.status_code}: {msg}")
+            else:
+                raise SystemExit(f"GPG add failed: {r.status_code} {r.text}")
+        journal.step("user", f"gpg_key:{key_id}", _add)
+
+    return journal.finish()
 
 if __name__ == "__main__":
     sys.exit(main())
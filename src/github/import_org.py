@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Reverse import: write repos.yaml, teams.yaml and secrets.yaml for an existing
+org, in the schema the modules consume, so onboarding starts from what is
+already there instead of a hand-written config.
+
+  import_org.py --owner X [--out-dir private/import/X] [--workers 16] [--force]
+
+The org is walked by snapshot.py's refresh (repos and teams in parallel,
+paginated, conditional on stored ETags), so a re-import only refetches what
+changed. Secret values cannot be read back: every secret, and every hook with
+a secret, gets an ssm:/github/<owner>/... ref to populate before a live run
+(or run secrets.py with --skip-missing). Deploy keys are public and come back
+verbatim as literal: refs. Org rulesets, users and GPG keys are not imported.
+"""
+import argparse, sys, os
+from _common import get_token, atomic_write_yaml
+from _journal import STATE_DIR
+from _orgs import add_org_args, multi_org, fan_out
+from _snapshot import Snapshot, default_path, ORG
+from snapshot import refresh
+from teams import current_permission
+
+DEFAULT_OFF = ("has_issues", "has_projects", "has_wiki")  # on by default; only a disabled one is worth a setting
+
+def _ref(owner, *parts):
+    return "ssm:/github/" + "/".join((owner,) + parts)
+
+def protection_spec(branch, p):
+    """A protected_branches entry from GET .../protection (inverse of ensure_branch_protection)."""
+    spec = {"name": branch}
+    reviews = p.get("required_pull_request_reviews")
+    if reviews:
+        spec["require_pr_reviews"] = reviews.get("required_approving_review_count", 0)
+        if reviews.get("dismiss_stale_reviews"):
+            spec["dismiss_stale_reviews"] = True
+    contexts = (p.get("required_status_checks") or {}).get("contexts") or []
+    if contexts:
+        spec["require_status_checks"] = {"contexts": contexts}
+    if not (p.get("enforce_admins") or {}).get("enabled"):
+        spec["enforce_admins"] = False
+    return spec
+
+def ruleset_spec(rs):
+    rules = rs.get("rules") or []
+    types = [r["type"] for r in rules]
+    return {
+        "name": rs["name"],
+        "target": rs.get("target", "branch"),
+        "enforcement": rs.get("enforcement", "active"),
+        "conditions": rs.get("conditions") or {},
+        # {type: parameters} shorthand, unless a type repeats
+        "rules": {r["type"]: r.get("parameters") or {} for r in rules} if len(set(types)) == len(types) else rules,
+    }
+
+def environment_spec(name, e, patterns, branches):
+    spec = {"name": name}
+    if name not in branches:
+        spec["branch"] = False  # a plain name would create the branch
+    for rule in e.get("protection_rules") or []:
+        if rule.get("type") == "wait_timer" and rule.get("wait_timer"):
+            spec["wait_timer"] = rule["wait_timer"]
+        elif rule.get("type") == "required_reviewers":
+            rev = {"teams": sorted(r["reviewer"]["slug"] for r in rule.get("reviewers") or [] if r["type"] == "Team"),
+                   "users": sorted(r["reviewer"]["login"] for r in rule.get("reviewers") or [] if r["type"] == "User")}
+            spec["reviewers"] = {k: v for k, v in rev.items() if v}
+            if rule.get("prevent_self_review"):
+                spec["prevent_self_review"] = True
+    dbp = e.get("deployment_branch_policy") or {}
+    if dbp.get("protected_branches"):
+        spec["deployment_branches"] = "protected"
+    elif dbp.get("custom_branch_policies"):
+        spec["deployment_branches"] = sorted(patterns)
+    return name if list(spec) == ["name"] else spec
+
+def hook_spec(owner, scope, h):
+    cfg = h.get("config") or {}
+    spec = {"url": cfg.get("url"), "content_type": cfg.get("content_type", "json")}
+    if cfg.get("secret"):
+        spec["secret"] = _ref(owner, scope, "hooks", str(h["id"]))
+    spec["events"] = h.get("events") or ["push"]
+    spec["active"] = bool(h.get("active", True))
+    return spec
+
+def repos_config(owner, snap, include_archived):
+    out = []
+    for name, r in sorted(snap.children("repo", "").items()):
+        if r.get("archived") and not include_archived:
+            continue
+        branches = snap.children("branch", name)
+        spec = {"name": name}
+        if r.get("description"):
+            spec["description"] = r["description"]
+        spec["visibility"] = r.get("visibility") or ("private" if r.get("private") else "public")
+        spec["default_branch"] = r.get("default_branch") or "main"
+        if r.get("topics"):
+            spec["topics"] = sorted(r["topics"])
+        envs = [environment_spec(e, data, snap.children("branch_policy", f"{name}/{e}"), branches)
+                for e, data in sorted(snap.children("environment", name).items())]
+        if envs:
+            spec["environments"] = envs
+        settings = {k: False for k in DEFAULT_OFF if r.get(k) is False}
+        if settings:
+            spec["settings"] = settings
+        protected = [protection_spec(b, p) for b, p in sorted(snap.children("protection", name).items())]
+        if protected:
+            spec["protected_branches"] = protected
+        rulesets = [ruleset_spec(rs) for _, rs in sorted(snap.children("ruleset", name).items())]
+        if rulesets:
+            spec["rulesets"] = rulesets
+        hooks = [hook_spec(owner, name, h) for _, h in sorted(snap.children("hook", name).items())]
+        if hooks:
+            spec["repo_webhooks"] = hooks
+        out.append(spec)
+    return {"repos": out}
+
+def teams_config(snap):
+    out = []
+    for slug, t in sorted(snap.children("team", "").items()):
+        members = snap.children("team_member", slug)
+        spec = {"name": slug}  # teams.py looks teams up by this value as a slug
+        if t.get("description"):
+            spec["description"] = t["description"]
+        spec["privacy"] = t.get("privacy") or "closed"
+        spec["maintainers"] = sorted(l for l, m in members.items() if m["role"] == "maintainer")
+        spec["members"] = sorted(l for l, m in members.items() if m["role"] == "member")
+        spec["repos"] = [{"name": r, "permission": current_permission(g)} for r, g in sorted(snap.children("team_repo", slug).items())]
+        out.append(spec)
+    return {"teams": out}
+
+def secrets_config(owner, snap, repos):
+    cfg = {}
+    org = {}
+    for n, s in sorted(snap.children("secret", ORG).items()):
+        entry = {"value": _ref(owner, "org", n), "visibility": s.get("visibility", "all")}
+        if entry["visibility"] == "selected":
+            entry["selected_repos"] = s.get("selected_repos") or []
+        org[n] = entry
+    if org:
+        cfg["org"] = org
+    per_repo, envs, keys = {}, {}, {}
+    for repo in repos:
+        names = sorted(snap.children("secret", repo))
+        if names:
+            per_repo[repo] = {n: _ref(owner, repo, n) for n in names}
+        for env in sorted(snap.children("environment", repo)):
+            names = sorted(snap.children("env_secret", f"{repo}/{env}"))
+            if names:
+                envs.setdefault(repo, {})[env] = {n: _ref(owner, repo, env, n) for n in names}
+        dk = [{"title": t, "key": f"literal:{k['key']}", "read_only": bool(k.get("read_only", True))}
+              for t, k in sorted(snap.children("deploy_key", repo).items())]
+        if dk:
+            keys[repo] = dk
+    for k, v in (("repos", per_repo), ("envs", envs), ("deploy_keys", keys)):
+        if v:
+            cfg[k] = v
+    hooks = [hook_spec(owner, "org", h) for _, h in sorted(snap.children("hook", ORG).items())]
+    if hooks:
+        cfg["org_webhooks"] = hooks
+    return cfg
+
+def main(args=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--owner", help="Org login, or several comma-separated to import them concurrently")
+    ap.add_argument("--out-dir", default=None, help="Where the YAML goes (default: private/import/<owner>)")
+    ap.add_argument("--force", action="store_true", help="Overwrite existing files in --out-dir")
+    ap.add_argument("--include-archived", action="store_true", help="Also import archived repos")
+    ap.add_argument("--workers", type=int, default=16, help="Repos/teams fetched in parallel")
+    ap.add_argument("--full", action="store_true", help="Ignore the stored snapshot and refetch everything")
+    ap.add_argument("--db", default=None, help="Snapshot file (default: <state-dir>/snapshots/<owner>.sqlite)")
+    ap.add_argument("--state-dir", default=STATE_DIR)
+    ap.add_argument("--ssm-token", default="insizon-github-admin-token")
+    ap.add_argument("--region", default="us-east-2")
+    ap.add_argument("--profile", default=None)
+    add_org_args(ap)
+    args = args or ap.parse_args()
+    if multi_org(args):
+        if args.out_dir or args.db:
+            raise SystemExit("ERROR: --out-dir/--db name one org's files; drop them (or set out_dir/db per org in --orgs) to import several orgs")
+        return fan_out("import", main, args)
+
+    out_dir = args.out_dir or os.path.join("private", "import", args.owner)
+    paths = {f: os.path.join(out_dir, f) for f in ("repos.yaml", "teams.yaml", "secrets.yaml")}
+    existing = [p for p in paths.values() if os.path.exists(p)]
+    if existing and not args.force:
+        raise SystemExit(f"ERROR: {', '.join(existing)} already exist; pass --force to overwrite")
+
+    tok = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=False, owner=args.owner)
+    snap = Snapshot(args.db or default_path(args.owner, args.state_dir))
+    refresh(args.owner, tok, snap, args.full, args.workers)
+
+    repos = repos_config(args.owner, snap, args.include_archived)
+    teams = teams_config(snap)
+    secrets = secrets_config(args.owner, snap, [r["name"] for r in repos["repos"]])
+    snap.close()
+
+    header = f"# imported from {args.owner}; review before applying\n"
+    atomic_write_yaml(paths["repos.yaml"], repos, header)
+    atomic_write_yaml(paths["teams.yaml"], teams, header)
+    atomic_write_yaml(paths["secrets.yaml"], secrets,
+                      header + f"# values are ssm:/github/{args.owner}/... refs to populate (GitHub never returns secret values)\n")
+    print(f"OK: {len(repos['repos'])} repos, {len(teams['teams'])} teams, "
+          f"{sum(len(v) for v in (secrets.get('repos') or {}).values()) + len(secrets.get('org') or {})} secrets -> {out_dir}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
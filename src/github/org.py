@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
-import argparse, sys, requests
-from _common import load_yaml, get_token, gh_client
+import argparse, sys
+from _common import load_yaml, get_token, gh_client, gh_http
+from _journal import RunJournal, add_journal_args
+from _orgs import add_org_args, multi_org, fan_out
+from github import GithubException
 
 API = "https://api.github.com"
 HDR = {"Accept": "application/vnd.github+json"}
@@ -36,21 +39,29 @@ def _resolve_value(ref, region, profile=None, dry_run=False, skip_missing=False)
         raise
 
 def _require_scope(token, scope):
-    r = requests.get(API, headers={"Authorization": f"Bearer {token}", **HDR})
+    # only classic PATs report scopes; App installation tokens and fine-grained PATs are
+    # checked by the API itself (a 403 on the hook listing below)
+    r = gh_http.get(API, headers={"Authorization": f"Bearer {token}", **HDR})
+    if "x-oauth-scopes" not in r.headers:
+        return
     scopes = [s.strip() for s in r.headers.get("x-oauth-scopes","").split(",") if s.strip()]
     if scope not in scopes:
         raise SystemExit(f"ERROR: token missing required scope '{scope}'. Present: {scopes}")
 
-def main():
+def main(args=None):
     ap = argparse.ArgumentParser()
-    ap.add_argument("--owner", required=True)
+    ap.add_argument("--owner", help="Org login, or several comma-separated to reconcile them concurrently")
     ap.add_argument("--config", default="src/config/secrets.yaml")
     ap.add_argument("--ssm-token", default="insizon-github-admin-token")
     ap.add_argument("--region", default="us-east-2")
     ap.add_argument("--dry-run", action="store_true")
     ap.add_argument("--skip-missing", action="store_true")
     ap.add_argument("--profile", default=None)
-    args = ap.parse_args()
+    add_journal_args(ap)
+    add_org_args(ap)
+    args = args or ap.parse_args()
+    if multi_org(args):
+        return fan_out("org", main, args)
 
     cfg = load_yaml(args.config) or {}
 
@@ -61,12 +72,19 @@ def main():
             print(f"DRY: create org webhook -> {h['url']}")
         sys.exit(0)
 
-    tok = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=False)
+    tok = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=False, owner=args.owner)
     _require_scope(tok, "admin:org_hook")
     gh, org = gh_client(args.owner, tok)
+    journal = RunJournal.from_args("org", args)
 
     hooks = cfg.get("org_webhooks") or []
-    existing = {h.config.get("url"): h for h in org.get_hooks()}
+    try:
+        existing = {h.config.get("url"): h for h in org.get_hooks()}
+    except GithubException as e:
+        if e.status == 403:
+            raise SystemExit(f"ERROR: token cannot manage {args.owner} webhooks (needs admin:org_hook, or the App's "
+                             f"organization_hooks: write permission)")
+        raise
 
     for h in hooks:
         url = h["url"]
@@ -89,8 +107,10 @@ def main():
             "events": h.get("events", ["push"]),
             "active": bool(h.get("active", True))
         }
-        org.create_hook(**payload)
-        print(f"OK: org webhook created -> {url}")
+        if journal.step("org", f"webhook:{url}", org.create_hook, **payload):
+            print(f"OK: org webhook created -> {url}")
+
+    return journal.finish()
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -1,7 +1,14 @@
 #!/usr/bin/env python3
-import argparse, sys, json, requests
-from _common import load_yaml, get_token, gh_client
+import argparse, sys, os, json, time, hashlib
+from urllib.parse import quote
+from _common import load_yaml, get_token, gh_client, load_json, atomic_write_json, lookup_id, gh_http, pin, paginate, ObjectCache
+from _journal import RunJournal, add_journal_args
+from _metrics import METRICS
+from _graphql import MutationBatch, MAX_MUTATIONS, repo_nodes, journal_results
+from _orgs import add_org_args, multi_org, fan_out
+from _snapshot import Snapshot
 from github import GithubException
+from github.Repository import Repository
 
 API = "https://api.github.com"
 H = {"Accept": "application/vnd.github+json", "X-GitHub-Api-Version": "2022-11-28"}
@@ -9,9 +16,10 @@ def _h(tok): return {"Authorization": f"Bearer {tok}", **H}
 
 def _delete_branch_protection(owner, repo, branch, tok):
     url = f"{API}/repos/{owner}/{repo}/branches/{branch}/protection"
-    r = requests.delete(url, headers=_h(tok))
+    r = gh_http.delete(url, headers=_h(tok))
     if r.status_code not in (204, 404):
         raise SystemExit(f"Failed to delete protection {owner}/{repo}@{branch}: {r.status_code} {r.text}")
+    return r.status_code == 204
 
 def _apply_protection_from_spec(owner, repo, branch, spec, tok):
     ensure_branch_protection(owner, repo, branch, spec, tok, dry=False)
@@ -20,6 +28,10 @@ def upsert_file(repo, path, content_str, message, branch):
     from github import GithubException
     try:
         existing = repo.get_contents(path, ref=branch)
+        if existing.decoded_content == content_str.encode("utf-8"):
+            print(f"SKIP: {repo.full_name}:{path} unchanged on {branch}")
+            METRICS.count("file", "unchanged")
+            return True
         repo.update_file(path, message, content_str, existing.sha, branch=branch)
         print(f"OK: updated {repo.full_name}:{path} on {branch}")
         return True
@@ -59,10 +71,66 @@ def ensure_branch_protection(owner, repo, branch, spec, tok, dry):
         print(f"DRY: protect {owner}/{repo}@{branch} -> {json.dumps(payload)}")
         return
 
-    r = requests.put(url, headers=_h(tok), data=json.dumps(payload))
+    r = gh_http.put(url, headers=_h(tok), data=json.dumps(payload))
     if r.status_code not in (200, 201):
         raise SystemExit(f"Branch protection failed {owner}/{repo}@{branch}: {r.status_code} {r.text}")
 
+# ---------- batched branch protection (GraphQL) ----------
+RULE_FIELDS = ("id pattern isAdminEnforced requiresStatusChecks requiredStatusCheckContexts requiresStrictStatusChecks "
+               "requiresApprovingReviews requiredApprovingReviewCount dismissesStaleReviews requiresLinearHistory "
+               "allowsForcePushes allowsDeletions blocksCreations requiresConversationResolution")
+
+def _protection_input(branch, spec):
+    """BranchProtectionRule fields equivalent to ensure_branch_protection's REST payload."""
+    contexts = (spec.get("require_status_checks", {}) or {}).get("contexts", []) or []
+    reviews = "require_pr_reviews" in spec or bool(spec.get("dismiss_stale_reviews"))
+    return {
+        "pattern": branch,
+        "isAdminEnforced": bool(spec.get("enforce_admins", True)),
+        "requiresStatusChecks": bool(contexts),
+        "requiredStatusCheckContexts": contexts,
+        "requiresStrictStatusChecks": False,
+        "requiresApprovingReviews": reviews,
+        "requiredApprovingReviewCount": int(spec.get("require_pr_reviews", 0)),
+        "dismissesStaleReviews": bool(spec.get("dismiss_stale_reviews")),
+        "requiresLinearHistory": False,
+        "allowsForcePushes": False,
+        "allowsDeletions": False,
+        "blocksCreations": False,
+        "requiresConversationResolution": False,
+    }
+
+def _rule_matches(cur, want):
+    norm = lambda v: sorted(v) if isinstance(v, list) else v
+    return all(norm(cur.get(k)) == norm(v) for k, v in want.items())
+
+def apply_protections(owner, items, tok, journal, batch_size):
+    """
+    items: [(repo, branch, spec)]. One aliased query reads every repo's rules,
+    then only missing/differing rules are created/updated, in batched mutations.
+    """
+    nodes = repo_nodes(tok, owner, {repo for repo, _, _ in items},
+                       f"id branchProtectionRules(first: 100) {{ nodes {{ {RULE_FIELDS} }} }}")
+    batch, steps = MutationBatch(tok, batch_size), []
+    for repo, branch, spec in items:
+        key = f"{repo}@{branch}"
+        node = nodes.get(repo)
+        want = _protection_input(branch, spec)
+        cur = next((r for r in node["branchProtectionRules"]["nodes"] if r["pattern"] == branch), None) if node else None
+        if node is None:
+            batch.fail(key, f"repo {repo} not found")
+        elif cur is not None and _rule_matches(cur, want):
+            print(f"SKIP: {owner}/{key} protection unchanged")
+            METRICS.count("branch_protection", "unchanged")
+            continue
+        elif cur is None:
+            batch.add(key, "createBranchProtectionRule", "CreateBranchProtectionRuleInput", {"repositoryId": node["id"], **want})
+        else:
+            batch.add(key, "updateBranchProtectionRule", "UpdateBranchProtectionRuleInput", {"branchProtectionRuleId": cur["id"], **want})
+        steps.append((f"repo:{repo}", f"protect:{branch}", key, f"OK: protected {owner}/{key}"))
+    batch.run()
+    journal_results(journal, batch, steps)
+
 def ensure_rulesets(owner, repo, rulesets, tok, dry):
     url = f"{API}/repos/{owner}/{repo}/rulesets"
     if dry:
@@ -76,22 +144,330 @@ def ensure_rulesets(owner, repo, rulesets, tok, dry):
             "conditions": rs.get("conditions", {}),
             "rules": rs.get("rules", {})
         }
-        r = requests.post(url, headers=_h(tok), data=json.dumps(payload))
+        r = gh_http.post(url, headers=_h(tok), data=json.dumps(payload))
         if r.status_code not in (201, 200, 422):
             raise SystemExit(f"Ruleset create failed {owner}/{repo}: {r.status_code} {r.text}")
 
-def ensure_branch(repo, branch, from_branch="main"):
-    try:
-        repo.get_branch(branch)
-    except GithubException:
-        base = repo.get_branch(from_branch)
-        repo.create_git_ref(ref=f"refs/heads/{branch}", sha=base.commit.sha)
+def _drop_superseded_protection(owner, repo, branch, tok):
+    if _delete_branch_protection(owner, repo, branch, tok):
+        print(f"OK: removed classic protection on {owner}/{repo}@{branch} (superseded by org ruleset)")
+
+def _drop_superseded_ruleset(owner, repo, name, tok):
+    url = f"{API}/repos/{owner}/{repo}/rulesets"
+    for rs in paginate(url, tok, {"includes_parents": "false"}, allow_404=True):
+        if rs["name"] != name:
+            continue
+        r = gh_http.delete(f"{url}/{rs['id']}", headers=_h(tok))
+        if r.status_code not in (204, 404):
+            raise SystemExit(f"Ruleset delete failed {owner}/{repo}/{name}: {r.status_code} {r.text}")
+        print(f"OK: removed ruleset {name} on {owner}/{repo} (superseded by org ruleset)")
+
+# ---------- org-level rulesets ----------
+ORG_ADMIN_BYPASS = {"actor_id": 1, "actor_type": "OrganizationAdmin", "bypass_mode": "always"}
+
+def _rules_list(rules):
+    """Ruleset rules as the API list form; YAML may use the {type: parameters} shorthand."""
+    if isinstance(rules, list):
+        return sorted(rules, key=lambda r: r["type"])
+    return [{"type": t, **({"parameters": p} if p else {})} for t, p in sorted((rules or {}).items())]
+
+def _protection_rules(spec):
+    """A protected_branches entry expressed as ruleset rules (same semantics as ensure_branch_protection)."""
+    rules = {"deletion": {}, "non_fast_forward": {}}
+    if "require_pr_reviews" in spec or spec.get("dismiss_stale_reviews"):
+        rules["pull_request"] = {
+            "required_approving_review_count": int(spec.get("require_pr_reviews", 0)),
+            "dismiss_stale_reviews_on_push": bool(spec.get("dismiss_stale_reviews")),
+            "require_code_owner_review": False,
+            "require_last_push_approval": False,
+            "required_review_thread_resolution": False,
+        }
+    contexts = (spec.get("require_status_checks") or {}).get("contexts", []) or []
+    if contexts:
+        rules["required_status_checks"] = {
+            "strict_required_status_checks_policy": False,
+            "required_status_checks": [{"context": c} for c in contexts],
+        }
+    bypass = [] if spec.get("enforce_admins", True) else [ORG_ADMIN_BYPASS]
+    return _rules_list(rules), bypass
+
+def compile_org_rulesets(cfg):
+    """
+    Fold identical per-repo protection into org rulesets targeting repo names.
+    Returns (desired {name: payload}, covered {(repo, "protect"|"ruleset", name): org ruleset name}).
+    Only groups shared by at least `min_repos` repos are compiled; the rest stay per-repo,
+    as does the branch a repo's `workflows:` are committed to. Once the org rulesets
+    are applied, main() removes the per-repo protection/rulesets they supersede.
+    """
+    ocfg = cfg.get("org_rulesets") or {}
+    desired, covered = {}, {}
+    for rs in ocfg.get("rulesets", []) or []:
+        desired[rs["name"]] = {
+            "name": rs["name"],
+            "target": rs.get("target", "branch"),
+            "enforcement": rs.get("enforcement", "active"),
+            "conditions": rs.get("conditions", {}),
+            "rules": _rules_list(rs.get("rules", {})),
+            "bypass_actors": rs.get("bypass_actors", []),
+        }
+    if not ocfg.get("compile"):
+        return desired, covered
+
+    prefix = ocfg.get("prefix", "auto-")
+    groups = {}
+    for spec in cfg.get("repos", []) or []:
+        repo = spec["name"]
+        # workflow commits land on the default branch, and --allow-unprotect can only lift
+        # classic protection, so that branch keeps it instead of joining an org ruleset
+        wf_branch = spec.get("default_branch", "main") if spec.get("workflows") else None
+        for p in spec.get("protected_branches", []) or []:
+            if p["name"] == wf_branch:
+                continue
+            rules, bypass = _protection_rules(p)
+            body = {"target": "branch", "enforcement": "active", "ref": [f"refs/heads/{p['name']}"], "rules": rules, "bypass_actors": bypass}
+            groups.setdefault(json.dumps(body, sort_keys=True), (p["name"], body, []))[2].append((repo, "protect", p["name"]))
+        for rs in spec.get("rulesets", []) or []:
+            cond = dict(rs.get("conditions", {}) or {})
+            ref = (cond.pop("ref_name", {}) or {}).get("include", [])
+            if cond:
+                continue  # already has non-ref conditions; leave it per-repo
+            body = {"target": rs.get("target", "branch"), "enforcement": rs.get("enforcement", "active"), "ref": ref,
+                    "rules": _rules_list(rs.get("rules", {})), "bypass_actors": []}
+            groups.setdefault(json.dumps(body, sort_keys=True), (rs["name"], body, []))[2].append((repo, "ruleset", rs["name"]))
+
+    for key, (label, body, members) in groups.items():
+        repos = sorted({m[0] for m in members})
+        if len(repos) < int(ocfg.get("min_repos", 2)):
+            continue
+        name = f"{prefix}{label.replace('/', '-')}-{hashlib.sha256(key.encode()).hexdigest()[:8]}"
+        desired[name] = {
+            "name": name,
+            "target": body["target"],
+            "enforcement": body["enforcement"],
+            "conditions": {
+                "ref_name": {"include": body["ref"], "exclude": []},
+                "repository_name": {"include": repos, "exclude": [], "protected": False},
+            },
+            "rules": body["rules"],
+            "bypass_actors": body["bypass_actors"],
+        }
+        covered.update(dict.fromkeys(members, name))
+    return desired, covered
+
+def _subset(want, have):
+    """True when every value we manage in `want` is already present in `have` (server adds defaults)."""
+    if isinstance(want, dict):
+        return isinstance(have, dict) and all(_subset(v, have.get(k)) for k, v in want.items())
+    if isinstance(want, list):
+        if not isinstance(have, list) or len(want) != len(have):
+            return False
+        key = lambda x: json.dumps(x, sort_keys=True)
+        if want and isinstance(want[0], dict) and "type" in want[0]:
+            key = lambda x: x.get("type", "")
+        return all(_subset(w, h) for w, h in zip(sorted(want, key=key), sorted(have, key=key)))
+    return want == have
+
+def ensure_org_rulesets(owner, desired, prefix, tok, dry):
+    """Diff desired org rulesets against the org; create/update changed ones and delete stale compiled ones."""
+    url = f"{API}/orgs/{owner}/rulesets"
+    if dry:
+        for name, payload in sorted(desired.items()):
+            repos = payload["conditions"].get("repository_name", {}).get("include", [])
+            print(f"DRY: org ruleset {name} -> {len(repos)} repos: {json.dumps(payload)}")
+        return
+    existing = {rs["name"]: rs for rs in paginate(url, tok)}
+    for name, payload in sorted(desired.items()):
+        cur = existing.get(name)
+        if cur is None:
+            rr = gh_http.post(url, headers=_h(tok), data=json.dumps(payload))
+            if rr.status_code not in (200, 201):
+                raise SystemExit(f"Org ruleset create failed {owner}/{name}: {rr.status_code} {rr.text}")
+            print(f"OK: org ruleset created {name}")
+            continue
+        detail = gh_http.get(f"{url}/{cur['id']}", headers=_h(tok)); detail.raise_for_status()
+        if _subset(payload, detail.json()):
+            print(f"SKIP: org ruleset {name} unchanged")
+            METRICS.count("org_ruleset", "unchanged")
+            continue
+        rr = gh_http.put(f"{url}/{cur['id']}", headers=_h(tok), data=json.dumps(payload))
+        if rr.status_code != 200:
+            raise SystemExit(f"Org ruleset update failed {owner}/{name}: {rr.status_code} {rr.text}")
+        print(f"OK: org ruleset updated {name}")
+    for name, cur in sorted(existing.items()):
+        if prefix and name.startswith(prefix) and name not in desired:
+            rr = gh_http.delete(f"{url}/{cur['id']}", headers=_h(tok))
+            if rr.status_code not in (204, 404):
+                raise SystemExit(f"Org ruleset delete failed {owner}/{name}: {rr.status_code} {rr.text}")
+            print(f"OK: org ruleset removed {name} (no longer compiled)")
+
+def ensure_branch(repo, branch, from_branch="main", known=None):
+    if known is not None:
+        if branch in known:
+            return
+    else:
+        try:
+            repo.get_branch(branch); return
+        except GithubException:
+            pass
+    base = repo.get_branch(from_branch)
+    repo.create_git_ref(ref=f"refs/heads/{branch}", sha=base.commit.sha)
+
+# ---------- creation & settings ----------
+def _security_payload(spec):
+    sa = spec.get("security_and_analysis") or {}
+    return {k: {"status": v} for k, v in sa.items()}
+
+def create_repo_full(gh, owner, spec, tok):
+    """
+    One request for a missing repo: generate from `template` (workflows and,
+    with include_all_branches, branches included) or create with every setting
+    the create endpoint accepts. Returns a Repository built from the response.
+    """
+    name = spec["name"]
+    vis = spec.get("visibility", "private")
+    tpl = spec.get("template")
+    if tpl:
+        tpl = {"repo": tpl} if isinstance(tpl, str) else tpl
+        url = f"{API}/repos/{tpl['repo']}/generate"
+        payload = {"owner": owner, "name": name, "description": spec.get("description", ""),
+                   "private": vis != "public", "include_all_branches": bool(tpl.get("include_all_branches", True))}
+    else:
+        url = f"{API}/orgs/{owner}/repos"
+        payload = {**(spec.get("settings") or {}), "name": name, "description": spec.get("description", ""),
+                   "visibility": vis, "auto_init": True}
+    r = gh_http.post(url, headers=_h(tok), data=json.dumps(payload))
+    if r.status_code != 201:
+        raise SystemExit(f"Repo create failed {owner}/{name}: {r.status_code} {r.text}")
+    print(f"OK: created {owner}/{name}" + (f" from template {tpl['repo']}" if tpl else ""))
+    raw = r.json()
+    if tpl:
+        _wait_for_branch(owner, name, raw.get("default_branch") or "main", tok)
+    return gh.create_from_raw_data(Repository, raw)
+
+def _wait_for_branch(owner, repo, branch, tok, timeout=60):
+    """Template generation returns before the contents exist; wait until the default branch does."""
+    url, delay, deadline = f"{API}/repos/{owner}/{repo}/branches/{quote(branch, safe='')}", 1, time.time() + timeout
+    while True:
+        r = gh_http.get(url, headers=_h(tok))
+        if r.status_code == 200:
+            return
+        if time.time() + delay > deadline:
+            print(f"WARN: {owner}/{repo}@{branch} still missing {timeout}s after generating from template; continuing")
+            return
+        time.sleep(delay)
+        delay = min(delay * 2, 8)
+
+def residual_settings(spec, raw, branches):
+    """Fields of PATCH /repos/{owner}/{repo} whose desired value differs from the repo's current state."""
+    patch = {k: v for k, v in (spec.get("settings") or {}).items() if raw.get(k) != v}
+    if "description" in spec and (raw.get("description") or "") != spec["description"]:
+        patch["description"] = spec["description"]
+    cur_sa = raw.get("security_and_analysis") or {}
+    sa = {k: v for k, v in _security_payload(spec).items() if (cur_sa.get(k) or {}).get("status") != v["status"]}
+    if sa:
+        patch["security_and_analysis"] = sa
+    def_branch = spec.get("default_branch", "main")
+    if raw.get("default_branch") != def_branch and def_branch in branches:
+        patch["default_branch"] = def_branch
+    return patch
+
+def apply_settings(gh, owner, repo, patch, tok):
+    r = gh_http.patch(f"{API}/repos/{owner}/{repo.name}", headers=_h(tok), data=json.dumps(patch))
+    if r.status_code != 200:
+        raise SystemExit(f"Repo settings failed {owner}/{repo.name}: {r.status_code} {r.text}")
+    print(f"OK: {repo.name} settings -> {sorted(patch)}")
+    return gh.create_from_raw_data(Repository, r.json())
+
+# ---------- environments ----------
+def _env_spec(e):
+    return {"name": e} if isinstance(e, str) else e
+
+def env_branches(spec):
+    """Environment names that also get a branch of the same name (opt out with branch: false)."""
+    return [e["name"] for e in map(_env_spec, spec.get("environments", [])) if e.get("branch", True)]
+
+def _env_desired(owner, e, tok):
+    """Normalized protection for an environment spec, plus its custom branch patterns."""
+    rev = e.get("reviewers") or {}
+    reviewers = [("Team", lookup_id("team", owner, t, tok)) for t in rev.get("teams", [])]
+    reviewers += [("User", lookup_id("user", owner, u, tok)) for u in rev.get("users", [])]
+    db = e.get("deployment_branches")
+    if db is None:
+        policy, patterns = None, []
+    elif db == "protected":
+        policy, patterns = {"protected_branches": True, "custom_branch_policies": False}, []
+    else:
+        policy, patterns = {"protected_branches": False, "custom_branch_policies": True}, sorted(db)
+    want = {"wait_timer": int(e.get("wait_timer", 0)), "prevent_self_review": bool(e.get("prevent_self_review", False)),
+            "reviewers": sorted(reviewers), "deployment_branch_policy": policy}
+    return want, patterns
+
+def _env_current(e):
+    """Same shape as _env_desired, from a GET .../environments entry."""
+    cur = {"wait_timer": 0, "prevent_self_review": False, "reviewers": [], "deployment_branch_policy": None}
+    for rule in e.get("protection_rules") or []:
+        if rule.get("type") == "wait_timer":
+            cur["wait_timer"] = rule.get("wait_timer", 0)
+        elif rule.get("type") == "required_reviewers":
+            cur["prevent_self_review"] = bool(rule.get("prevent_self_review", False))
+            cur["reviewers"] = sorted((r["type"], r["reviewer"]["id"]) for r in rule.get("reviewers") or [])
+    dbp = e.get("deployment_branch_policy")
+    if dbp:
+        cur["deployment_branch_policy"] = {"protected_branches": bool(dbp.get("protected_branches")),
+                                           "custom_branch_policies": bool(dbp.get("custom_branch_policies"))}
+    return cur
+
+def _sync_branch_policies(owner, repo, env, patterns, tok):
+    url = f"{API}/repos/{owner}/{repo}/environments/{quote(env, safe='')}/deployment-branch-policies"
+    have = {p["name"]: p["id"] for p in paginate(url, tok, key="branch_policies")}
+    for pat in patterns:
+        if pat not in have:
+            rr = gh_http.post(url, headers=_h(tok), data=json.dumps({"name": pat, "type": "branch"}))
+            if rr.status_code not in (200, 201):
+                raise SystemExit(f"Branch policy create failed {owner}/{repo}:{env} {pat}: {rr.status_code} {rr.text}")
+            print(f"OK: {repo}:{env} deploys from {pat}")
+    for pat, pid in have.items():
+        if pat not in patterns:
+            rr = gh_http.delete(f"{url}/{pid}", headers=_h(tok))
+            if rr.status_code not in (204, 404):
+                raise SystemExit(f"Branch policy delete failed {owner}/{repo}:{env} {pat}: {rr.status_code} {rr.text}")
+            print(f"OK: {repo}:{env} no longer deploys from {pat}")
+
+def ensure_environments(owner, repo, envs, tok, dry):
+    """
+    One listing of the repo's environments, then a PUT only for those whose
+    normalized wait timer / reviewers / branch policy differ from the spec.
+    """
+    envs = [_env_spec(e) for e in envs]
+    if dry:
+        for e in envs:
+            extra = {k: v for k, v in e.items() if k not in ("name", "branch")}
+            print(f"DRY: ensure environment {e['name']}" + (f" {json.dumps(extra)}" if extra else ""))
+        return
+    base = f"{API}/repos/{owner}/{repo}/environments"
+    current = {e["name"]: e for e in paginate(base, tok, key="environments", allow_404=True)}  # 404: none yet
+    for e in envs:
+        name = e["name"]
+        want, patterns = _env_desired(owner, e, tok)
+        have = current.get(name)
+        if have is not None and _env_current(have) == want:
+            print(f"SKIP: environment {repo}:{name} unchanged")
+            METRICS.count("environment", "unchanged")
+        else:
+            payload = {"wait_timer": want["wait_timer"], "prevent_self_review": want["prevent_self_review"],
+                       "reviewers": [{"type": t, "id": i} for t, i in want["reviewers"]],
+                       "deployment_branch_policy": want["deployment_branch_policy"]}
+            r = gh_http.put(f"{base}/{quote(name, safe='')}", headers=_h(tok), data=json.dumps(payload))
+            if r.status_code != 200:
+                raise SystemExit(f"Environment update failed {owner}/{repo}:{name}: {r.status_code} {r.text}")
+            print(f"OK: environment {repo}:{name} {'created' if have is None else 'updated'}")
+        if want["deployment_branch_policy"] and want["deployment_branch_policy"]["custom_branch_policies"]:
+            _sync_branch_policies(owner, repo, name, patterns, tok)
 
 def ensure_repo_webhooks(owner, repo, hooks, tok):
     # list, ensure present; create if missing
     url = f"{API}/repos/{owner}/{repo.name}/hooks"
-    r = requests.get(url, headers=_h(tok)); r.raise_for_status()
-    existing = {h["config"].get("url"): h for h in r.json()}
+    existing = {h["config"].get("url"): h for h in paginate(url, tok)}
     for h in hooks or []:
         u = h["url"]
         if u in existing:
@@ -108,10 +484,49 @@ def ensure_repo_webhooks(owner, repo, hooks, tok):
           "events": h.get("events", ["push"]),
           "active": bool(h.get("active", True))
         }
-        rr = requests.post(url, headers=_h(tok), json=payload)
+        rr = gh_http.post(url, headers=_h(tok), json=payload)
         rr.raise_for_status()
         print(f"OK: repo webhook created -> {u}")
 
+def spec_fingerprint(spec, coverage=()):
+    """
+    Hash of the normalized spec plus the content of every referenced workflow
+    source_file and the org rulesets covering the repo ((kind, name, ruleset)
+    entries), since coverage depends on the other repos' specs too.
+    """
+    h = hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode("utf-8"))
+    if coverage:
+        h.update(json.dumps(sorted(coverage)).encode("utf-8"))
+    for wf in spec.get("workflows", []) or []:
+        try:
+            with open(wf["source_file"], "rb") as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        except OSError:
+            h.update(b"<missing>")  # reconcile will surface the error
+    return h.hexdigest()
+
+def remote_stamp(repo):
+    return f"{repo.pushed_at and repo.pushed_at.isoformat()}|{repo.updated_at and repo.updated_at.isoformat()}"
+
+def _store_fingerprints(org, journal, reconciled, fp_path, fingerprints):
+    """
+    Write fingerprints for the repos that converged: no failed step and every
+    batched protection applied. Stamps are re-read since our own writes bump them.
+    """
+    failed = {o for o, _, _ in journal.failures}
+    stored = 0
+    for name, fp, protects in reconciled:
+        obj = f"repo:{name}"
+        if obj in failed or not all(journal.done(obj, a) for a in protects):
+            continue
+        try:
+            fingerprints[name] = {"spec": fp, "remote": remote_stamp(org.get_repo(name))}
+            stored += 1
+        except Exception as e:
+            print(f"WARN: could not store fingerprint for {name}: {e}")
+    if stored:
+        atomic_write_json(fp_path, fingerprints)
+
 def upsert_with_unprotect(owner, token, repo, path, content_str, message, branch, protected_specs, allow_unprotect=False):
     try:
         return upsert_file(repo, path, content_str, message, branch)
@@ -129,27 +544,95 @@ def upsert_with_unprotect(owner, token, repo, path, content_str, message, branch
                 print(f"OK: re-applied protection on {repo.full_name}@{branch}")
         return ok
 
-def main():
+def plan_from_snapshot(snap, spec, covered):
+    """Dry-run plan for one repo as a diff against a local snapshot (snapshot.py); no API calls."""
+    name = spec["name"]
+    have = snap.repo(name) or (snap.repo(spec["rename_from"]) if spec.get("rename_from") else None)
+    if have is None:
+        print(f"DRY: would create repo (vis={spec.get('visibility','private')})")
+        have = {}
+    elif have["name"] != name:
+        print(f"DRY: would rename {have['name']} -> {name}")
+    if have.get("archived"):
+        print(f"DRY: would unarchive {name}")
+    src = have.get("name", name)
+    topics = spec.get("topics", [])
+    if topics and sorted(have.get("topics") or []) != sorted(topics):
+        print(f"DRY: set topics {topics} on {name} (now {have.get('topics') or []})")
+    def_branch = spec.get("default_branch", "main")
+    if have.get("default_branch") != def_branch:
+        print(f"DRY: set default branch to {def_branch} on {name} (now {have.get('default_branch')})")
+    branches = {def_branch, *(b["name"] for b in spec.get("protected_branches", [])), *env_branches(spec)}
+    present = snap.children("branch", src)
+    for b in sorted(branches - set(present)):
+        print(f"DRY: create branch {b}")
+    protected = snap.children("protection", src)
+    for p in spec.get("protected_branches", []):
+        if (name, "protect", p["name"]) in covered:
+            if p["name"] in protected:
+                print(f"DRY: remove classic protection on {name}@{p['name']} (superseded by org ruleset)")
+            continue
+        print(f"DRY: {'update' if p['name'] in protected else 'add'} protection on {name}@{p['name']}")
+    rulesets = snap.children("ruleset", src)
+    for r in spec.get("rulesets", []) or []:
+        if (name, "ruleset", r["name"]) not in covered:
+            print(f"DRY: {'update' if r['name'] in rulesets else 'create'} ruleset {r['name']}")
+        elif r["name"] in rulesets:
+            print(f"DRY: remove ruleset {r['name']} (superseded by org ruleset)")
+    envs = snap.children("environment", src)
+    for e in map(_env_spec, spec.get("environments", []) or []):
+        print(f"DRY: {'update' if e['name'] in envs else 'create'} environment {e['name']}")
+    hooks = {h.get("config", {}).get("url") for h in snap.children("hook", src).values()}
+    for rwh in spec.get("repo_webhooks", []) or []:
+        if rwh["url"] not in hooks:
+            print(f"DRY: create repo webhook -> {rwh['url']}")
+    for wf in spec.get("workflows", []): print(f"DRY: upsert workflow {wf['path']} from {wf['source_file']} (on {def_branch})")
+
+def main(args=None):
     ap = argparse.ArgumentParser()
-    ap.add_argument("--owner", required=True)
+    ap.add_argument("--owner", help="Org login, or several comma-separated to reconcile them concurrently")
     ap.add_argument("--config", default="src/config/repos.yaml")
     ap.add_argument("--ssm-token", default="insizon-github-admin-token")
     ap.add_argument("--region", default="us-east-2")
     ap.add_argument("--dry-run", action="store_true")
     ap.add_argument("--profile", default=None)
     ap.add_argument("--allow-unprotect", action="store_true")
-    args = ap.parse_args()
+    ap.add_argument("--full", action="store_true", help="Reconcile every repo, ignoring stored fingerprints")
+    ap.add_argument("--graphql-batch", type=int, default=MAX_MUTATIONS, help="Branch protection writes per GraphQL request")
+    ap.add_argument("--only", action="append", default=None, metavar="NAME", help="Reconcile only these repos (repeatable)")
+    ap.add_argument("--snapshot", nargs="?", const="auto", default=None, metavar="DB",
+                    help="With --dry-run: plan against a local snapshot (snapshot.py refresh) instead of printing every step")
+    add_journal_args(ap)
+    add_org_args(ap)
+    args = args or ap.parse_args()
+    if multi_org(args):
+        return fan_out("repos", main, args)
 
     cfg = load_yaml(args.config)
+    # compile from the full config so --only never narrows an org ruleset's repo list
+    org_rs, covered = compile_org_rulesets(cfg)
+    org_rs_prefix = (cfg.get("org_rulesets") or {}).get("prefix", "auto-") if (cfg.get("org_rulesets") or {}).get("compile") else None
+    if args.only:
+        cfg["repos"] = [x for x in cfg.get("repos", []) if x["name"] in args.only or x.get("rename_from") in args.only]
 
     if args.dry_run:
         # Pure simulation: no network calls.
+        snap = Snapshot.open(args.owner, args.state_dir, args.snapshot) if args.snapshot else None
+        if org_rs or org_rs_prefix:
+            ensure_org_rulesets(args.owner, org_rs, org_rs_prefix, tok="DRY", dry=True)
         for spec in cfg.get("repos", []):
             name = spec["name"]
             print(f"==> Repo: {name}")
+            if snap:
+                plan_from_snapshot(snap, spec, covered)
+                continue
             if spec.get("rename_from"):
                 print(f"DRY: would rename {spec['rename_from']} -> {name}")
-            print(f"DRY: would ensure repo exists (vis={spec.get('visibility','private')})")
+            tpl = spec.get("template")
+            tpl = (tpl if isinstance(tpl, str) else tpl.get("repo")) if tpl else None
+            print(f"DRY: would ensure repo exists (vis={spec.get('visibility','private')}" + (f", template={tpl}" if tpl else "") + ")")
+            if spec.get("settings") or spec.get("security_and_analysis"):
+                print(f"DRY: settings {json.dumps({**(spec.get('settings') or {}), **({'security_and_analysis': _security_payload(spec)} if spec.get('security_and_analysis') else {})})}")
             topics = spec.get("topics", [])
             if topics:
                 print(f"DRY: set topics {topics} on {name}")
@@ -157,96 +640,151 @@ def main():
             print(f"DRY: set default branch to {def_branch} on {name}")
             branches = {def_branch}
             for b in spec.get("protected_branches", []): branches.add(b["name"])
-            for env in spec.get("environments", []): branches.add(env)
+            branches.update(env_branches(spec))
             for b in sorted(branches): print(f"DRY: ensure branch {b}")
-            for env in spec.get("environments", []): print(f"DRY: ensure environment {env}")
+            ensure_environments(args.owner, name, spec.get("environments", []), tok="DRY", dry=True)
             for wf in spec.get("workflows", []): print(f"DRY: upsert workflow {wf['path']} from {wf['source_file']} (on {def_branch})")
-            for p in spec.get("protected_branches", []): ensure_branch_protection(args.owner, name, p["name"], p, tok="DRY", dry=True)
-            rs = spec.get("rulesets", [])
+            for p in spec.get("protected_branches", []):
+                if (name, "protect", p["name"]) in covered: print(f"DRY: {name}@{p['name']} protected by org ruleset (classic protection on it removed)")
+                else: ensure_branch_protection(args.owner, name, p["name"], p, tok="DRY", dry=True)
+            rs = [r for r in spec.get("rulesets", []) or [] if (name, "ruleset", r["name"]) not in covered]
             if rs: ensure_rulesets(args.owner, name, rs, tok="DRY", dry=True)
+            for r in spec.get("rulesets", []) or []:
+                if (name, "ruleset", r["name"]) in covered: print(f"DRY: {name} ruleset {r['name']} folded into an org ruleset (repo copy removed)")
             for rwh in spec.get("repo_webhooks", []) or []: print(f"DRY: repo webhook -> {rwh['url']}")
         sys.exit(0)
 
-    token = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=False)
+    token = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=False, owner=args.owner)
     gh, org = gh_client(args.owner, token)
+    cache = ObjectCache(gh, org)
+    journal = RunJournal.from_args("repos", args)
+
+    if org_rs or org_rs_prefix:
+        journal.step("org", "rulesets", ensure_org_rulesets, args.owner, org_rs, org_rs_prefix, token, dry=False)
 
-    for spec in cfg.get("repos", []):
-        name = spec["name"]
-        rename_from = spec.get("rename_from")
+    # fingerprints of the last successful reconcile: spec hash + remote pushed_at/updated_at
+    fp_path = os.path.join(args.state_dir, "fingerprints", f"{args.owner}-repos.json")
+    fingerprints = load_json(fp_path, {}) or {}
+    with METRICS.stage("list_repos"):
+        listed = [] if args.full else list(org.get_repos())  # one paginated listing, which also seeds the cache
+    for r in listed:
+        cache.put("repo", r.name, r)
+    remote = {r.name: remote_stamp(r) for r in listed}
+    protections, reconciled = [], []  # protections go out as one GraphQL batch after the loop
 
-        # rename if requested
-        if rename_from and rename_from != name:
+    try:
+        for spec in cfg.get("repos", []):
+            name = spec["name"]
+            obj = f"repo:{name}"
+            pin(token, name)  # with a token pool, one identity writes this repo
+            fp = spec_fingerprint(spec, [(k, n, rs) for (r, k, n), rs in covered.items() if r == name])
+            prev = fingerprints.get(name) or {}
+            if not args.full and prev.get("spec") == fp and name in remote and prev.get("remote") == remote[name]:
+                print(f"SKIP: {name} unchanged since last reconcile (use --full to force)")
+                METRICS.count("repo", "unchanged")
+                continue
+            rename_from = spec.get("rename_from")
+
+            # rename if requested
+            if rename_from and rename_from != name:
+                def _rename():
+                    old = cache.repo(rename_from)
+                    if old is None:
+                        print(f"WARN: rename_from '{rename_from}' not found; creating {name} fresh")
+                        return
+                    print(f"==> Renaming repo {rename_from} -> {name}")
+                    old.edit(name=name)
+                    cache.forget("repo", rename_from)
+                    cache.put("repo", name, old)
+                journal.step(obj, "rename", _rename)
+
+            print(f"==> Repo: {name}")
             try:
-                old = org.get_repo(rename_from)
-                print(f"==> Renaming repo {rename_from} -> {name}")
-                old.edit(name=name)
+                repo = cache.repo(name); exists = repo is not None
             except Exception:
-                print(f"WARN: rename_from '{rename_from}' not found; creating {name} fresh")
+                exists = False
 
-        print(f"==> Repo: {name}")
-        try:
-            repo = org.get_repo(name); exists = True
-        except Exception:
-            exists = False
-
-        if not exists:
-            repo = org.create_repo(
-                name=name,
-                description=spec.get("description",""),
-                private=(spec.get("visibility","private")!="public"),
-                auto_init=True
-            )
-
-        # topics
-        topics = spec.get("topics", [])
-        if topics: repo.replace_topics(topics)
-
-        # default branch
-        def_branch = spec.get("default_branch", "main")
-        if repo.default_branch != def_branch:
-            try: repo.edit(default_branch=def_branch)
-            except Exception: pass
-
-        # branches + envs
-        branches = {def_branch}
-        for b in spec.get("protected_branches", []): branches.add(b["name"])
-        for env in spec.get("environments", []): branches.add(env)
-        for b in branches:
-            if b != repo.default_branch:
-                ensure_branch(repo, b, from_branch=repo.default_branch)
-        for env in spec.get("environments", []):
-            try: repo.create_environment(env)
-            except Exception: pass
-
-        # WORKFLOWS FIRST (to avoid 409 on protected branches) — with safe auto-unprotect
-        prot_specs = spec.get("protected_branches", [])
-        for wf in spec.get("workflows", []):
-            with open(wf["source_file"], "r", encoding="utf-8") as f:
-                content = f.read()
-            upsert_with_unprotect(
-                owner=args.owner,
-                token=token,
-                repo=repo,
-                path=wf["path"],
-                content_str=content,
-                message=wf.get("message","chore: add workflow"),
-                branch=repo.default_branch,
-                protected_specs=prot_specs,
-                allow_unprotect=args.allow_unprotect
-            )
-
-        # THEN protection & rulesets
-        for p in spec.get("protected_branches", []):
-            ensure_branch_protection(args.owner, name, p["name"], p, token, dry=False)
-
-        rs = spec.get("rulesets", [])
-        if rs:
-            ensure_rulesets(args.owner, name, rs, token, dry=False)
-
-        # repo webhooks (optional – not implemented yet)
-        # for rwh in spec.get("repo_webhooks", []) or []:
-        #     print("NOTE: repo_webhooks live handling not implemented in this path")
-        # ensure_repo_webhooks(args.owner, repo, spec.get("repo_webhooks", []), token)
+            if not exists:
+                repo = journal.step(obj, "create", create_repo_full, gh, args.owner, spec, token)
+                if repo is None:
+                    continue  # creation failed under --continue-on-error; nothing else can apply
+
+            # topics (only when they differ)
+            topics = spec.get("topics", [])
+            if topics and sorted(repo.topics or []) != sorted(topics):
+                journal.step(obj, "topics", repo.replace_topics, topics)
+
+            # branches + envs (one listing instead of a GET per branch)
+            def_branch = spec.get("default_branch", "main")
+            branches = {def_branch}
+            for b in spec.get("protected_branches", []): branches.add(b["name"])
+            branches.update(env_branches(spec))
+            known = {b.name for b in repo.get_branches()} if branches - {repo.default_branch} else {repo.default_branch}
+            for b in sorted(branches):
+                if b not in known:
+                    journal.step(obj, f"branch:{b}", ensure_branch, repo, b, from_branch=repo.default_branch, known=known)
+                    known.add(b)
+
+            # settings + default branch in a single PATCH, only for what differs
+            patch = residual_settings(spec, repo.raw_data, known)
+            if patch:
+                repo = journal.step(obj, "settings", apply_settings, gh, args.owner, repo, patch, token) or repo
+
+            if spec.get("environments"):
+                journal.step(obj, "environments", ensure_environments, args.owner, name, spec["environments"], token, dry=False)
+
+            # WORKFLOWS FIRST (to avoid 409 on protected branches) — with safe auto-unprotect
+            prot_specs = [p for p in spec.get("protected_branches", []) if (name, "protect", p["name"]) not in covered]
+            for wf in spec.get("workflows", []):
+                def _workflow(wf=wf):
+                    with open(wf["source_file"], "r", encoding="utf-8") as f:
+                        content = f.read()
+                    return upsert_with_unprotect(
+                        owner=args.owner,
+                        token=token,
+                        repo=repo,
+                        path=wf["path"],
+                        content_str=content,
+                        message=wf.get("message","chore: add workflow"),
+                        branch=repo.default_branch,
+                        protected_specs=prot_specs,
+                        allow_unprotect=args.allow_unprotect
+                    )
+                journal.step(obj, f"workflow:{wf['path']}", _workflow)
+
+            # THEN protection (batched after the loop) & rulesets; what an org ruleset enforces
+            # loses its per-repo copy, but only once the org rulesets are in place
+            org_ok = journal.done("org", "rulesets")
+            for p in spec.get("protected_branches", []):
+                if (name, "protect", p["name"]) in covered:
+                    if org_ok:
+                        journal.step(obj, f"unprotect:{p['name']}", _drop_superseded_protection, args.owner, name, p["name"], token)
+                    continue
+                if not journal.done(obj, f"protect:{p['name']}"):
+                    protections.append((name, p["name"], p))
+
+            for rs in spec.get("rulesets", []) or []:
+                if (name, "ruleset", rs["name"]) in covered:
+                    if org_ok:
+                        journal.step(obj, f"remove_ruleset:{rs['name']}", _drop_superseded_ruleset, args.owner, name, rs["name"], token)
+                    continue
+                journal.step(obj, f"ruleset:{rs['name']}", ensure_rulesets, args.owner, name, [rs], token, dry=False)
+
+            # repo webhooks (optional – not implemented yet)
+            # for rwh in spec.get("repo_webhooks", []) or []:
+            #     print("NOTE: repo_webhooks live handling not implemented in this path")
+            # ensure_repo_webhooks(args.owner, repo, spec.get("repo_webhooks", []), token)
+
+            reconciled.append((name, fp, [f"protect:{b}" for n, b, _ in protections if n == name]))
+
+        if protections:
+            with METRICS.stage("protections_batch"):
+                apply_protections(args.owner, protections, token, journal, args.graphql_batch)
+    finally:
+        # remember what we converged to, also when a later repo aborts the run
+        _store_fingerprints(org, journal, reconciled, fp_path, fingerprints)
+
+    return journal.finish()
 
 if __name__ == "__main__":
     sys.exit(main())
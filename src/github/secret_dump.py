@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Read the encrypted secret dump written by secrets.py --dump-archive.
+
+  secret_dump.py keygen                         # create the dump key file
+  secret_dump.py list                           # entry paths (no key needed)
+  secret_dump.py get repo/insizon-dev/API_KEY   # decrypt one entry only
+"""
+import argparse, sys
+from _dump import DumpArchive, keygen, load_key, read_index
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("command", choices=["keygen", "list", "get"])
+    ap.add_argument("entry", nargs="?", help="scope path, e.g. org/NAME, repo/<repo>/NAME, env/<repo>/<env>/NAME")
+    ap.add_argument("--archive", default="private/github_secrets.dump")
+    ap.add_argument("--key", default="file:private/github_secrets.key", help="Dump key ref (literal:/file:/ssm:)")
+    ap.add_argument("--region", default="us-east-2")
+    ap.add_argument("--profile", default=None)
+    args = ap.parse_args()
+
+    if args.command == "keygen":
+        if not args.key.startswith("file:"):
+            raise SystemExit("ERROR: keygen writes a key file; pass --key file:<path>")
+        path = args.key.split("file:", 1)[1]
+        keygen(path)
+        print(f"OK: dump key written to {path}")
+        return 0
+
+    if args.command == "list":
+        for entry in read_index(args.archive):
+            print(entry)
+        return 0
+
+    if not args.entry:
+        raise SystemExit("ERROR: get needs an entry path")
+    archive = DumpArchive(args.archive, load_key(args.key, args.region, args.profile))
+    try:
+        sys.stdout.write(archive.get(args.entry))
+    except KeyError:
+        raise SystemExit(f"ERROR: {args.entry} not in {args.archive}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
-import argparse, os, sys, yaml, base64, json, requests
-from _common import load_yaml, get_token
+import argparse, os, sys, yaml, base64, json, functools, threading
+from _common import load_yaml, get_token, load_json, atomic_write_json, gh_http, pin, paginate, ContextPool
+from _journal import RunJournal, StepSkipped, add_journal_args
+from _metrics import METRICS
+from _dump import DumpArchive, load_key
+from _orgs import add_org_args, multi_org, fan_out
 import pathlib, stat
 
 try:
@@ -15,27 +19,50 @@ def _h(tok):
     return {"Authorization": f"Bearer {tok}", **H}
 
 def _get(url, tok):
-    r = requests.get(url, headers=_h(tok))
+    r = gh_http.get(url, headers=_h(tok))
     r.raise_for_status()
     return r.json()
 
 def _put(url, tok, payload):
-    r = requests.put(url, headers=_h(tok), data=json.dumps(payload))
+    r = gh_http.put(url, headers=_h(tok), data=json.dumps(payload))
     r.raise_for_status()
     return r.json() if r.text else {}
 
+def _delete(url, tok):
+    r = gh_http.delete(url, headers=_h(tok))
+    if r.status_code not in (204, 404):
+        r.raise_for_status()
+    return r.status_code
+
 def _ensure_pynacl():
     try:
         import nacl; return
     except Exception:
         os.system("python3 -m pip install pynacl >/dev/null 2>&1 || pip install pynacl >/dev/null 2>&1")
 
+@functools.lru_cache(maxsize=None)
+def _box(public_key_b64):
+    # one PublicKey/SealedBox per scope key, reused for every secret sealed to it
+    return public.SealedBox(public.PublicKey(base64.b64decode(public_key_b64)))
+
 def _encrypt(public_key_b64, value_str):
-    pk = public.PublicKey(base64.b64decode(public_key_b64))
-    sealed_box = public.SealedBox(pk)
-    enc = sealed_box.encrypt(value_str.encode("utf-8"))
+    enc = _box(public_key_b64).encrypt(value_str.encode("utf-8"))
     return base64.b64encode(enc).decode("utf-8")
 
+@functools.lru_cache(maxsize=None)
+def _public_key(scope_url, tok):
+    return _get(f"{scope_url}/public-key", tok)
+
+METRICS.cache("public_key", lambda: _public_key.cache_info()[:2])
+
+def _sealed(scope_url, tok, value):
+    pk = _public_key(scope_url, tok)
+    return {"encrypted_value": _encrypt(pk["key"], value), "key_id": pk["key_id"]}
+
+def _org_scope(org): return f"{API}/orgs/{org}/actions/secrets"
+def _repo_scope(owner, repo): return f"{API}/repos/{owner}/{repo}/actions/secrets"
+def _env_scope(owner, repo, env): return f"{API}/repos/{owner}/{repo}/environments/{env}/secrets"
+
 def _ssm_client(region, profile=None):
     import boto3
     if profile:
@@ -57,6 +84,40 @@ def _resolve_ref_live(ref, region, profile):
         return resp["Parameter"]["Value"]
     raise ValueError(f"Unsupported secret ref: {ref}")
 
+def _parse_dotenv(text):
+    out = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        if line.startswith("export "):
+            line = line[len("export "):].lstrip()
+        k, v = line.split("=", 1)
+        k, v = k.strip(), v.strip()
+        if len(v) >= 2 and v[0] == v[-1] and v[0] in "\"'":
+            q, v = v[0], v[1:-1]
+            if q == '"':
+                v = v.replace("\\n", "\n").replace('\\"', '"')
+        elif " #" in v:
+            v = v.split(" #", 1)[0].rstrip()
+        out[k] = v
+    return out
+
+def _expand_bulk(ref):
+    """dotenv:path / json:path -> {NAME: value}; one file feeds many secrets of a scope."""
+    kind, p = ref.split(":", 1)
+    with open(p, "r", encoding="utf-8") as f:
+        text = f.read()
+    if kind == "dotenv":
+        return _parse_dotenv(text)
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError(f"{ref}: expected a JSON object of NAME: value")
+    return {k: v if isinstance(v, str) else json.dumps(v) for k, v in data.items()}
+
+def _is_bulk(ref):
+    return isinstance(ref, str) and (ref.startswith("dotenv:") or ref.startswith("json:"))
+
 def _resolve_ref(ref, region, profile, dry_run=False, skip_missing=False):
     if dry_run:
         return f"<dry-run:{ref}>"
@@ -74,46 +135,56 @@ def _resolve_ref(ref, region, profile, dry_run=False, skip_missing=False):
         raise
 
 def _get_repo_id_map(owner, tok):
-    r = requests.get(f"{API}/orgs/{owner}/repos?per_page=100", headers=_h(tok))
-    r.raise_for_status()
-    return {x["name"]: x["id"] for x in r.json()}
-
-def upsert_org_secret(org, name, value, tok, dry, visibility="all", selected_repo_ids=None):
-    if dry:
-        print(f"DRY: org secret {name} vis={visibility} selected={selected_repo_ids}")
-        return
-    pk = _get(f"{API}/orgs/{org}/actions/secrets/public-key", tok)
-    payload = {
-        "encrypted_value": _encrypt(pk["key"], value),
-        "key_id": pk["key_id"],
-        "visibility": visibility
-    }
-    if visibility == "selected":
-        payload["selected_repository_ids"] = selected_repo_ids or []
-    _put(f"{API}/orgs/{org}/actions/secrets/{name}", tok, payload)
-    print(f"OK: org secret {name} upserted (vis={visibility})")
-
-def upsert_repo_secret(owner, repo, name, value, tok, dry):
-    if dry:
-        print(f"DRY: repo {repo} secret {name}")
-        return
-    pk = _get(f"{API}/repos/{owner}/{repo}/actions/secrets/public-key", tok)
-    _put(f"{API}/repos/{owner}/{repo}/actions/secrets/{name}", tok, {
-        "encrypted_value": _encrypt(pk["key"], value),
-        "key_id": pk["key_id"]
-    })
-    print(f"OK: repo {repo} secret {name} upserted")
-
-def upsert_env_secret(owner, repo, env, name, value, tok, dry):
-    if dry:
-        print(f"DRY: repo {repo} env {env} secret {name}")
-        return
-    pk = _get(f"{API}/repos/{owner}/{repo}/environments/{env}/secrets/public-key", tok)
-    _put(f"{API}/repos/{owner}/{repo}/environments/{env}/secrets/{name}", tok, {
-        "encrypted_value": _encrypt(pk["key"], value),
-        "key_id": pk["key_id"]
-    })
-    print(f"OK: repo {repo} env {env} secret {name} upserted")
+    return {x["name"]: x["id"] for x in paginate(f"{API}/orgs/{owner}/repos", tok)}
+
+def plan_promotions(cfg, min_repos=2):
+    """
+    Identical (name, ref) repo secrets shared by >= min_repos repos -> {name: (ref, [repos])}.
+    Names already declared as org secrets are left alone; when one name has several
+    shared refs, the largest group is promoted and the rest stay repo secrets.
+    """
+    groups = {}
+    for repo, kv in (cfg.get("repos") or {}).items():
+        for k, ref in (kv or {}).items():
+            if isinstance(ref, str) and not _is_bulk(ref):
+                groups.setdefault((k, ref), []).append(repo)
+    org_names = set((cfg.get("org") or {}).keys())
+    best = {}
+    for (name, ref), repos in groups.items():
+        if len(repos) >= min_repos and name not in org_names and len(repos) > len(best.get(name, (None, []))[1]):
+            best[name] = (ref, sorted(repos))
+    return best
+
+def apply_promotions(cfg, promos):
+    """Move promoted repo secrets into cfg['org'] as selected-visibility secrets; repos not in the group keep their own."""
+    org = dict(cfg.get("org") or {})
+    repos = {r: dict(kv or {}) for r, kv in (cfg.get("repos") or {}).items()}
+    for name, (ref, members) in promos.items():
+        for r in members:
+            repos[r].pop(name, None)
+        org[name] = {"value": ref, "visibility": "selected", "selected_repos": members}
+    return {**cfg, "org": org, "repos": repos}
+
+def run_pipeline(jobs, seal, upload, workers):
+    """
+    Seal (resolve + encrypt) jobs in one pool and hand each result straight to
+    an upload pool, so encryption and SSM reads overlap with the PUTs.
+    upload(job, sealed_future) runs in the upload pool; returns the first error.
+    """
+    errors, stop = [], threading.Event()
+    def _up(job, fut):
+        if stop.is_set():
+            return
+        try:
+            upload(job, fut)
+        except BaseException as e:  # SystemExit included: stop feeding new work
+            errors.append(e); stop.set()
+    with ContextPool(workers, thread_name_prefix="upload") as up:
+        with ContextPool(max(1, workers // 2), thread_name_prefix="seal") as enc:
+            for job in jobs:
+                fut = enc.submit(lambda j=job: None if stop.is_set() else seal(j))
+                fut.add_done_callback(lambda f, j=job: up.submit(_up, j, f))
+    return errors[0] if errors else None
 
 def _safe_write(root, parts, name, value):
     base = pathlib.Path(root).joinpath(*parts)
@@ -127,71 +198,164 @@ def _safe_write(root, parts, name, value):
         pass
     print(f"DUMP: wrote {fp}")
 
-def main():
+def main(args=None):
     _ensure_pynacl()
     ap = argparse.ArgumentParser()
-    ap.add_argument("--owner", required=True)
+    ap.add_argument("--owner", help="Org login, or several comma-separated to reconcile them concurrently")
     ap.add_argument("--config", default="src/config/secrets.yaml")
     ap.add_argument("--ssm-token", default="insizon-github-admin-token")
     ap.add_argument("--region", default="us-east-2")
     ap.add_argument("--dry-run", action="store_true")
     ap.add_argument("--skip-missing", action="store_true")
-    ap.add_argument("--dump-dir", default="private/github_secrets")
+    ap.add_argument("--dump-dir", default="private/github_secrets", help="Plaintext per-secret dump (ignored with --dump-archive)")
+    ap.add_argument("--dump-archive", default=None, help="Single encrypted dump archive, e.g. private/github_secrets.dump")
+    ap.add_argument("--dump-key", default="file:private/github_secrets.key", help="Archive key ref (literal:/file:/ssm:); create with secret_dump.py keygen")
     ap.add_argument("--profile", default=None)
-    args = ap.parse_args()
+    ap.add_argument("--workers", type=int, default=8, help="Parallel seal/upload workers")
+    ap.add_argument("--promote-duplicates", action="store_true", help="Turn identical repo secrets into selected-visibility org secrets (also optimize.promote_duplicates)")
+    ap.add_argument("--only", action="append", default=None, metavar="SCOPE", help="Only these repos' repo/env secrets; ':org' selects org secrets (repeatable)")
+    add_journal_args(ap)
+    add_org_args(ap)
+    args = args or ap.parse_args()
+    if multi_org(args):
+        return fan_out("secrets", main, args)
 
     cfg = load_yaml(args.config) or {}
-    tok = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=args.dry_run)
+    opt = cfg.get("optimize") or {}
+    promos = {}
+    if args.promote_duplicates or opt.get("promote_duplicates"):
+        # planned on the full config so --only never narrows a selected repo list
+        promos = plan_promotions(cfg, int(opt.get("min_repos", 2)))
+        for name, (ref, members) in sorted(promos.items()):
+            print(f"OPTIMIZE: {name} ({ref}) in {len(members)} repos -> 1 org secret (saves {len(members) - 1} writes per run)")
+        if promos:
+            print(f"OPTIMIZE: {sum(len(m) for _, m in promos.values())} repo secret writes -> {len(promos)} org secret writes")
+        cfg = apply_promotions(cfg, promos)
+    if args.only:
+        cfg = {
+            "org": {k: v for k, v in (cfg.get("org") or {}).items()
+                    if ":org" in args.only or (k in promos and set(promos[k][1]) & set(args.only))},
+            "repos": {r: kv for r, kv in (cfg.get("repos") or {}).items() if r in args.only},
+            "envs": {r: e for r, e in (cfg.get("envs") or {}).items() if r in args.only},
+        }
+    tok = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=args.dry_run, owner=args.owner)
+    journal = RunJournal.from_args("secrets", args)
+
+    # Build one job per secret: (journal object, name, ref-or-value, dump path, scope, extra payload)
+    jobs = []
+    def _scope_jobs(obj, label, kv, dump_parts, scope, extra=None, default_extra=None):
+        entries = {}
+        for k, ref in (kv or {}).items():
+            if not _is_bulk(ref):
+                continue
+            if args.dry_run:
+                print(f"DRY: {label}: import every secret from {ref}")
+                continue
+            try:
+                entries.update({n: {"value": v} for n, v in _expand_bulk(ref).items()})
+            except Exception as e:
+                if not args.skip_missing:
+                    raise
+                print(f"WARN: could not expand '{ref}' ({e}); skipping due to --skip-missing")
+        # explicit entries win over names imported from a file
+        entries.update({k: {"ref": ref} for k, ref in (kv or {}).items() if not _is_bulk(ref)})
+        for name, src in entries.items():
+            jobs.append({"obj": obj, "name": name, "label": label, "dump": dump_parts, "scope": scope,
+                         "extra": (extra or {}).get(name, default_extra or {}), **src})
 
     # ORG secrets
     org_cfg = cfg.get("org") or {}
     repo_id_map = None
+    org_plain, org_extra = {}, {}
     for k, v in org_cfg.items():
         if isinstance(v, dict):
-            ref = v.get("value")
             visibility = v.get("visibility", "all")
-            sel = v.get("selected_repos", [])
             sel_ids = None
             if visibility == "selected":
                 if args.dry_run:
                     sel_ids = []  # do not call GitHub in dry-run
                 else:
                     repo_id_map = repo_id_map or _get_repo_id_map(args.owner, tok)
-                    sel_ids = [repo_id_map[r] for r in sel if r in repo_id_map]
-            val = _resolve_ref(ref, args.region, args.profile, dry_run=args.dry_run, skip_missing=args.skip_missing)
-            if val is None:
-                continue
-            if args.dump_dir and not args.dry_run:
-                _safe_write(args.dump_dir, ["org"], k, val)
-            upsert_org_secret(args.owner, k, val, tok, args.dry_run, visibility, sel_ids)
+                    sel_ids = [repo_id_map[r] for r in v.get("selected_repos", []) if r in repo_id_map]
+            org_plain[k] = v.get("value")
+            org_extra[k] = {"visibility": visibility, **({"selected_repository_ids": sel_ids} if visibility == "selected" else {})}
         else:
-            val = _resolve_ref(v, args.region, args.profile, dry_run=args.dry_run, skip_missing=args.skip_missing)
-            if val is None:
-                continue
-            if args.dump_dir and not args.dry_run:
-                _safe_write(args.dump_dir, ["org"], k, val)
-            upsert_org_secret(args.owner, k, val, tok, args.dry_run, "all", None)
+            org_plain[k] = v
+    _scope_jobs("org", "org", org_plain, ["org"], _org_scope(args.owner), org_extra, {"visibility": "all"})
 
     # REPO secrets
     for repo, kv in (cfg.get("repos") or {}).items():
-        for k, ref in (kv or {}).items():
-            val = _resolve_ref(ref, args.region, args.profile, dry_run=args.dry_run, skip_missing=args.skip_missing)
-            if val is None:
-                continue
-            if args.dump_dir and not args.dry_run:
-                _safe_write(args.dump_dir, ["repo", repo], k, val)
-            upsert_repo_secret(args.owner, repo, k, val, tok, args.dry_run)
+        _scope_jobs(f"repo:{repo}", f"repo {repo}", kv, ["repo", repo], _repo_scope(args.owner, repo))
 
     # ENV secrets
     for repo, envs in (cfg.get("envs") or {}).items():
         for env, kv in (envs or {}).items():
-            for k, ref in (kv or {}).items():
-                val = _resolve_ref(ref, args.region, args.profile, dry_run=args.dry_run, skip_missing=args.skip_missing)
-                if val is None:
-                    continue
-                if args.dump_dir and not args.dry_run:
-                    _safe_write(args.dump_dir, ["env", repo, env], k, val)
-                upsert_env_secret(args.owner, repo, env, k, val, tok, args.dry_run)
+            _scope_jobs(f"repo:{repo}", f"repo {repo} env {env}", kv, ["env", repo, env], _env_scope(args.owner, repo, env))
+
+    def _action(job):
+        env = job["dump"][2] + "/" if job["dump"][0] == "env" else ""
+        return f"secret:{env}{job['name']}"
+
+    if args.dry_run:
+        for job in jobs:
+            extra = job["extra"]
+            vis = f" vis={extra['visibility']} selected={extra.get('selected_repository_ids')}" if extra else ""
+            print(f"DRY: {job['label']} secret {job['name']}{vis}")
+        return 0
+
+    archive = DumpArchive(args.dump_archive, load_key(args.dump_key, args.region, args.profile)) if args.dump_archive else None
+
+    def seal(job):
+        # resolve inside the pipeline so a resumed run does not re-read completed refs
+        if journal.done(job["obj"], _action(job)):
+            return None
+        val = job["value"] if "value" in job else _resolve_ref(job["ref"], args.region, args.profile, skip_missing=args.skip_missing)
+        if val is None:
+            return None
+        if archive is not None:
+            archive.put(job["dump"], job["name"], val)
+        elif args.dump_dir:
+            _safe_write(args.dump_dir, job["dump"], job["name"], val)
+        return {**_sealed(job["scope"], tok, val), **job["extra"]}
+
+    def upload(job, fut):
+        def _do():
+            payload = fut.result()  # re-raises resolve/encrypt errors into this step
+            if payload is None:  # ref missing under --skip-missing: not written, so not "ok"
+                raise StepSkipped(f"{job['label']} secret {job['name']} not resolved")
+            pin(tok, job["obj"])  # with a token pool, one identity writes each repo's secrets
+            _put(f"{job['scope']}/{job['name']}", tok, payload)
+            print(f"OK: {job['label']} secret {job['name']} upserted")
+        journal.step(job["obj"], _action(job), _do)
+
+    with METRICS.stage("pipeline"):
+        err = run_pipeline(jobs, seal, upload, args.workers)
+
+    # promoted names: drop the now-shadowing repo copies once, the first time a repo joins the group
+    promo_path = os.path.join(args.state_dir, "secrets", f"{args.owner}-promoted.json")
+    if err is None and (promos or os.path.exists(promo_path)):
+        done = load_json(promo_path, {}) or {}
+        # forget repos that left a group (they got their own secret back) and promotions that went away,
+        # so a repo that rejoins has its repo copy deleted again
+        done = {n: [r for r in rs if r in promos[n][1]] for n, rs in done.items() if n in promos}
+        failed = {(o, a) for o, a, _ in journal.failures}
+        for name, (ref, members) in sorted(promos.items()):
+            if name not in org_plain or ("org", f"secret:{name}") in failed:
+                continue
+            for r in sorted(set(members) - set(done.get(name, []))):
+                if journal.step(f"repo:{r}", f"unshadow:{name}", _delete, f"{_repo_scope(args.owner, r)}/{name}", tok) is not None:
+                    done.setdefault(name, []).append(r)
+        atomic_write_json(promo_path, done)
+
+    if archive is not None:
+        with METRICS.stage("dump"):
+            # a full run knows every managed secret, so entries outside that set are dropped
+            keep = None if args.only else {"/".join([*job["dump"], job["name"]]) for job in jobs}
+            updated, unchanged, total, removed = archive.commit(keep)
+        print(f"DUMP: {args.dump_archive}: {updated} updated, {unchanged} unchanged, {removed} removed, {total} total")
+    if err is not None:
+        raise err
+    return journal.finish()
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Local snapshot of org state for offline questions and API-free dry runs.
+
+  snapshot.py --owner X refresh               # capture / update <state-dir>/snapshots/X.sqlite
+  snapshot.py --owner X unprotected [--branch main]
+  snapshot.py --owner X access <repo>         # which teams hold which permission on a repo
+  snapshot.py --owner X sql "SELECT ..."      # anything else (schema in _snapshot.py)
+
+A refresh lists repos and teams, then walks them concurrently. Every
+single-page fetch is conditional on its stored ETag, so objects that did not
+change come back as 304s (free against the rate limit) and keep their rows;
+repos/teams that disappeared are dropped. The refresh is ETag-only: a repo's
+updated_at/pushed_at do not move on hook, key, secret or protection changes,
+so every repo is walked. repos.py, teams.py and cleanup.py read the snapshot
+in --dry-run with --snapshot.
+"""
+import argparse, sys, os, time, threading
+from _common import get_token, gh_http, paginate, ContextPool
+from _journal import STATE_DIR
+from _orgs import add_org_args, multi_org, fan_out
+from _snapshot import Snapshot, default_path, ORG, REPO_KINDS, TEAM_KINDS
+
+API = "https://api.github.com"
+H = {"Accept": "application/vnd.github+json", "X-GitHub-Api-Version": "2022-11-28"}
+def _h(tok): return {"Authorization": f"Bearer {tok}", **H}
+
+class Fetcher:
+    """Conditional GETs for one refresh; collects writes for the main thread."""
+    def __init__(self, tok, etags, stored, full):
+        self.tok, self.etags, self.stored, self.full = tok, etags, stored, full
+        self.fetched = self.unchanged = 0
+        self._lock = threading.Lock()
+
+    def get(self, url, key=None, allow=(404,), conditional=True):
+        """(body or list, etag) on 200, None on 304; (empty, None) for an `allow`ed status."""
+        h = _h(self.tok)
+        if conditional and not self.full and url in self.etags:
+            h["If-None-Match"] = self.etags[url]
+        r = gh_http.get(url, headers=h, params={"per_page": 100})
+        with self._lock:
+            if r.status_code == 304:
+                self.unchanged += 1
+            else:
+                self.fetched += 1
+        if r.status_code == 304:
+            return None
+        if r.status_code in allow:
+            return ([] if key is not False else {}), None
+        if r.status_code != 200:
+            raise SystemExit(f"GET {r.url} failed: {r.status_code} {r.text}")
+        body = r.json()
+        if key is False:
+            return body, r.headers.get("ETag")
+        items = (body.get(key) or []) if key else body
+        nxt = r.links.get("next", {}).get("url")
+        if nxt:  # the first page's ETag says nothing about later pages; do not keep it
+            return items + list(paginate(nxt, self.tok, key=key)), None
+        return items, r.headers.get("ETag")
+
+    def details(self, kind, parent, listed, url_of, ops):
+        """Swap list summaries for full objects (ruleset conditions/rules live only on the item URL)."""
+        stored = self.stored.get((kind, parent), {})
+        out = {}
+        for n, item in listed.items():
+            url = url_of(item)
+            res = self.get(url, key=False)
+            if res is None and n in stored:
+                out[n] = stored[n]
+                continue
+            if res is None:  # ETag kept but row lost: fetch unconditionally
+                res = self.get(url, key=False, conditional=False)
+            out[n] = res[0] or item
+            ops.append(("etag", url, res[1]))
+        return out
+
+    def rows(self, ops, kind, parent, url, name_of, key=None, shape=None, allow=(404,)):
+        """Fetch a list into ops; returns the current {name: data} (stored rows on 304)."""
+        res = self.get(url, key, allow)
+        if res is None:
+            return self.stored.get((kind, parent), {})
+        items, etag = res
+        rows = {str(name_of(i)): (shape(i) if shape else i) for i in items}
+        ops.append(("replace", kind, parent, rows))
+        ops.append(("etag", url, etag))
+        return rows
+
+def repo_state(owner, name, f):
+    """Writes for one repo: branches, protection, rulesets, environments, hooks, deploy keys, secret names."""
+    ops, base = [], f"{API}/repos/{owner}/{name}"
+    branches = f.rows(ops, "branch", name, f"{base}/branches", lambda b: b["name"])
+    protections = {}
+    for b, info in branches.items():
+        if not info.get("protected"):
+            continue
+        url = f"{base}/branches/{b}/protection"
+        res = f.get(url, key=False, allow=(404, 403))  # 403: protection needs a paid plan on private repos
+        if res is None:
+            prev = f.stored.get(("protection", name), {}).get(b)
+            if prev is not None:
+                protections[b] = prev
+        else:
+            if res[0]:
+                protections[b] = res[0]
+            ops.append(("etag", url, res[1]))
+    ops.append(("replace", "protection", name, protections))
+    rulesets = f.rows(ops, "ruleset", name, f"{base}/rulesets?includes_parents=false", lambda r: r["name"])
+    ops.append(("replace", "ruleset", name, f.details("ruleset", name, rulesets, lambda r: f"{base}/rulesets/{r['id']}", ops)))
+    envs = f.rows(ops, "environment", name, f"{base}/environments", lambda e: e["name"], key="environments")
+    for env, e in envs.items():
+        if (e.get("deployment_branch_policy") or {}).get("custom_branch_policies"):
+            f.rows(ops, "branch_policy", f"{name}/{env}", f"{base}/environments/{env}/deployment-branch-policies",
+                   lambda p: p["name"], key="branch_policies")
+    f.rows(ops, "hook", name, f"{base}/hooks", lambda h: h["id"], allow=(404, 403))
+    f.rows(ops, "deploy_key", name, f"{base}/keys", lambda k: k["title"], allow=(404, 403))
+    f.rows(ops, "secret", name, f"{base}/actions/secrets", lambda s: s["name"], key="secrets", allow=(404, 403))
+    for env in envs:
+        f.rows(ops, "env_secret", f"{name}/{env}", f"{base}/environments/{env}/secrets", lambda s: s["name"], key="secrets", allow=(404, 403))
+    return ops
+
+def team_state(owner, slug, f):
+    """Writes for one team: members with their role, and repo permissions."""
+    ops, base = [], f"{API}/orgs/{owner}/teams/{slug}"
+    members = {}
+    for role in ("maintainer", "member"):
+        url = f"{base}/members?role={role}"
+        res = f.get(url)
+        if res is None:
+            members.update({l: m for l, m in f.stored.get(("team_member", slug), {}).items() if m["role"] == role})
+            continue
+        members.update({u["login"]: {"login": u["login"], "role": role} for u in res[0]})
+        ops.append(("etag", url, res[1]))
+    ops.append(("replace", "team_member", slug, members))
+    perm = lambda r: {"permission": next((p for p in ("admin", "maintain", "push", "triage", "pull") if (r.get("permissions") or {}).get(p)), None),
+                      "role_name": r.get("role_name")}
+    f.rows(ops, "team_repo", slug, f"{base}/repos", lambda r: r["name"], shape=perm)
+    return ops
+
+def refresh(owner, tok, snap, full, workers):
+    f = Fetcher(tok, snap.etags(), snap.load(), full)
+    stored_repos = f.stored.get(("repo", ""), {})
+    listed = {r["name"]: r for r in paginate(f"{API}/orgs/{owner}/repos", tok, {"type": "all"})}
+    teams = {t["slug"]: t for t in paginate(f"{API}/orgs/{owner}/teams", tok)}
+
+    with ContextPool(max(1, workers)) as ex:
+        repo_jobs = {n: ex.submit(repo_state, owner, n, f) for n in sorted(listed)}
+        team_jobs = {s: ex.submit(team_state, owner, s, f) for s in sorted(teams)}
+        org_ops = org_state(owner, f)
+        for n, fut in repo_jobs.items():
+            apply(snap, fut.result())
+        for s, fut in team_jobs.items():
+            apply(snap, fut.result())
+    apply(snap, org_ops)
+
+    snap.replace("repo", "", listed)
+    snap.replace("team", "", teams)
+    for gone in set(stored_repos) - set(listed):
+        snap.drop_children(REPO_KINDS, gone)
+        snap.drop_etags(f"{API}/repos/{owner}/{gone}/")
+    for gone in set(f.stored.get(("team", ""), {})) - set(teams):
+        snap.drop_children(TEAM_KINDS, gone)
+        snap.drop_etags(f"{API}/orgs/{owner}/teams/{gone}/")
+    snap.mark_refreshed()
+    snap.commit()
+    print(f"OK: snapshot {snap.path}: {len(listed)} repos, {len(teams)} teams; "
+          f"{f.fetched} fetched, {f.unchanged} unchanged (304)")
+
+def org_state(owner, f):
+    ops, base = [], f"{API}/orgs/{owner}"
+    f.rows(ops, "hook", ORG, f"{base}/hooks", lambda h: h["id"], allow=(404, 403))
+    f.rows(ops, "ruleset", ORG, f"{base}/rulesets", lambda r: r["name"], allow=(404, 403))
+    secrets = f.rows(ops, "secret", ORG, f"{base}/actions/secrets", lambda s: s["name"], key="secrets", allow=(404, 403))
+    for n, sec in secrets.items():
+        # repo selection changes leave the secret list (and its ETag) alone: refetch it every time
+        sec.pop("selected_repos", None)
+        if sec.get("visibility") == "selected":
+            sec["selected_repos"] = sorted(r["name"] for r in paginate(f"{base}/actions/secrets/{n}/repositories", f.tok, key="repositories"))
+    ops.append(("replace", "secret", ORG, secrets))
+    return ops
+
+def apply(snap, ops):
+    for op in ops:
+        if op[0] == "replace":
+            snap.replace(*op[1:])
+        else:
+            snap.set_etag(*op[1:])
+
+def _table(cols, rows):
+    print("\t".join(cols))
+    for r in rows:
+        print("\t".join("" if v is None else str(v) for v in r))
+
+def main(args=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("command", choices=["refresh", "unprotected", "access", "sql"])
+    ap.add_argument("arg", nargs="?", help="access: repo name; sql: the query")
+    ap.add_argument("--owner", help="Org login, or several comma-separated (refresh)")
+    ap.add_argument("--db", default=None, help="Snapshot file (default: <state-dir>/snapshots/<owner>.sqlite)")
+    ap.add_argument("--branch", default="main", help="unprotected: branch to check")
+    ap.add_argument("--full", action="store_true", help="refresh: ignore stored ETags and refetch everything")
+    ap.add_argument("--workers", type=int, default=8, help="refresh: repos/teams fetched in parallel")
+    ap.add_argument("--state-dir", default=STATE_DIR)
+    ap.add_argument("--ssm-token", default="insizon-github-admin-token")
+    ap.add_argument("--region", default="us-east-2")
+    ap.add_argument("--profile", default=None)
+    add_org_args(ap)
+    args = args or ap.parse_args()
+    if multi_org(args):
+        if args.command != "refresh":
+            raise SystemExit("ERROR: queries read one org's snapshot; pass a single --owner")
+        if args.db:
+            raise SystemExit("ERROR: --db names one org's snapshot; drop it to refresh several orgs (each gets <state-dir>/snapshots/<owner>.sqlite)")
+        return fan_out("snapshot", main, args)
+
+    path = args.db or default_path(args.owner, args.state_dir)
+    if args.command == "refresh":
+        tok = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=False, owner=args.owner)
+        snap = Snapshot(path)
+        start = time.time()
+        refresh(args.owner, tok, snap, args.full, args.workers)
+        print(f"OK: refreshed in {time.time() - start:.1f}s")
+        snap.close()
+        return 0
+
+    if not os.path.exists(path):
+        raise SystemExit(f"ERROR: no snapshot at {path}; run refresh first")
+    snap = Snapshot(path)
+    print(f"SNAPSHOT: {path} (taken {snap.taken()})")
+    if args.command == "unprotected":
+        _table(*snap.query(
+            "SELECT r.name, json_extract(r.data, '$.default_branch') AS default_branch FROM objects r "
+            "WHERE r.kind = 'repo' AND json_extract(r.data, '$.archived') = 0 AND NOT EXISTS "
+            "(SELECT 1 FROM objects p WHERE p.kind = 'protection' AND p.parent = r.name AND p.name = ?) "
+            "ORDER BY r.name", (args.branch,)))
+    elif args.command == "access":
+        if not args.arg:
+            raise SystemExit("ERROR: access needs a repo name")
+        _table(*snap.query(
+            "SELECT parent AS team, json_extract(data, '$.permission') AS permission, json_extract(data, '$.role_name') AS role "
+            "FROM objects WHERE kind = 'team_repo' AND name = ? ORDER BY parent", (args.arg,)))
+    else:
+        if not args.arg:
+            raise SystemExit("ERROR: sql needs a query")
+        _table(*snap.query(args.arg))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
-import argparse, sys
-from _common import load_yaml, get_token, gh_client
+import argparse, sys, base64, hashlib, struct, threading
+from concurrent.futures import as_completed
+from _common import load_yaml, get_token, gh_client, pin, ContextPool
+from _journal import RunJournal, add_journal_args
+from _metrics import METRICS
+from _orgs import add_org_args, multi_org, fan_out
 
 def _resolve_key(ref, dry_run=False, skip_missing=False):
     if dry_run:
@@ -19,18 +23,72 @@ def _resolve_key(ref, dry_run=False, skip_missing=False):
             return None
         raise
 
-def main():
+def parse_pubkey(text):
+    """
+    "<type> <base64> [comment]" -> ("<type> <base64>", "SHA256:..."), the form
+    GitHub lists deploy keys in and the fingerprint ssh-keygen -lf prints.
+    """
+    parts = (text or "").split()
+    if len(parts) < 2:
+        raise ValueError("not an OpenSSH public key")
+    ktype, b64 = parts[0], parts[1]
+    try:
+        blob = base64.b64decode(b64, validate=True)
+        (n,) = struct.unpack(">I", blob[:4])
+    except Exception:
+        raise ValueError("public key body is not valid base64")
+    if blob[4:4 + n].decode("ascii", "replace") != ktype:
+        raise ValueError(f"key type {ktype} does not match the key body")
+    fp = base64.b64encode(hashlib.sha256(blob).digest()).decode("ascii").rstrip("=")
+    return f"{ktype} {b64}", f"SHA256:{fp}"
+
+def plan_repo(desired, existing, prune=False):
+    """
+    desired: [{title, key, fp, read_only}]; existing: [{id, title, key, fp, read_only}].
+    Returns a list of (op, item, old) with op in add/rotate/unchanged/remove.
+    Keys match by fingerprint; a title whose key changed is rotated (add new, then remove old).
+    """
+    by_fp = {e["fp"]: e for e in existing}
+    by_title = {e["title"]: e for e in existing}
+    used, plan = set(), []
+    for it in desired:
+        cur = by_fp.get(it["fp"])
+        if cur is not None:
+            used.add(cur["id"])
+            # deploy keys cannot be edited; a read_only change means re-adding the same key
+            plan.append(("unchanged" if cur["read_only"] == it["read_only"] else "rotate", it, cur))
+            continue
+        old = by_title.get(it["title"])
+        if old is not None and old["id"] not in used and old["fp"] not in {d["fp"] for d in desired}:
+            used.add(old["id"])
+            plan.append(("rotate", it, old))
+        else:
+            plan.append(("add", it, None))
+    if prune:
+        plan += [("remove", None, e) for e in existing if e["id"] not in used]
+    return plan
+
+def main(args=None):
     ap = argparse.ArgumentParser()
-    ap.add_argument("--owner", required=True)
+    ap.add_argument("--owner", help="Org login, or several comma-separated to reconcile them concurrently")
     ap.add_argument("--config", default="src/config/secrets.yaml")
     ap.add_argument("--ssm-token", default="insizon-github-admin-token")
     ap.add_argument("--region", default="us-east-2")
     ap.add_argument("--dry-run", action="store_true")
     ap.add_argument("--skip-missing", action="store_true")
     ap.add_argument("--profile", default=None)
-    args = ap.parse_args()
+    ap.add_argument("--prune", action="store_true", help="Remove deploy keys that are not in the config")
+    ap.add_argument("--workers", type=int, default=8, help="Repos reconciled in parallel")
+    ap.add_argument("--only", action="append", default=None, metavar="REPO", help="Reconcile only these repos' deploy keys (repeatable)")
+    add_journal_args(ap)
+    add_org_args(ap)
+    args = args or ap.parse_args()
+    if multi_org(args):
+        return fan_out("ssh_keys", main, args)
 
     cfg = load_yaml(args.config) or {}
+    if args.only:
+        cfg["deploy_keys"] = {r: items for r, items in (cfg.get("deploy_keys") or {}).items() if r in args.only}
 
     if args.dry_run:
         for repo_name, items in (cfg.get("deploy_keys") or {}).items():
@@ -41,24 +99,90 @@ def main():
                 print(f"DRY: add deploy key '{title}' (ro={ro}) to {repo_name} from {key}")
         sys.exit(0)
 
-    token = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=False)
+    token = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=False, owner=args.owner)
     gh, org = gh_client(args.owner, token)
+    journal = RunJournal.from_args("ssh_keys", args)
 
-    deploy = cfg.get("deploy_keys") or {}
-    for repo_name, items in deploy.items():
-        repo = org.get_repo(repo_name)
-        existing = {k.title: k for k in repo.get_keys()}
+    # resolve and fingerprint every key locally before touching any repo
+    deploy = {}
+    for repo_name, items in (cfg.get("deploy_keys") or {}).items():
+        deploy[repo_name] = []
         for it in items:
-            title = it["title"]
             key = _resolve_key(it["key"], dry_run=False, skip_missing=args.skip_missing)
             if key is None:
                 continue
-            ro = bool(it.get("read_only", True))
-            if title in existing:
-                print(f"SKIP: deploy key '{title}' already exists on {repo_name}")
-                continue
-            repo.create_key(title=title, key=key, read_only=ro)
-            print(f"OK: deploy key '{title}' added to {repo_name}")
+            try:
+                key, fp = parse_pubkey(key)
+            except ValueError as e:
+                raise SystemExit(f"ERROR: deploy key '{it['title']}' for {repo_name}: {e}")
+            deploy[repo_name].append({"title": it["title"], "key": key, "fp": fp, "read_only": bool(it.get("read_only", True))})
+
+    totals = {"added": 0, "rotated": 0, "removed": 0, "unchanged": 0}
+    lock = threading.Lock()
+
+    def reconcile(repo_name, desired):
+        obj = f"repo:{repo_name}"
+        pin(token, repo_name)
+        repo = gh.get_repo(f"{args.owner}/{repo_name}", lazy=True)
+        def _existing():
+            keys = []
+            for k in repo.get_keys():
+                ek = {"id": k.id, "title": k.title, "read_only": k.read_only, "handle": k}
+                ek["key"], ek["fp"] = parse_pubkey(k.key)
+                keys.append(ek)
+            return keys
+        # journaled so a missing/inaccessible repo fails alone (and --continue-on-error goes on)
+        existing = journal.step(obj, "list_keys", _existing)
+        if existing is None:
+            if not journal.done(obj, "list_keys"):
+                return  # the listing failed; recorded in the journal
+            existing = _existing()  # listed in the run being resumed; keys may have changed since
+        counts = dict.fromkeys(totals, 0)
+        for op, it, old in plan_repo(desired, existing, prune=args.prune):
+            if op == "unchanged":
+                counts["unchanged"] += 1
+                print(f"SKIP: deploy key '{it['title']}' on {repo_name} unchanged ({it['fp']})")
+                METRICS.count("deploy_key", "unchanged", org=args.owner)
+            elif op == "add":
+                if journal.step(obj, f"deploy_key:{it['title']}", repo.create_key, title=it["title"], key=it["key"], read_only=it["read_only"]):
+                    counts["added"] += 1
+                    print(f"OK: deploy key '{it['title']}' added to {repo_name} ({it['fp']})")
+            elif op == "rotate":
+                def _rotate(it=it, old=old):
+                    if old["fp"] == it["fp"]:
+                        old["handle"].delete()  # same key, new read_only: GitHub refuses a duplicate, so remove first
+                        repo.create_key(title=it["title"], key=it["key"], read_only=it["read_only"])
+                    else:
+                        repo.create_key(title=it["title"], key=it["key"], read_only=it["read_only"])
+                        old["handle"].delete()
+                    return True
+                if journal.step(obj, f"deploy_key:{it['title']}:{it['fp']}", _rotate):
+                    counts["rotated"] += 1
+                    change = f"read_only -> {it['read_only']}" if old["fp"] == it["fp"] else f"{old['fp']} -> {it['fp']}"
+                    print(f"OK: deploy key '{it['title']}' rotated on {repo_name} ({change})")
+            elif op == "remove":
+                def _remove(old=old):
+                    old["handle"].delete()
+                    return True
+                if journal.step(obj, f"deploy_key_remove:{old['fp']}", _remove):
+                    counts["removed"] += 1
+                    print(f"OK: deploy key '{old['title']}' removed from {repo_name} ({old['fp']})")
+        with lock:
+            for k, v in counts.items():
+                totals[k] += v
+
+    with ContextPool(max(1, args.workers), thread_name_prefix="deploy-keys") as pool:
+        futures = [pool.submit(reconcile, name, desired) for name, desired in deploy.items()]
+        try:
+            for f in as_completed(futures):
+                f.result()
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            raise
+
+    print("SUMMARY: deploy keys " + " ".join(f"{k}={v}" for k, v in totals.items()))
+    return journal.finish()
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -1,51 +1,164 @@
 #!/usr/bin/env python3
 import argparse, sys
-from _common import load_yaml, get_token, gh_client
+from concurrent.futures import as_completed
+from _common import load_yaml, get_token, gh_client, gh_http, paginate, ObjectCache, ContextPool
+from _journal import RunJournal, add_journal_args
+from _graphql import MutationBatch, MAX_MUTATIONS, repo_nodes, journal_results
+from _orgs import add_org_args, multi_org, fan_out
+from _snapshot import Snapshot
+from _metrics import METRICS
 from github.GithubException import GithubException
 
-def main():
+API = "https://api.github.com"
+H = {"Accept": "application/vnd.github+json", "X-GitHub-Api-Version": "2022-11-28"}
+def _h(tok): return {"Authorization": f"Bearer {tok}", **H}
+
+# REST permission -> GraphQL RepositoryPermission; custom roles stay on REST
+GQL_PERMS = {"pull": "READ", "triage": "TRIAGE", "push": "WRITE", "maintain": "MAINTAIN", "admin": "ADMIN"}
+# role_name in GET /teams/{slug}/repos -> REST permission
+ROLE_PERMS = {"read": "pull", "triage": "triage", "write": "push", "maintain": "maintain", "admin": "admin"}
+
+# ---------- permission matrix ----------
+def current_permission(grant):
+    """Config-style permission from a team repo listing entry (or a snapshot team_repo row)."""
+    role = grant.get("role_name")
+    if role:
+        return ROLE_PERMS.get(role, role)  # anything else is a custom repository role
+    if isinstance(grant.get("permission"), str):
+        return grant["permission"]
+    flags = grant.get("permissions") or {}
+    return next((p for p in ("admin", "maintain", "push", "triage", "pull") if flags.get(p)), "pull")
+
+def compile_matrix(cfg):
+    """{(team, repo): permission} from the teams config."""
+    return {(t["name"], r["name"]): r.get("permission", "pull") for t in cfg.get("teams", []) for r in t.get("repos", [])}
+
+def current_matrix(owner, slugs, tok, workers):
+    """{(team, repo): permission} now: one paginated listing per team, teams fetched in parallel."""
+    def one(slug):
+        return slug, [(r["name"], current_permission(r)) for r in paginate(f"{API}/orgs/{owner}/teams/{slug}/repos", tok, allow_404=True)]
+    with ContextPool(max(1, workers), thread_name_prefix="team-repos") as pool:
+        return {(slug, repo): perm for slug, items in pool.map(one, sorted(slugs)) for repo, perm in items}
+
+def plan_matrix(want, have, revoke=False):
+    """
+    The calls that turn `have` into `want`, as sorted [(team, repo, permission)]
+    lists: grants (no access yet), changes (other permission) and, with revoke,
+    revokes (access the config does not list). `have` must only hold managed teams.
+    """
+    grants = [(t, r, p) for (t, r), p in sorted(want.items()) if (t, r) not in have]
+    changes = [(t, r, p) for (t, r), p in sorted(want.items()) if (t, r) in have and have[t, r] != p]
+    revokes = [(t, r, p) for (t, r), p in sorted(have.items()) if (t, r) not in want] if revoke else []
+    return grants, changes, revokes
+
+def _set_repo(owner, team, repo, perm, tok):
+    r = gh_http.put(f"{API}/orgs/{owner}/teams/{team}/repos/{owner}/{repo}", headers=_h(tok), json={"permission": perm})
+    if r.status_code not in (200, 204):
+        raise SystemExit(f"Team repo permission failed {team} -> {repo} ({perm}): {r.status_code} {r.text}")
+    print(f"OK: {team} -> {repo} ({perm})")
+
+def _revoke_repo(owner, team, repo, tok):
+    r = gh_http.delete(f"{API}/orgs/{owner}/teams/{team}/repos/{owner}/{repo}", headers=_h(tok))
+    if r.status_code not in (204, 404):
+        raise SystemExit(f"Team repo revoke failed {team} -> {repo}: {r.status_code} {r.text}")
+    print(f"OK: revoked {team} access to {repo}")
+
+def grant_repos(owner, grants, tok, journal, batch_size):
+    """
+    grants: {(repo, perm): [(team, team_node_id, obj, action)]}. One
+    updateTeamsRepository per repo/permission covers all its teams, and the
+    mutations go out batched; each team's grant is journaled separately.
+    """
+    nodes = repo_nodes(tok, owner, {repo for repo, _ in grants})
+    batch, steps = MutationBatch(tok, batch_size), []
+    for (repo, perm), teams in sorted(grants.items()):
+        key = f"{repo}:{perm}"
+        if nodes.get(repo) is None:
+            batch.fail(key, f"repo {repo} not found")
+        else:
+            batch.add(key, "updateTeamsRepository", "UpdateTeamsRepositoryInput",
+                      {"repositoryId": nodes[repo]["id"], "teamIds": [t[1] for t in teams], "permission": GQL_PERMS[perm]})
+        steps += [(obj, action, key, f"OK: {team} -> {repo} ({perm})") for team, _, obj, action in teams]
+    batch.run()
+    journal_results(journal, batch, steps)
+
+def main(args=None):
     ap = argparse.ArgumentParser()
-    ap.add_argument("--owner", required=True)
+    ap.add_argument("--owner", help="Org login, or several comma-separated to reconcile them concurrently")
     ap.add_argument("--config", default="src/config/teams.yaml")
     ap.add_argument("--ssm-token", default="insizon-github-admin-token")
     ap.add_argument("--region", default="us-east-2")
     ap.add_argument("--dry-run", action="store_true")
     ap.add_argument("--profile", default=None)
-    args = ap.parse_args()
+    ap.add_argument("--only", action="append", default=None, metavar="NAME", help="Reconcile only these teams (repeatable)")
+    ap.add_argument("--graphql-batch", type=int, default=MAX_MUTATIONS, help="Repo permission updates per GraphQL request")
+    ap.add_argument("--workers", type=int, default=8, help="Team repo listings and REST permission writes in parallel")
+    ap.add_argument("--revoke-unlisted", action="store_true", help="Also revoke repo access a managed team has but the config does not list")
+    ap.add_argument("--snapshot", nargs="?", const="auto", default=None, metavar="DB",
+                    help="With --dry-run: plan against a local snapshot (snapshot.py refresh) instead of printing every step")
+    add_journal_args(ap)
+    add_org_args(ap)
+    args = args or ap.parse_args()
+    if multi_org(args):
+        return fan_out("teams", main, args)
 
     cfg = load_yaml(args.config)
+    if args.only:
+        cfg["teams"] = [x for x in cfg.get("teams", []) if x["name"] in args.only or x.get("rename_from") in args.only]
+    want = compile_matrix(cfg)
 
     if args.dry_run:
+        snap = Snapshot.open(args.owner, args.state_dir, args.snapshot) if args.snapshot else None
+        have = {}
         for t in cfg.get("teams", []):
             name = t["name"]
-            print(f"DRY: create team {name}")
+            exists = snap is not None and snap.team(name) is not None
+            members = snap.children("team_member", name) if exists else {}
+            if exists:
+                have.update({(name, r): current_permission(g) for r, g in snap.children("team_repo", name).items()})
+            else:
+                print(f"DRY: create team {name}")
             for m in t.get("maintainers", []):
-                print(f"DRY: set {m} as maintainer in {name}")
+                if (members.get(m) or {}).get("role") != "maintainer":
+                    print(f"DRY: set {m} as maintainer in {name}")
             for m in t.get("members", []):
-                print(f"DRY: add {m} as member in {name}")
-            for r in t.get("repos", []):
-                print(f"DRY: grant {r.get('permission','pull')} on {r['name']} to {name}")
+                if m not in members:
+                    print(f"DRY: add {m} as member in {name}")
+        grants, changes, revokes = plan_matrix(want, have, revoke=snap is not None and args.revoke_unlisted)
+        for team, repo, perm in grants:
+            print(f"DRY: grant {perm} on {repo} to {team}")
+        for team, repo, perm in changes:
+            print(f"DRY: change {team} on {repo} {have[team, repo]} -> {perm}")
+        for team, repo, perm in revokes:
+            print(f"DRY: revoke {team} access to {repo} ({perm})")
+        if args.revoke_unlisted and snap is None:
+            print("DRY: revokes not evaluated (needs --snapshot to know current access)")
         sys.exit(0)
 
-    token = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=False)
+    token = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=False, owner=args.owner)
     gh, org = gh_client(args.owner, token)
+    cache = ObjectCache(gh, org)
+    journal = RunJournal.from_args("teams", args)
 
+    teams, created = {}, set()
     for t in cfg.get("teams", []):
         name = t["name"]
-        try:
-            team = org.get_team_by_slug(name)
-        except Exception:
-            team = None
+        obj = f"team:{name}"
+        team = cache.team(name)
 
         if not team:
-            team = org.create_team(name, privacy=t.get("privacy","closed"))
+            team = journal.step(obj, "create", org.create_team, name, privacy=t.get("privacy","closed"))
+            if team is None:
+                continue
+            cache.put("team", name, team)
+            created.add(name)
             print(f"OK: team created {name}")
+        teams[name] = team
 
         # Maintainers
         for m in t.get("maintainers", []):
             try:
-                user_obj = gh.get_user(m)
-                team.add_membership(user_obj, role="maintainer")
+                team.add_membership(cache.user_handle(m), role="maintainer")
                 print(f"OK: {m} set as maintainer in {name}")
             except GithubException as e:
                 print(f"WARN: maintainer add failed {m} -> {name}: {e.data if hasattr(e,'data') else e}")
@@ -55,25 +168,50 @@ def main():
         # Members
         for m in t.get("members", []):
             try:
-                user_obj = gh.get_user(m)
-                team.add_membership(user_obj, role="member")
+                team.add_membership(cache.user_handle(m), role="member")
                 print(f"OK: {m} added to {name}")
             except GithubException as e:
                 print(f"WARN: member add failed {m} -> {name}: {e.data if hasattr(e,'data') else e}")
             except AssertionError:
                 print(f"WARN: PyGithub expected a user object for member {m}")
 
-        # Repo permissions
-        for r in t.get("repos", []):
-            repo = org.get_repo(r["name"])
-            perm = r.get("permission","pull")
-            try:
-                # attach then set permission (idempotent)
-                team.add_to_repos(repo)
-            except Exception:
-                pass
-            team.update_team_repository(repo, permission=perm)
-            print(f"OK: {name} -> {repo.name} ({perm})")
+    # Repo permissions: config matrix vs. what the teams hold now, minimal writes only
+    want = {k: p for k, p in want.items() if k[0] in teams}
+    with METRICS.stage("team_repos_fetch"):
+        have = current_matrix(args.owner, set(teams) - created, token, args.workers)
+    grants, changes, revokes = plan_matrix(want, have, revoke=args.revoke_unlisted)
+    unchanged = len(want) - len(grants) - len(changes)
+    if unchanged:
+        print(f"SKIP: {unchanged} team repo permissions unchanged")
+        METRICS.count("team", "unchanged", unchanged)
+
+    gql, rest = {}, []
+    for team, repo, perm in grants + changes:
+        obj, action = f"team:{team}", f"repo:{repo}:{perm}"
+        if journal.done(obj, action):
+            continue
+        if perm in GQL_PERMS:  # built-in roles: batched through GraphQL below
+            gql.setdefault((repo, perm), []).append((team, teams[team].node_id, obj, action))
+        else:  # custom roles: one PUT sets (or adds) the permission
+            rest.append((obj, action, _set_repo, (args.owner, team, repo, perm, token)))
+    for team, repo, _ in revokes:
+        rest.append((f"team:{team}", f"revoke:{repo}", _revoke_repo, (args.owner, team, repo, token)))
+
+    with ContextPool(max(1, args.workers), thread_name_prefix="team-repos") as pool:
+        futures = [pool.submit(journal.step, obj, action, fn, *a) for obj, action, fn, a in rest]
+        try:
+            if gql:
+                with METRICS.stage("grants_batch"):
+                    grant_repos(args.owner, gql, token, journal, args.graphql_batch)
+            for f in as_completed(futures):
+                f.result()
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            raise
+    print(f"SUMMARY: team repos granted={len(grants)} changed={len(changes)} revoked={len(revokes)} unchanged={unchanged}")
+
+    return journal.finish()
 
 if __name__ == "__main__":
     sys.exit(main())
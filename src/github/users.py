@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
-import argparse, sys, requests
-from _common import load_yaml, get_token, gh_client
+import argparse, sys
+from _common import load_yaml, get_token, gh_client, gh_http, ObjectCache
+from _journal import RunJournal, StepSkipped, add_journal_args
+from _orgs import add_org_args, multi_org, fan_out
 from github.GithubException import GithubException
 
 API = "https://api.github.com"
@@ -22,22 +24,26 @@ def invite_user_rest(org_login, token, invitee_id=None, email=None, role="direct
     if email:
         payload["email"] = email
 
-    r = requests.post(url, headers=_h(token), json=payload)
+    r = gh_http.post(url, headers=_h(token), json=payload)
     if r.status_code == 201:
         return True, "invited"
     if r.status_code == 422:
         return False, f"already invited/member ({r.text.strip()})"
-    return False, f"{r.status_code} {r.text}"
+    raise SystemExit(f"Invite failed: {r.status_code} {r.text}")
 
-def main():
+def main(args=None):
     ap = argparse.ArgumentParser()
-    ap.add_argument("--owner", required=True)
+    ap.add_argument("--owner", help="Org login, or several comma-separated to reconcile them concurrently")
     ap.add_argument("--config", default="src/config/users.yaml")
     ap.add_argument("--ssm-token", default="insizon-github-admin-token")
     ap.add_argument("--region", default="us-east-2")
     ap.add_argument("--dry-run", action="store_true")
     ap.add_argument("--profile", default=None)
-    args = ap.parse_args()
+    add_journal_args(ap)
+    add_org_args(ap)
+    args = args or ap.parse_args()
+    if multi_org(args):
+        return fan_out("users", main, args)
 
     cfg = load_yaml(args.config)
 
@@ -53,8 +59,10 @@ def main():
                 print(f"INFO: email-only invite; re-run after acceptance to add to teams: {u['teams']}")
         sys.exit(0)
 
-    token = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=False)
+    token = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=False, owner=args.owner)
     gh, org = gh_client(args.owner, token)
+    cache = ObjectCache(gh, org)
+    journal = RunJournal.from_args("users", args)
 
     # normalize role values from YAML → GitHub API expected values
     role_map = {
@@ -76,37 +84,43 @@ def main():
         user_obj = None
         if username:
             try:
-                user_obj = gh.get_user(username)
-                invitee_id = user_obj.id
+                user_obj = cache.user(username)
+                if user_obj is None:
+                    print(f"WARN: could not resolve username {username}: not found. Will try email if provided.")
+                else:
+                    invitee_id = user_obj.id
             except GithubException as e:
                 print(f"WARN: could not resolve username {username}: {e.data if hasattr(e,'data') else e}. Will try email if provided.")
 
-        ok, msg = invite_user_rest(org.login, token, invitee_id=invitee_id, email=email, role=role)
         target = username or email
-        if ok:
-            print(f"OK: invitation sent to {target}")
-        else:
-            print(f"INFO: invite for {target}: {msg}")
+        res = journal.step(f"user:{target}", "invite", invite_user_rest, org.login, token, invitee_id=invitee_id, email=email, role=role)
+        if res:
+            ok, msg = res
+            if ok:
+                print(f"OK: invitation sent to {target}")
+            else:
+                print(f"INFO: invite for {target}: {msg}")
 
         # Add to teams only when we have a username (best-effort; may fail until they accept)
         if username and team_slugs:
-            if user_obj is None:
-                try:
-                    user_obj = gh.get_user(username)
-                except GithubException:
-                    user_obj = None
             for tslug in team_slugs:
-                try:
-                    team = org.get_team_by_slug(tslug)
-                    if user_obj:
-                        team.add_membership(user_obj)  # defaults to member
-                        print(f"OK: added {username} to team {tslug}")
-                    else:
-                        print(f"INFO: cannot add {username} to {tslug} yet (no user object). Re-run after acceptance.")
-                except GithubException as e:
-                    print(f"INFO: add to team queued/failed for {username} -> {tslug}: {e.data if hasattr(e,'data') else e}")
+                if not user_obj:
+                    print(f"INFO: cannot add {username} to {tslug} yet (no user object). Re-run after acceptance.")
+                    continue
+                def _add(tslug=tslug):
+                    try:
+                        cache.team_handle(tslug).add_membership(user_obj)  # defaults to member
+                    except GithubException as e:
+                        # not journaled as ok, so --resume retries it
+                        msg = f"add to team queued/failed for {username} -> {tslug}: {e.data if hasattr(e,'data') else e}"
+                        print(f"INFO: {msg}")
+                        raise StepSkipped(msg)
+                    print(f"OK: added {username} to team {tslug}")
+                journal.step(f"team:{tslug}", f"member:{username}", _add)
         elif team_slugs and not username:
             print(f"INFO: email-only invite; re-run users.py after acceptance to add to teams: {team_slugs}")
 
+    return journal.finish()
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Org webhook receiver: turns deliveries into targeted reconcile jobs.
+
+  repository / branch_protection_rule / repository_ruleset / member -> repos.py --only <repo>
+  team / membership                                                  -> teams.py --only <team>
+
+Deliveries are verified against the webhook secret (X-Hub-Signature-256),
+debounced per object, and drained by a single worker that batches all due
+objects of a kind into one reconcile invocation. Only objects present in the
+YAML configs are reconciled; events sent by the automation identity itself
+are ignored so our own writes do not loop back.
+
+Replay recorded deliveries locally (no network, nothing executed with --dry-run):
+  webhook.py --owner X --replay path/to/deliveries --dry-run
+Each replay file is JSON: {"event": "<X-GitHub-Event>", "payload": {...}}, or
+{"event": ..., "body": "<raw delivery body>", "signature": "sha256=..."} in which
+case the signature is verified against the raw body as the server would.
+"""
+import argparse, sys, os, json, hmac, hashlib, time, threading, glob
+from _common import load_yaml, get_token, token_env, automation_logins
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from _reconcile import managed_objects, make_runner
+from org import _resolve_value
+
+def verify_signature(secret, body, header):
+    if not header or not header.startswith("sha256="):
+        return False
+    mac = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(f"sha256={mac}", header)
+
+def jobs_for_event(event, payload):
+    """Map one delivery to the (kind, name) objects it may have drifted."""
+    repo = (payload.get("repository") or {}).get("name")
+    team = (payload.get("team") or {}).get("slug")
+    if event in ("repository", "branch_protection_rule", "repository_ruleset", "member"):
+        return [("repo", repo)] if repo else []
+    if event in ("team", "membership"):
+        return [("team", team)] if team else []
+    return []
+
+class Debouncer:
+    """Per-key debounce in front of a single worker; each event pushes its key's deadline out."""
+    def __init__(self, delay, run):
+        self.delay = delay
+        self.run = run
+        self.pending = {}
+        self.cv = threading.Condition()
+
+    def submit(self, key):
+        with self.cv:
+            self.pending[key] = time.monotonic() + self.delay
+            self.cv.notify()
+
+    def _take_due(self, force=False):
+        now = time.monotonic()
+        due = [k for k, t in self.pending.items() if force or t <= now]
+        for k in due:
+            del self.pending[k]
+        return due
+
+    def _dispatch(self, keys):
+        by_kind = {}
+        for kind, name in keys:
+            by_kind.setdefault(kind, []).append(name)
+        for kind, names in sorted(by_kind.items()):
+            try:
+                self.run(kind, sorted(names))
+            except Exception as e:
+                print(f"WARN: reconcile {kind} {names} failed: {e}")
+
+    def worker(self):
+        while True:
+            with self.cv:
+                while not self.pending:
+                    self.cv.wait()
+                wait = min(self.pending.values()) - time.monotonic()
+                if wait > 0:
+                    self.cv.wait(wait)
+                    continue
+                keys = self._take_due()
+            self._dispatch(keys)
+
+    def drain(self):
+        with self.cv:
+            keys = self._take_due(force=True)
+        self._dispatch(keys)
+
+class Receiver:
+    def __init__(self, args, managed, secret, ignore_sender, queue):
+        self.args = args
+        self.managed = managed
+        self.secret = secret
+        self.ignore_sender = ignore_sender
+        self.queue = queue
+
+    def handle(self, event, payload):
+        sender = (payload.get("sender") or {}).get("login")
+        if sender in self.ignore_sender:
+            print(f"SKIP: {event} from {sender} (automation identity)")
+            return
+        for kind, name in jobs_for_event(event, payload):
+            if name not in self.managed[kind]:
+                print(f"SKIP: {event} on unmanaged {kind} {name}")
+                continue
+            print(f"QUEUE: {event}/{payload.get('action', '-')} -> {kind} {name}")
+            self.queue.submit((kind, name))
+
+def _handler(receiver):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if receiver.secret is not None and not verify_signature(receiver.secret, body, self.headers.get("X-Hub-Signature-256")):
+                self.send_response(401); self.end_headers()
+                print("WARN: rejected delivery with bad signature")
+                return
+            event = self.headers.get("X-GitHub-Event", "")
+            try:
+                payload = json.loads(body or b"{}")
+            except ValueError:
+                self.send_response(400); self.end_headers()
+                return
+            self.send_response(202); self.end_headers()
+            if event != "ping":
+                receiver.handle(event, payload)
+
+        def log_message(self, fmt, *a):
+            pass  # deliveries are logged by Receiver.handle
+    return Handler
+
+def replay(receiver, paths):
+    files = []
+    for p in paths:
+        files += sorted(glob.glob(os.path.join(p, "*.json"))) if os.path.isdir(p) else [p]
+    for fp in files:
+        with open(fp, "rb") as f:
+            raw = f.read()
+        rec = json.loads(raw)
+        if "body" in rec:
+            body = rec["body"].encode("utf-8")
+            if receiver.secret is not None and not verify_signature(receiver.secret, body, rec.get("signature")):
+                print(f"WARN: {fp}: bad signature, skipped")
+                continue
+            payload = json.loads(body)
+        else:
+            payload = rec["payload"]
+        receiver.handle(rec["event"], payload)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--owner", required=True)
+    ap.add_argument("--repos", default="src/config/repos.yaml")
+    ap.add_argument("--teams", default="src/config/teams.yaml")
+    ap.add_argument("--secrets", default="src/config/secrets.yaml", help="org_webhooks[].secret is used when --secret is not given")
+    ap.add_argument("--secret", default=None, help="Webhook secret ref (literal:/file:/ssm:)")
+    ap.add_argument("--listen", default="127.0.0.1:8787")
+    ap.add_argument("--debounce", type=float, default=5.0, help="Seconds of quiet before an object is reconciled")
+    ap.add_argument("--replay", nargs="+", default=None, help="Recorded delivery files/dirs to process instead of listening")
+    ap.add_argument("--ignore-sender", default=None, help="Login whose events are ignored (default: the token's user(s))")
+    ap.add_argument("--ssm-token", default="insizon-github-admin-token")
+    ap.add_argument("--region", default="us-east-2")
+    ap.add_argument("--profile", default=None)
+    ap.add_argument("--dry-run", action="store_true", help="Print reconcile jobs instead of running them")
+    args = ap.parse_args()
+
+    managed = managed_objects(load_yaml(args.repos), load_yaml(args.teams))
+
+    ref = args.secret
+    if ref is None:
+        hooks = (load_yaml(args.secrets) or {}).get("org_webhooks") or []
+        ref = next((h["secret"] for h in hooks if h.get("secret")), None)
+    # listening always needs the secret (dry listen included); a dry replay only
+    # resolves an explicitly given one, since config refs may point at SSM
+    secret = _resolve_value(ref, args.region, args.profile) if ref and (args.secret or not args.dry_run or not args.replay) else None
+    if secret is None and not args.replay:
+        raise SystemExit("ERROR: a webhook secret is required to listen (--secret or org_webhooks[].secret)")
+
+    env = dict(os.environ)
+    ignore = {args.ignore_sender} if args.ignore_sender else set()
+    if not args.dry_run:
+        tok = get_token(args.ssm_token, region=args.region, profile=args.profile, dry_run=False, owner=args.owner)
+        env.update(token_env(tok))  # resolve once; child reconciles skip SSM
+        if not args.ignore_sender:
+            ignore = automation_logins(tok)
+
+    queue = Debouncer(0 if args.replay else args.debounce, make_runner(args, env))
+    receiver = Receiver(args, managed, secret, ignore, queue)
+
+    if args.replay:
+        replay(receiver, args.replay)
+        queue.drain()
+        return 0
+
+    threading.Thread(target=queue.worker, daemon=True).start()
+    host, port = args.listen.rsplit(":", 1)
+    srv = ThreadingHTTPServer((host, int(port)), _handler(receiver))
+    print(f"LISTEN: http://{host}:{port} (debounce {args.debounce}s, ignoring sender {', '.join(sorted(ignore)) or '-'})")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
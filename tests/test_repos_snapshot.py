@@ -0,0 +1,48 @@
+import io, os, sys, tempfile, unittest
+from contextlib import redirect_stdout
+
+# the modules are scripts importing their siblings by bare name; appended so stdlib/PyGithub names win
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src", "github"))
+import _common  # noqa: F401  (before repos, which pulls in the rest)
+from _snapshot import Snapshot
+from repos import plan_from_snapshot
+
+class PlanFromSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.snap = Snapshot(os.path.join(self.dir.name, "o.sqlite"))
+        self.snap.replace("repo", "", {"r": {"name": "r", "default_branch": "dev", "topics": []}})
+        self.snap.replace("branch", "r", {"dev": {"name": "dev", "protected": False}})
+        self.snap.replace("environment", "r", {"dev": {"name": "dev"}})
+
+    def tearDown(self):
+        self.snap.close()
+        self.dir.cleanup()
+
+    def plan(self, spec, covered=()):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            plan_from_snapshot(self.snap, spec, covered=dict.fromkeys(covered, "auto-dev"))
+        return out.getvalue().splitlines()
+
+    def test_plain_string_environments(self):
+        lines = self.plan({"name": "r", "default_branch": "dev", "environments": ["dev", "prod"]})
+        self.assertIn("DRY: update environment dev", lines)
+        self.assertIn("DRY: create environment prod", lines)
+        self.assertIn("DRY: create branch prod", lines)
+
+    def test_mapping_environments(self):
+        lines = self.plan({"name": "r", "default_branch": "dev", "environments": [{"name": "prod", "branch": False}]})
+        self.assertIn("DRY: create environment prod", lines)
+        self.assertNotIn("DRY: create branch prod", lines)
+
+    def test_covered_protection_is_removed(self):
+        self.snap.replace("protection", "r", {"dev": {}})
+        spec = {"name": "r", "default_branch": "dev", "protected_branches": [{"name": "dev"}]}
+        self.assertIn("DRY: update protection on r@dev", self.plan(spec))
+        lines = self.plan(spec, covered=[("r", "protect", "dev")])
+        self.assertIn("DRY: remove classic protection on r@dev (superseded by org ruleset)", lines)
+        self.assertNotIn("DRY: update protection on r@dev", lines)
+
+if __name__ == "__main__":
+    unittest.main()